@@ -0,0 +1,92 @@
+"""
+Asyncio facade over the blocking API helpers, for the paths that only orchestrate requests.
+
+The cloudcix clients are synchronous, so each request runs on a thread of a bounded executor while the event loop
+waits on it. A semaphore caps the number of requests in flight at API_ASYNC_CONCURRENCY, so a healthcheck or scrub
+that finds hundreds of objects does not flood the API. Listings fetch their pages one at a time so each one only holds
+a single request in flight. Requests still go through utils and api_call, so they keep the cache, retries and circuit
+breaker of the blocking path.
+
+Usage:
+    async def check(api: AsyncAPI):
+        vms, virtual_routers = await asyncio.gather(api.list(IAAS.vm, params), api.list(IAAS.virtual_router, params))
+
+    AsyncAPI.run(check)
+"""
+# stdlib
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+# lib
+from cloudcix.client import Client
+from requests import Response
+# local
+import api_call
+import settings
+import utils
+
+__all__ = [
+    'AsyncAPI',
+]
+
+T = TypeVar('T')
+
+
+class AsyncAPI:
+    """
+    Runs the blocking API helpers on a bounded executor and exposes them as coroutines
+    """
+
+    def __init__(self, concurrency: Optional[int] = None):
+        """
+        :param concurrency: The maximum number of requests in flight. Defaults to settings.API_ASYNC_CONCURRENCY
+        """
+        self.concurrency = concurrency or settings.API_ASYNC_CONCURRENCY
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        # Created inside the running loop, semaphores bind to the loop they are first used in
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @classmethod
+    def run(cls, main: Callable[['AsyncAPI'], Awaitable[T]], concurrency: Optional[int] = None) -> T:
+        """
+        Run a coroutine function to completion with a new facade, from synchronous code
+        :param main: The coroutine function to run, it is passed the facade
+        :param concurrency: The maximum number of requests in flight
+        :returns: The result of the coroutine
+        """
+        api = cls(concurrency)
+        try:
+            return asyncio.run(main(api))
+        finally:
+            api._executor.shutdown(wait=True)
+
+    async def submit(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Run any blocking function on the executor, counted against the concurrency limit
+        The function counts as one request, so it should only send one request at a time
+        :param fn: The function to run
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def list(self, client: Client, params: Dict[str, Any], **kwargs) -> Deque[Dict[str, Any]]:
+        """
+        utils.api_list as a coroutine, fetching one page at a time so the listing counts as one request in flight
+        """
+        return await self.submit(utils.api_list, client, params, workers=1, **kwargs)
+
+    async def read(self, client: Client, pk: int, **kwargs) -> Dict[str, Any]:
+        """
+        utils.api_read as a coroutine
+        """
+        return await self.submit(utils.api_read, client, pk, **kwargs)
+
+    async def call(self, client: Client, method: str, **kwargs) -> Response:
+        """
+        api_call.call as a coroutine
+        """
+        return await self.submit(api_call.call, client, method, **kwargs)
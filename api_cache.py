@@ -0,0 +1,133 @@
+"""
+Read-through cache for API objects, kept per worker process.
+
+utils.api_read and utils.api_list check the cache before making a request for clients that have a TTL configured, so
+the tasks running in a worker do not keep re-reading the same Server records. Entries expire after the TTL of their
+client, the least recently used entries are evicted once the cache is full, and any update made through
+utils.api_partial_update drops the cached entries of its client straight away.
+
+Objects whose state the tasks check before acting on them, such as VMs and Virtual Routers, are not cached. Other
+workers change their state, and invalidation only reaches the cache of the worker that made the update.
+"""
+# stdlib
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+# lib
+from cloudcix.api.iaas import IAAS
+from cloudcix.client import Client
+# local
+import settings
+
+__all__ = [
+    'clear',
+    'get',
+    'invalidate',
+    'key_for',
+    'put',
+    'stats',
+]
+
+Key = Tuple[str, Hashable]
+
+_entries: 'OrderedDict[Key, Tuple[float, Any]]' = OrderedDict()
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+
+def _client_name(client: Client) -> str:
+    return f'{client.application}.{client.service_uri}'
+
+
+# Seconds that the records of each client are cached for, keyed by client name. Clients not listed are not cached
+TTLS: Dict[str, int] = {
+    _client_name(IAAS.server): settings.API_CACHE_SERVER_TTL,
+}
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def key_for(client: Client, request: Any) -> Optional[Key]:
+    """
+    Generate the cache key for a request
+    :param client: The client the request is made with
+    :param request: The pk of a read, or the params of a list
+    :returns: The key, or None if the records of the client are not cached
+    """
+    name = _client_name(client)
+    if TTLS.get(name, 0) <= 0:
+        return None
+    return name, _freeze(request)
+
+
+def get(key: Key) -> Optional[Any]:
+    """
+    Fetch a copy of the cached value for the key, if there is a live entry
+    :param key: The key generated by key_for
+    """
+    global _hits, _misses
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry[0] <= now:
+            _entries.pop(key, None)
+            _misses += 1
+            return None
+        _entries.move_to_end(key)
+        _hits += 1
+        value = entry[1]
+    # Callers modify the records they get back, so never hand out the cached instance
+    return copy.deepcopy(value)
+
+
+def put(key: Key, value: Any):
+    """
+    Store a copy of the value in the cache, evicting the least recently used entries if the cache is full
+    :param key: The key generated by key_for
+    :param value: The record or list of records returned by the API
+    """
+    expires = time.monotonic() + TTLS[key[0]]
+    value = copy.deepcopy(value)
+    with _lock:
+        _entries[key] = (expires, value)
+        _entries.move_to_end(key)
+        while len(_entries) > settings.API_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def invalidate(client: Client, pk: int):
+    """
+    Drop the cached read of a record that has changed, along with every cached list of its client
+    :param client: The client of the record that was updated
+    :param pk: The id of the record that was updated
+    """
+    name = _client_name(client)
+    with _lock:
+        # Read keys hold the pk itself, list keys hold the frozen params
+        stale = [key for key in _entries if key[0] == name and (key[1] == pk or isinstance(key[1], tuple))]
+        for key in stale:
+            del _entries[key]
+
+
+def clear():
+    """
+    Drop every entry in the cache
+    """
+    with _lock:
+        _entries.clear()
+
+
+def stats() -> Tuple[int, int]:
+    """
+    :returns: The number of cache hits and misses since the worker started
+    """
+    return _hits, _misses
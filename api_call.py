@@ -0,0 +1,168 @@
+"""
+Resilient call layer around the cloudcix API clients.
+
+Every request made through call() gets:
+    - a single renewal and retry when the token has expired
+    - bounded retries with jittered exponential backoff for 5xx responses and connection errors, for the idempotent
+      methods in IDEMPOTENT_METHODS only. A create that timed out or failed with a 5xx may still have been applied, so
+      it is sent once and the caller decides what to do with the failure
+    - a circuit breaker per application that opens after API_BREAKER_THRESHOLD consecutive failures, so a degraded
+      API is not hammered by every worker at once. While it is open, requests fail immediately with a 503 response
+      until API_BREAKER_COOLDOWN seconds have passed and a single trial request is let through
+    - a latency and status metric per endpoint
+"""
+# stdlib
+import logging
+import random
+import threading
+import time
+from typing import Dict
+# lib
+import requests
+from cloudcix.client import Client
+# local
+import metrics
+import settings
+from cloudcix_token import Token
+
+__all__ = [
+    'call',
+    'CircuitBreaker',
+    'IDEMPOTENT_METHODS',
+]
+
+LOGGER = logging.getLogger('robot.api_call')
+
+# Client methods that can be sent again without changing the outcome, so are safe to retry
+IDEMPOTENT_METHODS = frozenset({'list', 'read', 'update', 'partial_update'})
+
+
+class CircuitBreaker:
+    """
+    Tracks the consecutive failures of an application and decides whether requests may be sent to it
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        """
+        :param threshold: The number of consecutive failures that opens the circuit
+        :param cooldown: The number of seconds the circuit stays open before a trial request is let through
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Check whether a request may be sent. Once the cooldown has passed, one caller is let through as a trial and
+        the cooldown restarts for everyone else
+        """
+        with self._lock:
+            if self.failures < self.threshold:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def success(self):
+        """
+        Record a successful request, closing the circuit
+        """
+        with self._lock:
+            self.failures = 0
+
+    def failure(self):
+        """
+        Record a failed request, opening the circuit once the threshold is reached
+        """
+        with self._lock:
+            self.failures += 1
+            if self.failures == self.threshold:
+                LOGGER.warning(f'Circuit opened after {self.failures} consecutive failed requests.')
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def _breaker(application: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if application not in _breakers:
+            _breakers[application] = CircuitBreaker(settings.API_BREAKER_THRESHOLD, settings.API_BREAKER_COOLDOWN)
+        return _breakers[application]
+
+
+def _circuit_open_response(endpoint: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 503
+    response._content = f'{{"detail": "Circuit open for {endpoint}, request not sent."}}'.encode()
+    return response
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter, so workers that failed together do not retry together
+    return random.uniform(0, min(settings.API_RETRY_BACKOFF * 2 ** attempt, settings.API_RETRY_BACKOFF_MAX))
+
+
+def _token_expired(response: requests.Response) -> bool:
+    if response.status_code != 401:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    if not isinstance(body, dict):
+        return False
+    return 'token is expired' in str(body.get('detail', ''))
+
+
+def call(client: Client, method: str, **kwargs) -> requests.Response:
+    """
+    Send a request with the given client method, retrying idempotent methods and renewing the token as needed
+    :param client: The client to make the request with
+    :param method: The name of the client method, e.g. list, read, create or partial_update
+    :param kwargs: The kwargs for the client method, excluding the token
+    :returns: The last response received, or a 503 response if the circuit of the application is open
+    :raises requests.RequestException: If the API could not be reached on any attempt
+    """
+    endpoint = f'{client.application}.{client.service_uri}'
+    breaker = _breaker(client.application)
+    retries = settings.API_RETRIES if method in IDEMPOTENT_METHODS else 0
+    renewed = False
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            metrics.api_request(endpoint, method, 503, 0.0)
+            return _circuit_open_response(endpoint)
+
+        token = Token.get_instance().token
+        start = time.monotonic()
+        try:
+            response = getattr(client, method)(token=token, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            metrics.api_request(endpoint, method, 0, time.monotonic() - start)
+            breaker.failure()
+            if attempt >= retries:
+                raise
+            LOGGER.warning(f'Could not reach {endpoint} for {method}, retrying.', exc_info=True)
+        else:
+            metrics.api_request(endpoint, method, response.status_code, time.monotonic() - start)
+            if _token_expired(response) and not renewed:
+                # Renew the token for every process and try again, without counting it against the retries
+                Token.get_instance().expire(token)
+                renewed = True
+                continue
+            if response.status_code < 500:
+                breaker.success()
+                return response
+            breaker.failure()
+            if attempt >= retries:
+                return response
+            LOGGER.warning(f'HTTP {response.status_code} from {endpoint} for {method}, retrying.')
+
+        time.sleep(_backoff(attempt))
+        attempt += 1
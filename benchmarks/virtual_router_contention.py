@@ -0,0 +1,92 @@
+"""
+Contention on the swanctl lock of a PodNet as the concurrency of the virtual_router worker grows.
+
+The virtual_router worker runs a prefork pool of 4, and the Virtual Router tasks serialise their swanctl loads on the
+PodNet with `flock /run/lock/robot-swanctl.lock`. This benchmark runs the same locked `swanctl --load-all` on a PodNet
+from a pool of worker processes, each with its own pooled SSH connection as in the worker, and reports for each
+concurrency the loads per second and how long each load waited for the lock and held it. The times are taken on the
+PodNet, so they are not skewed by the clock of this host.
+
+The load only reloads the swanctl configuration already on the PodNet, which every Virtual Router task does anyway, so
+it is safe to run against a live PodNet.
+
+Usage: PYTHONPATH=. python benchmarks/virtual_router_contention.py <podnet ip> [--loads 32] [--concurrency 1 2 4]
+"""
+# stdlib
+import argparse
+import multiprocessing
+import statistics
+import time
+from typing import List, Tuple
+# lib
+import opentracing
+# local
+from mixins import LinuxMixin
+
+# The lock that the Virtual Router templates take around swanctl
+SWANCTL_LOCK = '/run/lock/robot-swanctl.lock'
+
+# Prints when the load was started, when it got the lock and when it released it, in seconds on the PodNet
+LOAD = (
+    'date +%s.%N; '
+    f'sudo flock {SWANCTL_LOCK} sh -c "date +%s.%N; swanctl --load-all > /dev/null; date +%s.%N"'
+)
+
+
+class _Benchmark(LinuxMixin):
+    pass
+
+
+def _load(host: str) -> Tuple[float, float]:
+    """
+    Run one locked swanctl load on the PodNet
+    :returns: The seconds the load waited for the lock, and the seconds it held it for
+    """
+    span = opentracing.tracer.start_span('swanctl_load')
+    client = None
+    try:
+        client = _Benchmark.open_client(host, 'robot')
+        stdout, stderr = _Benchmark.deploy(LOAD, client, span)
+    finally:
+        _Benchmark.release_client(client)
+        span.finish()
+    started, acquired, released = (float(line) for line in stdout.split())
+    return acquired - started, released - acquired
+
+
+def run(host: str, loads: int, concurrency: int) -> Tuple[float, List[float], List[float]]:
+    """
+    Run the loads from a pool of worker processes
+    :returns: The loads per second, and the wait and hold time of each load
+    """
+    context = multiprocessing.get_context('fork')
+    with context.Pool(concurrency) as pool:
+        # Connect every process before timing, the connections of a running worker are already open
+        pool.map(_load, [host] * concurrency, chunksize=1)
+        start = time.perf_counter()
+        results = pool.map(_load, [host] * loads, chunksize=1)
+        elapsed = time.perf_counter() - start
+    waits = [wait for wait, _ in results]
+    holds = [hold for _, hold in results]
+    return loads / elapsed, waits, holds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('host', help='IP address of the PodNet')
+    parser.add_argument('--loads', type=int, default=32)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    print(f'{"concurrency":>11} {"loads/s":>8} {"mean wait (ms)":>15} {"p95 wait (ms)":>14} {"mean hold (ms)":>15}')
+    for concurrency in args.concurrency:
+        throughput, waits, holds = run(args.host, args.loads, concurrency)
+        p95 = statistics.quantiles(waits, n=20)[-1] if len(waits) > 1 else waits[0]
+        print(
+            f'{concurrency:>11} {throughput:>8.1f} {statistics.mean(waits) * 1000:>15.1f} {p95 * 1000:>14.1f} '
+            f'{statistics.mean(holds) * 1000:>15.1f}',
+        )
+
+
+if __name__ == '__main__':
+    main()
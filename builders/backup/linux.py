@@ -6,15 +6,15 @@ builder class for kvm backup
 """
 # stdlib
 import logging
-import socket
 from datetime import datetime
 from typing import Any, Dict, Optional
 # lib
 import opentracing
 from jaeger_client import Span
 from netaddr import IPAddress
-from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+from paramiko import SSHException
 # local
+import host_facts
 import settings
 import utils
 from mixins import LinuxMixin
@@ -84,20 +84,11 @@ class Linux(LinuxMixin):
 
         # Open a client and run the two necessary commands on the host
         built = False
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy)
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        client = None
         try:
             # Try connecting to the host and running the necessary commands
-            sock.connect((host_ip, 22))
-            client.connect(
-                hostname=host_ip,
-                username='administrator',
-                pkey=key,
-                timeout=30,
-                sock=sock,
-            )  # No need for password as it should have keys
+            # No need for password as it should have keys
+            client = Linux.open_client(host_ip, 'administrator')
             span.set_tag('host', host_ip)
 
             # Attempt to execute the backup build commands
@@ -111,7 +102,7 @@ class Linux(LinuxMixin):
             child_span.finish()
 
             if stdout:
-                Linux.logger.debug(f'Backup build command for Backup {backup_id} generated stdout. \n{stdout}')
+                Linux.logger.debug('Backup build command for Backup %s generated stdout. \n%s', backup_id, stdout)
             if stderr:
                 Linux.logger.error(f'Backup build command for Backup {backup_id} generated stderr. \n{stderr}')
                 backup_data['errors'].append(stderr)
@@ -122,7 +113,10 @@ class Linux(LinuxMixin):
             backup_data['errors'].append(error)
             span.set_tag('failed_reason', 'ssh_error')
         finally:
-            client.close()
+            Linux.release_client(client)
+            # The backup moves the drives of the VM onto a temporary overlay and back, so a drive map of the VM probed
+            # while it ran is out of date
+            host_facts.invalidate(host_ip, template_data['vm_identifier'])
 
         return built
 
@@ -185,6 +179,6 @@ class Linux(LinuxMixin):
         """
         # Render the backup command
         backup_cmd = utils.JINJA_ENV.get_template('backup/kvm/commands/build.j2').render(**template_data)
-        Linux.logger.debug(f'Generated backup build command for Backup #{backup_id}\n{backup_cmd}')
+        Linux.logger.debug('Generated backup build command for Backup #%s\n%s', backup_id, backup_cmd)
 
         return backup_cmd
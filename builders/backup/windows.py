@@ -101,7 +101,7 @@ class Windows(WindowsMixin):
             # Check the stdout and stderr for messages
             if response.std_out:
                 msg = response.std_out.strip()
-                Windows.logger.debug(f'Backup build command for Backup #{backup_id} generated stdout\n{msg}')
+                Windows.logger.debug('Backup build command for Backup #%s generated stdout\n%s', backup_id, msg)
                 built = 'Created VM backup' in msg
             # Check if the error was parsed to ensure we're not logging invalid std_err output
             if response.std_err and '#< CLIXML\r\n' not in response.std_err:
@@ -173,6 +173,6 @@ class Windows(WindowsMixin):
         """
         # Render the backup command
         backup_cmd = utils.JINJA_ENV.get_template('backup/hyperv/commands/build.j2').render(**template_data)
-        Windows.logger.debug(f'Generated backup build command for Backup #{backup_id}\n{backup_cmd}')
+        Windows.logger.debug('Generated backup build command for Backup #%s\n%s', backup_id, backup_cmd)
 
         return backup_cmd
@@ -8,13 +8,13 @@ builder class for ceph
 
 # stdlib
 import logging
-import socket
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 # lib
 import opentracing
 from jaeger_client import Span
-from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+from paramiko import SSHClient, SSHException
 # local
+import fanout
 import settings
 from mixins import LinuxMixin
 from utils import (
@@ -28,6 +28,9 @@ __all__ = [
 ]
 
 MB_PER_GB = 1024
+# Seconds the build commands may run for on a monitor. The monitors are tried one at a time, so a monitor that hangs
+# must not hold up the others for longer than this
+BUILD_TIMEOUT = 300
 
 
 class Ceph(LinuxMixin):
@@ -89,46 +92,41 @@ class Ceph(LinuxMixin):
 
         # If everything is okay, commence building the ceph drive
         build_bash_script = JINJA_ENV.get_template('ceph/commands/build.j2').render(**template_data)
-        Ceph.logger.debug(f'Generated build bash script for ceph #{ceph_id}\n{build_bash_script}')
+        Ceph.logger.debug('Generated build bash script for ceph #%s\n%s', ceph_id, build_bash_script)
 
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-
-        built = False
-        for host_ip in settings.CEPH_MONITORS:
-            span.set_tag('host', host_ip)
-
-            sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        def build_on(host_ip: str, client: SSHClient) -> Tuple[bool, Any]:
+            Ceph.logger.debug(f'Executing Ceph build commands for ceph #{ceph_id} on {host_ip}')
+            built = False
+            child_span = opentracing.tracer.start_span('build_ceph', child_of=span)
+            child_span.set_tag('host', host_ip)
             try:
-                # No need for password as it should have keys
-                sock.connect((host_ip, 22))
-                client.connect(hostname=host_ip, username='administrator', pkey=key, timeout=30, sock=sock)
-
-                Ceph.logger.debug(f'Executing Ceph build commands for ceph #{ceph_id}')
-                child_span = opentracing.tracer.start_span('build_ceph', child_of=span)
-                stdout, stderr = Ceph.deploy(build_bash_script, client, child_span)
-                child_span.finish()
-
+                stdout, stderr = Ceph.deploy(build_bash_script, client, child_span, timeout=BUILD_TIMEOUT)
                 if stderr:
                     Ceph.logger.error(f'Build commands for ceph #{ceph_id} generated stderr.\n{stderr}')
                     ceph_data['errors'].append(stderr)
                 if stdout:
-                    Ceph.logger.debug(f'Build commands for ceph #{ceph_id} generated stdout.\n{stdout}')
+                    Ceph.logger.debug('Build commands for ceph #%s generated stdout.\n%s', ceph_id, stdout)
                     built = template_data['success_msg'] in stdout
-
             except (OSError, SSHException, TimeoutError):
                 error = f'Exception occurred while building ceph #{ceph_id} in {host_ip}'
                 Ceph.logger.error(error, exc_info=True)
                 ceph_data['errors'].append(error)
-                span.set_tag('failed_reason', 'ssh_error')
             finally:
-                client.close()
+                child_span.finish()
+            return built, None
 
-            if built:
-                break
+        # The drive only needs to be built through one monitor. Try the healthiest first, without waiting out the
+        # connect timeout of a dead one before moving on to the next
+        winner = fanout.first(settings.CEPH_MONITORS, 'administrator', build_on)
+        if winner is None:
+            error = f'Could not build ceph #{ceph_id} through any of the Ceph monitors'
+            Ceph.logger.error(error)
+            ceph_data['errors'].append(error)
+            span.set_tag('failed_reason', 'no_monitor_succeeded')
+            return False
 
-        return built
+        span.set_tag('host', winner[0])
+        return True
 
     @staticmethod
     def _get_template_data(ceph_data: Dict[str, Any], span: Span) -> Optional[Dict[str, Any]]:
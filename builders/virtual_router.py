@@ -9,7 +9,6 @@ builder class for virtual_routers
 # stdlib
 import logging
 import re
-import socket
 from collections import deque
 from typing import Any, Deque, Dict, Optional
 # lib
@@ -18,7 +17,7 @@ from cloudcix.api.iaas import IAAS
 from cloudcix.lock import ResourceLock
 from jaeger_client import Span
 from netaddr import IPNetwork
-from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+from paramiko import SSHException
 # local
 import settings
 import vpn_mappings
@@ -26,6 +25,7 @@ from mixins import LinuxMixin
 from utils import (
     api_list,
     api_read,
+    api_read_many,
     JINJA_ENV,
     Targets,
 )
@@ -125,15 +125,17 @@ class VirtualRouter(LinuxMixin):
         child_span = opentracing.tracer.start_span('generate_ip_commands', child_of=span)
         build_bash_script = JINJA_ENV.get_template('virtual_router/commands/build.j2').render(**template_data)
         VirtualRouter.logger.debug(
-            f'Generated build bash script for virtual_router #{virtual_router_id}\n{build_bash_script}',
+            'Generated build bash script for virtual_router #%s\n%s',
+            virtual_router_id,
+            build_bash_script,
         )
 
         firewall_nft = JINJA_ENV.get_template('virtual_router/features/firewall.j2').render(**template_data)
-        VirtualRouter.logger.debug(f'Generated firewall nft for virtual_router #{virtual_router_id}\n{firewall_nft}')
+        VirtualRouter.logger.debug('Generated firewall nft for virtual_router #%s\n%s', virtual_router_id, firewall_nft)
 
         if len(virtual_router_data['vpns']) > 0:
             vpn_conf = JINJA_ENV.get_template('virtual_router/features/vpn.j2').render(**template_data)
-            VirtualRouter.logger.debug(f'Generated vpn conf for virtual_router #{virtual_router_id}\n{vpn_conf}')
+            VirtualRouter.logger.debug('Generated vpn conf for virtual_router #%s\n%s', virtual_router_id, vpn_conf)
 
         child_span.finish()
 
@@ -142,15 +144,12 @@ class VirtualRouter(LinuxMixin):
         management_ip = template_data.pop('management_ip')
         built = False
 
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        client = None
+        sftp = None
         try:
             # Try connecting to the host and running the necessary commands
             # No need for password as it should have keys
-            sock.connect((management_ip, 22))
-            client.connect(hostname=management_ip, username='robot', pkey=key, timeout=30, sock=sock)
+            client = VirtualRouter.open_client(management_ip, 'robot')
             sftp = client.open_sftp()
             span.set_tag('host', management_ip)
 
@@ -225,14 +224,8 @@ class VirtualRouter(LinuxMixin):
                 f'Executing Virtual Router build commands for virtual_router #{virtual_router_id}',
             )
             child_span = opentracing.tracer.start_span('build_virtual_router', child_of=span)
-            if len(virtual_router_data['vpns']) > 0:
-                # for vpns swanctl load command applied which is a critical section.
-                # Critical section
-                requestor = f'Apply Swanctl for Build Virtual Router #{virtual_router_id}'
-                with ResourceLock(target, requestor, child_span):
-                    stdout, stderr = VirtualRouter.deploy(build_bash_script, client, child_span)
-            else:
-                stdout, stderr = VirtualRouter.deploy(build_bash_script, client, child_span)
+            # swanctl loads are serialised on the PodNet itself, so the script runs without the PodNet lock
+            stdout, stderr = VirtualRouter.deploy(build_bash_script, client, child_span)
             child_span.finish()
             if stderr:
                 VirtualRouter.logger.error(
@@ -242,8 +235,9 @@ class VirtualRouter(LinuxMixin):
                 virtual_router_data['errors'].append(stderr)
             else:
                 VirtualRouter.logger.debug(
-                    f'Virtual Router build commands for virtual_router #{virtual_router_id} generated stdout.'
-                    f'\n{stdout}',
+                    'Virtual Router build commands for virtual_router #%s generated stdout.\n%s',
+                    virtual_router_id,
+                    stdout,
                 )
                 built = True
 
@@ -253,7 +247,10 @@ class VirtualRouter(LinuxMixin):
             virtual_router_data['errors'].append(error)
             span.set_tag('failed_reason', 'ssh_error')
         finally:
-            client.close()
+            # The connection is pooled, so the SFTP session has to be closed explicitly
+            if sftp is not None:
+                sftp.close()
+            VirtualRouter.release_client(client)
 
         return built
 
@@ -351,6 +348,15 @@ class VirtualRouter(LinuxMixin):
         child_span = opentracing.tracer.start_span('listing_vpns', child_of=span)
         virtual_router_vpns = api_list(IAAS.vpn, params, span=child_span)
         child_span.finish()
+
+        # Read the VPNs that send emails in one request to get their email addresses
+        child_span = opentracing.tracer.start_span('reading_vpns', child_of=span)
+        vpn_details = api_read_many(
+            IAAS.vpn,
+            [vpn['id'] for vpn in virtual_router_vpns if vpn['send_email']],
+            span=child_span,
+        )
+        child_span.finish()
         for vpn in virtual_router_vpns:
             routes: Deque[Dict[str, str]] = deque()
             local_ts = []
@@ -395,9 +401,13 @@ class VirtualRouter(LinuxMixin):
 
             # if send_email is true then read VPN for email addresses
             if vpn['send_email']:
-                child_span = opentracing.tracer.start_span('reading_vpn', child_of=span)
-                vpn['emails'] = api_read(IAAS.vpn, pk=vpn['id'])['emails']
-                child_span.finish()
+                details = vpn_details.get(vpn['id'], {})
+                if 'emails' not in details:
+                    # Fall back to reading the VPN on its own if the bulk request did not return it
+                    child_span = opentracing.tracer.start_span('reading_vpn', child_of=span)
+                    details = api_read(IAAS.vpn, pk=vpn['id'], span=child_span)
+                    child_span.finish()
+                vpn['emails'] = details.get('emails', [])
 
             # MAP SRX values to Strongswan values
             vpn['ike_authentication_map'] = vpn_mappings.IKE_AUTHENTICATION_MAP[vpn['ike_authentication']]
@@ -10,7 +10,6 @@ import logging
 import os
 import random
 import shutil
-import socket
 import string
 from crypt import crypt, mksalt, METHOD_SHA512
 from typing import Any, Dict, Optional, Tuple
@@ -19,8 +18,9 @@ import opentracing
 from cloudcix.lock import ResourceLock
 from jaeger_client import Span
 from netaddr import IPAddress, IPNetwork
-from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+from paramiko import SSHException
 # local
+import host_facts
 import settings
 from mixins import LinuxMixin, VMImageMixin
 from utils import JINJA_ENV, Targets
@@ -153,20 +153,11 @@ class Linux(LinuxMixin, VMImageMixin):
 
         # Open a client and run the two necessary commands on the host
         built = False
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        client = None
         try:
             # Try connecting to the host and running the necessary commands
-            sock.connect((host_ip, 22))
-            client.connect(
-                hostname=host_ip,
-                username='administrator',
-                pkey=key,
-                timeout=30,
-                sock=sock,
-            )  # No need for password as it should have keys
+            # No need for password as it should have keys
+            client = Linux.open_client(host_ip, 'administrator')
             span.set_tag('host', host_ip)
 
             # Attempt to execute the bridge build commands
@@ -182,11 +173,21 @@ class Linux(LinuxMixin, VMImageMixin):
                 server_id=vm_data['server_id'],
             )
             with ResourceLock(target, requestor, child_span):
-                stdout, stderr = Linux.deploy(bridge_build_cmd, client, child_span)
+                # Skip the netplan apply if every bridge the VM needs is already up on the host
+                facts = host_facts.get(host_ip, child_span)
+                if facts is not None and all(str(vlan) in facts['bridges'] for vlan in template_data['vlans']):
+                    Linux.logger.debug(f'Bridges for VM #{vm_id} already exist on host {host_ip}')
+                    stdout = stderr = ''
+                else:
+                    try:
+                        stdout, stderr = Linux.deploy(bridge_build_cmd, client, child_span)
+                    finally:
+                        # Still inside the lock, so no other task decides on the bridges of the host before this
+                        host_facts.invalidate(host_ip)
             child_span.finish()
 
             if stdout:
-                Linux.logger.debug(f'Bridge build commands for VM #{vm_id} generated stdout.\n{stdout}')
+                Linux.logger.debug('Bridge build commands for VM #%s generated stdout.\n%s', vm_id, stdout)
             if stderr:
                 Linux.logger.error(f'Bridge build commands for VM #{vm_id} generated stderr.\n{stderr}')
                 vm_data['errors'].append(stderr)
@@ -194,11 +195,12 @@ class Linux(LinuxMixin, VMImageMixin):
             # Now attempt to execute the vm build command
             Linux.logger.debug(f'Executing vm build command for VM #{vm_id}')
             child_span = opentracing.tracer.start_span('build_vm', child_of=span)
-            stdout, stderr = Linux.deploy(vm_build_cmd, client, child_span)
+            # virt-install runs for minutes, so its progress is logged as it happens
+            stdout, stderr = Linux.deploy(vm_build_cmd, client, child_span, stream=True)
             child_span.finish()
 
             if stdout:
-                Linux.logger.debug(f'VM build command for VM #{vm_id} generated stdout.\n{stdout}')
+                Linux.logger.debug('VM build command for VM #%s generated stdout.\n%s', vm_id, stdout)
             if stderr:
                 Linux.logger.error(f'VM build command for VM #{vm_id} generated stderr.\n{stderr}')
                 vm_data['errors'].append(stderr)
@@ -210,7 +212,7 @@ class Linux(LinuxMixin, VMImageMixin):
             vm_data['errors'].append(error)
             span.set_tag('failed_reason', 'ssh_error')
         finally:
-            client.close()
+            Linux.release_client(client)
 
         # remove all the files created in network drive
         try:
@@ -445,7 +447,7 @@ class Linux(LinuxMixin, VMImageMixin):
         for vlan in template_data['vlans']:
             template_name = 'vm/kvm/bridge/definition.j2'
             bridge_def = JINJA_ENV.get_template(template_name).render(vlan=vlan)
-            Linux.logger.debug(f'Generated bridge definition file for VM #{vm_id}\n{bridge_def}')
+            Linux.logger.debug('Generated bridge definition file for VM #%s\n%s', vm_id, bridge_def)
             bridge_def_filename = f'{path}/br{vlan}.yaml'
             try:
                 # Attempt to write
@@ -463,7 +465,7 @@ class Linux(LinuxMixin, VMImageMixin):
         # Render and attempt to write the answer file
         template_name = f'vm/kvm/answer_files/{answer_file_name}.j2'
         answer_file_data = JINJA_ENV.get_template(template_name).render(**template_data)
-        Linux.logger.debug(f'Generated answer file for VM #{vm_id}\n{answer_file_data}')
+        Linux.logger.debug('Generated answer file for VM #%s\n%s', vm_id, answer_file_data)
         answer_file_path = f'{path}/{template_data["vm_identifier"]}.cfg'
         try:
             # Attempt to write
@@ -492,11 +494,11 @@ class Linux(LinuxMixin, VMImageMixin):
         """
         # Render the bridge build commands
         bridge_cmd = JINJA_ENV.get_template('vm/kvm/bridge/build.j2').render(**template_data)
-        Linux.logger.debug(f'Generated bridge build command for VM #{vm_id}\n{bridge_cmd}')
+        Linux.logger.debug('Generated bridge build command for VM #%s\n%s', vm_id, bridge_cmd)
 
         # Render the VM build command
         vm_cmd = JINJA_ENV.get_template('vm/kvm/commands/build.j2').render(**template_data)
-        Linux.logger.debug(f'Generated vm build command for VM #{vm_id}\n{vm_cmd}')
+        Linux.logger.debug('Generated vm build command for VM #%s\n%s', vm_id, vm_cmd)
 
         return bridge_cmd, vm_cmd
 
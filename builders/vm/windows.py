@@ -159,7 +159,7 @@ class Windows(WindowsMixin, VMImageMixin):
             # Check the stdout and stderr for messages
             if response.std_out:
                 msg = response.std_out.strip()
-                Windows.logger.debug(f'VM build command for VM #{vm_id} generated stdout\n{msg}')
+                Windows.logger.debug('VM build command for VM #%s generated stdout\n%s', vm_id, msg)
                 built = 'VM Successfully Created' in msg
             # Check if the error was parsed to ensure we're not logging invalid std_err output
             if response.std_err and '#< CLIXML\r\n' not in response.std_err:
@@ -331,14 +331,16 @@ class Windows(WindowsMixin, VMImageMixin):
         template_name = 'vm/hyperv/answer_files/windows.j2'
         answer_file_data = JINJA_ENV.get_template(template_name).render(**template_data)
         template_data.pop('admin_password')
-        answer_file_log = JINJA_ENV.get_template(template_name).render(**template_data)
-        Windows.logger.debug(f'Generated answer file for VM #{vm_id}\n{answer_file_log}')
+        # Rendering the answer file again without the password is only worth it if the log will be emitted
+        if Windows.logger.isEnabledFor(logging.DEBUG):
+            answer_file_log = JINJA_ENV.get_template(template_name).render(**template_data)
+            Windows.logger.debug('Generated answer file for VM #%s\n%s', vm_id, answer_file_log)
         answer_file_path = f'{path}/unattend.xml'
         try:
             # Attempt to write
             with open(answer_file_path, 'w') as f:
                 f.write(answer_file_data)
-            Windows.logger.debug(f'Successfully wrote answer file for VM #{vm_id} to {answer_file_log}')
+            Windows.logger.debug(f'Successfully wrote answer file for VM #{vm_id} to {answer_file_path}')
         except IOError as err:
             error = f'Failed to write answer file for VM #{vm_id} to {answer_file_path}.'
             Windows.logger.error(error, exc_info=True)
@@ -348,7 +350,7 @@ class Windows(WindowsMixin, VMImageMixin):
         # Render and attempt to write the network file
         template_name = 'vm/hyperv/commands/network.j2'
         network = JINJA_ENV.get_template(template_name).render(**template_data)
-        Windows.logger.debug(f'Generated network file for VM #{vm_id}\n{network}')
+        Windows.logger.debug('Generated network file for VM #%s\n%s', vm_id, network)
         network_file = f'{path}/network.xml'
         try:
             # Attempt to write
@@ -364,7 +366,7 @@ class Windows(WindowsMixin, VMImageMixin):
         # Render and attempt to write the build script file
         template_name = 'vm/hyperv/commands/script.j2'
         builder = JINJA_ENV.get_template(template_name).render(**template_data)
-        Windows.logger.debug(f'Generated build script file for VM #{vm_id}\n{builder}')
+        Windows.logger.debug('Generated build script file for VM #%s\n%s', vm_id, builder)
         script_file = f'{path}/builder.psm1'
         try:
             # Attempt to write
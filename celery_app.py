@@ -4,17 +4,23 @@ Celery main runner
 # stdlib
 import atexit
 import logging
-import time
+import os
 from datetime import timedelta
 # lib
 import opentracing
-from celery import Celery
+from celery import Celery, states
 from celery.schedules import crontab
-from celery.signals import task_failure, task_prerun, task_postrun
+from celery.signals import task_failure, task_prerun, task_postrun, worker_process_shutdown
 from jaeger_client import Config
 # local
+import api_cache
+import http_pool
+import inflight
 import metrics
 import settings
+import ssh_pool
+import telemetry
+import transitions
 import utils
 
 __all__ = [
@@ -38,6 +44,9 @@ tracer_config = Config(
 )
 
 
+# Send every API request of this process over one pooled keep-alive session, re-created in each forked worker
+http_pool.install()
+
 app = Celery(
     'robot',
     broker=f'amqp://[{settings.CELERY_HOST}]:5672',
@@ -69,13 +78,21 @@ app.conf.beat_schedule = {
 }
 
 
-# Ensure the loggers are set up before each task is run
+# The process that the loggers and tracer were set up in
+_telemetry_pid = None
+
+
+# Ensure the loggers are set up before the first task of each process is run
 @task_prerun.connect
 def setup_logger_and_tracer(*args, **kwargs):
     """
-    Set up the logger before each task is run, in the hopes that it will fix our logging issue.
+    Set up the logger before the first task of each worker process is run, whether the pool forks or not.
     Also ensure that the opentracing.tracer is setup for this environment
     """
+    global _telemetry_pid
+    if _telemetry_pid == os.getpid():
+        return
+    _telemetry_pid = os.getpid()
     if not settings.LOGSTASH_ENABLE:
         logging.disable(logging.CRITICAL)
         return
@@ -84,17 +101,61 @@ def setup_logger_and_tracer(*args, **kwargs):
     # Also check to ensure we have a opentracing.tracer initialized in the forked process
     if not opentracing.is_tracer_registered:
         tracer_config.initialize_tracer()
-        atexit.register(opentracing.tracer.close)
+        # Hand finished spans to the telemetry reporter thread so the worker is free as soon as the task returns
+        telemetry.install_reporter(opentracing.tracer)
+        atexit.register(telemetry.shutdown, opentracing.tracer)
+
+
+# Send the spans and logs still queued in a worker process before it exits
+@worker_process_shutdown.connect
+def flush_telemetry(*args, **kwargs):
+    """
+    Drain the telemetry queue of the process and close its tracer
+    """
+    if settings.LOGSTASH_ENABLE:
+        telemetry.shutdown(opentracing.tracer if opentracing.is_tracer_registered else None)
 
 
-# Sleep after each task to try and flush spans
+# Report how far behind the telemetry reporter thread of the worker is once each task has finished
 @task_postrun.connect
-def sleep_to_flush_spans(*args, **kwargs):
+def report_telemetry_stats(*args, **kwargs):
     """
-    Flush spans by passing to IO loop, just to be safe
+    Send the depth of this worker's telemetry queue, and the number of spans and log flushes it dropped, to Influx
     """
     if settings.LOGSTASH_ENABLE:
-        time.sleep(5)
+        metrics.telemetry_queue_stats(*telemetry.stats())
+
+
+# Clear the in flight entry of each task, and the transition claims it won, once it has finished, so the object can be
+# dispatched and moved on again
+@task_postrun.connect
+def clear_inflight_entry(task=None, args=None, state=None, **kwargs):
+    """
+    Remove the task's entry from the in flight registry that the dispatchers consult, along with its transition claims
+    A task that is retrying keeps its entry, it is still in flight
+    """
+    if task is not None and state != states.RETRY:
+        inflight.release_task(task.name, args)
+    transitions.end()
+
+
+# Report the API cache and connection pool counters of the worker once each task has finished
+@task_postrun.connect
+def report_api_stats(*args, **kwargs):
+    """
+    Send the hit and miss counters of this worker's API cache, and the connection reuse of its pool, to Influx
+    """
+    metrics.api_cache_stats(*api_cache.stats())
+    metrics.api_connection_stats(*http_pool.stats())
+
+
+# Report how often the worker reused its pooled SSH connections once each task has finished
+@task_postrun.connect
+def report_ssh_stats(*args, **kwargs):
+    """
+    Send the number of SSH handshakes made and pooled connections reused by this worker to Influx
+    """
+    metrics.ssh_pool_stats(*ssh_pool.stats())
 
 
 # Catch all uncaught errors
@@ -0,0 +1,189 @@
+"""
+Change feeds that wake the mainloop as soon as there are changes for Robot in the region.
+
+The mainloop always asks the run_robot service for the actual changes, a feed only decides how long the mainloop waits
+between checks;
+    - PollingFeed: waits out the full interval. This is the original behaviour and the fallback for every other feed
+    - AMQPFeed: blocks on a notification queue in the Celery broker and wakes as soon as a message is published to it
+    - LocalFeed: an in-process stand-in that can be notified directly, used to drive the mainloop locally
+"""
+# stdlib
+import logging
+import socket
+import threading
+import time
+from typing import List, Optional
+# lib
+from kombu import Consumer, Exchange, Queue
+# local
+import settings
+from celery_app import app
+
+__all__ = [
+    'AMQPFeed',
+    'ChangeFeed',
+    'get_change_feed',
+    'LocalFeed',
+    'notify',
+    'PollingFeed',
+]
+
+# The exchange that change notifications are published to
+CHANGE_FEED_EXCHANGE = Exchange('robot.change_feed', type='direct', durable=False)
+
+
+def _feed_queue() -> Queue:
+    """
+    The queue this region's mainloop listens on for change notifications
+    """
+    return Queue(
+        settings.CHANGE_FEED_QUEUE,
+        CHANGE_FEED_EXCHANGE,
+        routing_key=settings.CHANGE_FEED_QUEUE,
+        durable=False,
+    )
+
+
+class ChangeFeed:
+    """
+    Base class for the mainloop change feeds
+    """
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Block until either a change is signalled or the timeout expires
+        :param timeout: The maximum number of seconds to wait for
+        :returns: A flag stating whether a change was signalled before the timeout expired
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release any resources held by the feed
+        """
+        pass
+
+
+class PollingFeed(ChangeFeed):
+    """
+    Plain sleep between checks, no notifications are ever received
+    """
+
+    def wait(self, timeout: float) -> bool:
+        time.sleep(timeout)
+        return False
+
+
+class LocalFeed(ChangeFeed):
+    """
+    In-process feed that is woken by calling `notify`, from another thread or from a test harness
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def notify(self):
+        """
+        Wake the mainloop waiting on this feed
+        """
+        self._event.set()
+
+    def wait(self, timeout: float) -> bool:
+        woken = self._event.wait(timeout)
+        self._event.clear()
+        return woken
+
+
+class AMQPFeed(ChangeFeed):
+    """
+    Feed that consumes notifications from a queue in the Celery broker.
+    If the broker cannot be reached the feed falls back to polling until the next wait call, where it reconnects.
+    """
+    logger = logging.getLogger('robot.change_feed.amqp')
+
+    def __init__(self):
+        self._connection = None
+        self._consumer = None
+        self._notified = False
+
+    def _connect(self):
+        self._connection = app.connection()
+        self._connection.ensure_connection(max_retries=1)
+        self._consumer = Consumer(
+            self._connection,
+            queues=[_feed_queue()],
+            callbacks=[self._on_message],
+            accept=['json'],
+        )
+        self._consumer.consume()
+        self.logger.debug(f'Listening for changes on queue {settings.CHANGE_FEED_QUEUE}')
+
+    def _on_message(self, body, message):
+        self.logger.debug(f'Received change notification {body}')
+        self._notified = True
+        message.ack()
+
+    def wait(self, timeout: float) -> bool:
+        start = time.monotonic()
+        try:
+            if self._connection is None:
+                self._connect()
+            self._connection.drain_events(timeout=timeout)
+            # Drain any other notifications that arrived at the same time, one check covers all of them
+            while True:
+                self._connection.drain_events(timeout=0)
+        except socket.timeout:
+            pass
+        except Exception:
+            self.logger.error('Change feed connection failed, falling back to polling.', exc_info=True)
+            self.close()
+            remaining = timeout - (time.monotonic() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+        woken = self._notified
+        self._notified = False
+        return woken
+
+    def close(self):
+        if self._consumer is not None:
+            try:
+                self._consumer.cancel()
+            except Exception:
+                pass
+            self._consumer = None
+        if self._connection is not None:
+            try:
+                self._connection.release()
+            except Exception:
+                pass
+            self._connection = None
+
+
+def get_change_feed() -> ChangeFeed:
+    """
+    Build the change feed configured by the CHANGE_FEED setting.
+    Unknown values fall back to polling.
+    """
+    if settings.CHANGE_FEED == 'amqp':
+        return AMQPFeed()
+    if settings.CHANGE_FEED != 'poll':
+        logging.getLogger('robot.change_feed').warning(
+            f'Unknown CHANGE_FEED "{settings.CHANGE_FEED}", falling back to polling.',
+        )
+    return PollingFeed()
+
+
+def notify(project_ids: Optional[List[int]] = None):
+    """
+    Publish a change notification for this region's mainloop.
+    This is what a webhook receiver or the API side calls to wake Robot up
+    :param project_ids: The ids of the projects that changed, for logging only
+    """
+    with app.producer_or_acquire() as producer:
+        producer.publish(
+            {'project_ids': project_ids or []},
+            exchange=CHANGE_FEED_EXCHANGE,
+            routing_key=settings.CHANGE_FEED_QUEUE,
+            declare=[_feed_queue()],
+            serializer='json',
+        )
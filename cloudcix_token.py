@@ -4,13 +4,23 @@ ensure that Robot always has a valid token.
 
 Written using the singleton design pattern to ensure that only a single instance
 of the class is ever instantiated.
+
+The current token is shared by every Robot process on the host through a file in the local state directory, so the
+prefork workers do not each log in on their own. A background thread in each process renews the token ahead of the
+threshold, and renewals are serialised with a lock on the file so only one process logs in for each renewal.
 """
 # stdlib
+import fcntl
+import json
 import logging
-from datetime import datetime
-from typing import cast
+import os
+import threading
+import time
+from typing import cast, Optional, Tuple
 # lib
 from cloudcix.auth import get_admin_token
+# local
+import settings
 
 __all__ = [
     'Token',
@@ -23,16 +33,27 @@ class Token:
     # If the token is older than this number of minutes, get a new one
     THRESHOLD = 40
 
+    # The background thread renews the token once it is within this number of minutes of the threshold
+    REFRESH_AHEAD = 5
+
+    # Number of seconds between checks of the background thread
+    CHECK_INTERVAL = 30
+
     # Maintain the instance of Token that will be used everywhere
     __instance = None
 
+    logger = logging.getLogger('robot.cloudcix_token')
+
     def __init__(self):
         # Check to ensure that an instance has not been created yet
         if Token.__instance is not None:
             raise Exception('Trying to instantiate a singleton more than once!')
         # If not, set up everything that we need
-        self._token = get_admin_token()
-        self._created = datetime.utcnow()
+        self._token: Optional[str] = None
+        self._created = 0.0
+        self._lock = threading.Lock()
+        # The process the background thread was started in, threads do not survive a fork
+        self._refresher_pid: Optional[int] = None
         # Save the instance
         Token.__instance = self
 
@@ -48,9 +69,138 @@ class Token:
         """
         Retrieve the token, refreshing it beforehand if necessary
         """
-        if (datetime.utcnow() - self._created).seconds / 60 > self.THRESHOLD:
-            # We need to regenerate the token
-            self._token = get_admin_token()
-            self._created = datetime.utcnow()
-            logging.getLogger('robot.cloudcix_token').debug('Generated new token')
-        return self._token
+        self._start_refresher()
+        with self._lock:
+            if self._age() > self.THRESHOLD * 60:
+                self._load()
+            if self._age() > self.THRESHOLD * 60:
+                # The background thread has fallen behind, renew on the request path
+                self._renew(self._token)
+            return cast(str, self._token)
+
+    def expire(self, stale_token: str):
+        """
+        Force a renewal after the API rejected a token as expired. If several callers report the same token only the
+        first one logs in, the rest pick up the token it fetched.
+        :param stale_token: The token that was rejected
+        """
+        with self._lock:
+            self._renew(stale_token)
+
+    def _age(self) -> float:
+        return time.time() - self._created
+
+    def _load(self):
+        """
+        Read the token shared by the other processes, if there is one
+        """
+        shared = self._read_shared()
+        if shared is not None:
+            self._swap(*shared)
+
+    def _read_shared(self) -> Optional[Tuple[str, float]]:
+        """
+        Read the token shared by the other processes
+        :returns: The token and the time it was created, or None if there is no shared token
+        """
+        try:
+            with open(settings.TOKEN_PATH) as token_file:
+                shared = json.load(token_file)
+        except (OSError, ValueError):
+            return None
+        return shared['token'], shared.get('created', 0)
+
+    def _swap(self, token: str, created: float):
+        """
+        Use the given token from now on, unless this process already has a newer one
+        Must be called with the lock held
+        """
+        if created > self._created:
+            self._token = token
+            self._created = created
+
+    def _renew(self, stale_token: Optional[str]):
+        """
+        Log in for a new token unless another process has already replaced the stale one
+        Must be called with the lock held
+        :param stale_token: The token the caller wants replaced
+        """
+        self._swap(*self._fetch(stale_token))
+
+    def _fetch(self, stale_token: Optional[str]) -> Tuple[str, float]:
+        """
+        Get a token to replace the stale one, logging in unless another process has already replaced it. Does not
+        touch the token of this process, so it can be called without the lock held
+        :param stale_token: The token the caller wants replaced
+        :returns: The token and the time it was created
+        """
+        try:
+            os.makedirs(os.path.dirname(settings.TOKEN_PATH), exist_ok=True)
+            lock_file = open(f'{settings.TOKEN_PATH}.lock', 'w')
+        except OSError:
+            # The shared file cannot be used, fall back to a token for this process alone
+            self.logger.warning('Could not open the shared token lock, renewing the token for this process only.')
+            return get_admin_token(), time.time()
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            shared = self._read_shared()
+            if shared is not None and shared[0] != stale_token and time.time() - shared[1] <= self.THRESHOLD * 60:
+                # Renewed by another process while this one was waiting for the lock
+                return shared
+            token, created = get_admin_token(), time.time()
+            self._save(token, created)
+            self.logger.debug('Generated new token')
+            return token, created
+
+    def _save(self, token: str, created: float):
+        """
+        Atomically replace the shared token file with the given token
+        """
+        tmp_path = f'{settings.TOKEN_PATH}.{os.getpid()}'
+        try:
+            descriptor = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(descriptor, 'w') as token_file:
+                json.dump({'token': token, 'created': created}, token_file)
+            os.replace(tmp_path, settings.TOKEN_PATH)
+        except OSError:
+            self.logger.error('Could not write the shared token file.', exc_info=True)
+
+    def _start_refresher(self):
+        """
+        Start the background renewal thread in this process if it is not already running
+        """
+        if self._refresher_pid == os.getpid():
+            return
+        self._refresher_pid = os.getpid()
+        threading.Thread(target=self._refresh_ahead, name='token-refresher', daemon=True).start()
+
+    def _refresh_ahead(self):
+        """
+        Renew the token shortly before it reaches the threshold, so requests never wait on a login
+        """
+        while True:
+            time.sleep(self.CHECK_INTERVAL)
+            try:
+                with self._lock:
+                    if self._age() > (self.THRESHOLD - self.REFRESH_AHEAD) * 60:
+                        self._load()
+                    due = self._age() > (self.THRESHOLD - self.REFRESH_AHEAD) * 60
+                    stale_token = self._token
+                if not due:
+                    continue
+                # Log in without the lock, so requests keep using the current token in the meantime
+                token, created = self._fetch(stale_token)
+                with self._lock:
+                    self._swap(token, created)
+            except Exception:
+                self.logger.error('Background token renewal failed.', exc_info=True)
+
+
+def _reset_lock_after_fork():
+    # A thread of the parent may have held the lock at the time of the fork, and that thread does not exist here
+    instance = Token._Token__instance
+    if instance is not None:
+        instance._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_lock_after_fork)
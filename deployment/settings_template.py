@@ -32,7 +32,21 @@ PUBLIC_INF = os.getenv('ROUTER_PUBLIC_INTERFACE', 'eth0')
 VIRTUAL_ROUTERS_ENABLED = True
 
 __all__ = [
+    'API_ASYNC_CONCURRENCY',
+    'API_BREAKER_COOLDOWN',
+    'API_BREAKER_THRESHOLD',
+    'API_CACHE_SERVER_TTL',
+    'API_CACHE_SIZE',
+    'API_LIST_WORKERS',
+    'API_POOL_CONNECTIONS',
+    'API_POOL_MAXSIZE',
+    'API_RETRIES',
+    'API_RETRY_BACKOFF',
+    'API_RETRY_BACKOFF_MAX',
+    'API_READ_MANY_CHUNK',
     'CELERY_HOST',
+    'CHANGE_FEED',
+    'CHANGE_FEED_QUEUE',
     'CLOUDCIX_API_KEY',
     'CLOUDCIX_API_PASSWORD',
     'CLOUDCIX_API_URL',
@@ -44,21 +58,31 @@ __all__ = [
     'CLOUDCIX_LOCK_PORT',
     'CLOUDCIX_LOCK_USER',
     'COMPUTE_UI_URL',
+    'DEPENDENCY_RETRY_BACKOFF',
+    'DEPENDENCY_RETRY_BACKOFF_MAX',
     'EMAIL_HOST_USER',
     'EMAIL_HOST_PASSWORD',
     'EMAIL_HOST',
     'EMAIL_PORT',
     'EMAIL_REPLY_TO',
+    'FANOUT_HEDGE_DELAY',
+    'HOST_FACTS_DB_PATH',
+    'HOST_FACTS_TTL',
+    'HOST_QUEUE_BUCKETS',
+    'HOST_ROUTING',
     'HYPERV_HOST_NETWORK_DRIVE_PATH',
     'HYPERV_ROBOT_NETWORK_DRIVE_PATH',
     'HYPERV_VMS_PATH',
     'IN_PRODUCTION',
+    'INFLIGHT_DB_PATH',
+    'INFLIGHT_TTL',
     'CLOUDCIX_INFLUX_DATABASE',
     'CLOUDCIX_INFLUX_PORT',
     'CLOUDCIX_INFLUX_URL',
     'KVM_HOST_NETWORK_DRIVE_PATH',
     'KVM_ROBOT_NETWORK_DRIVE_PATH',
     'KVM_VMS_PATH',
+    'LOG_MAX_LENGTH',
     'LOGSTASH_ENABLE',
     'LOGSTASH_PORT',
     'LOGSTASH_URL',
@@ -66,10 +90,20 @@ __all__ = [
     'NETWORK_DRIVE_URL',
     'NETWORK_PASSWORD',
     'PODNET_CPE',
+    'POLL_BACKOFF',
+    'POLL_MAX_INTERVAL',
+    'POLL_MIN_INTERVAL',
     'PRIVATE_INF',
     'PUBLIC_INF',
     'ROBOT_ENV',
+    'ROBOT_STATE_DIR',
     'SEND_TO_FAIL',
+    'SSH_COMMAND_TIMEOUT',
+    'SSH_OUTPUT_MAX_BYTES',
+    'SSH_POOL_CHECKOUT_TIMEOUT',
+    'SSH_POOL_IDLE_TIMEOUT',
+    'SSH_POOL_KEEPALIVE',
+    'SSH_POOL_MAX_PER_HOST',
     'SUBJECT_BACKUP_BUILD_FAIL',
     'SUBJECT_BACKUP_FAIL',
     'SUBJECT_PROJECT_FAIL',
@@ -81,6 +115,13 @@ __all__ = [
     'SUBJECT_VPN_BUILD_SUCCESS',
     'SUBJECT_VPN_UPDATE_SUCCESS',
     'SUBJECT_VIRTUAL_ROUTER_FAIL',
+    'TASK_SNAPSHOT_MAX_AGE',
+    'TASK_SNAPSHOTS',
+    'TELEMETRY_QUEUE_SIZE',
+    'TELEMETRY_SHUTDOWN_TIMEOUT',
+    'TOKEN_PATH',
+    'TRANSITION_GUARD_TTL',
+    'VIRTUAL_ROUTER_LOCK_TIMEOUT',
     'VIRTUAL_ROUTERS_ENABLED',
 ]
 
@@ -168,6 +209,12 @@ CLOUDCIX_INFLUX_PORT = 443
 
 LOGSTASH_ENABLE = os.getenv('LOGSTASH_ENABLE', 'false').lower() == 'true'
 LOGSTASH_PORT = os.getenv('LOGSTASH_PORT', 5044)
+# Maximum number of characters of a log message sent to logstash, longer messages such as rendered scripts are cut short
+LOG_MAX_LENGTH = int(os.getenv('ROBOT_LOG_MAX_LENGTH', 16384))
+# Maximum number of spans and log flushes waiting for each process's telemetry reporter thread, more are dropped
+TELEMETRY_QUEUE_SIZE = int(os.getenv('ROBOT_TELEMETRY_QUEUE_SIZE', 10000))
+# Seconds a worker process waits on shutdown for its queued spans and logs to be sent
+TELEMETRY_SHUTDOWN_TIMEOUT = float(os.getenv('ROBOT_TELEMETRY_SHUTDOWN_TIMEOUT', 10))
 
 
 if f'{PAM_NAME}.{PAM_ORGANIZATION_URL}' == 'support.cloudcix.com':
@@ -210,6 +257,106 @@ for monitor in os.environ.get('CEPH_MONITORS', '').split(','):
     CEPH_MONITORS.append(str(ip))
 CEPH_MONITORS = tuple(CEPH_MONITORS)
 
+"""
+API Client Settings
+"""
+# Maximum number of requests in flight from the asyncio facade used by the healthcheck and scrub
+API_ASYNC_CONCURRENCY = int(os.getenv('ROBOT_API_ASYNC_CONCURRENCY', 16))
+# Number of threads that fetch the remaining pages of a list request in parallel
+API_LIST_WORKERS = int(os.getenv('ROBOT_API_LIST_WORKERS', 8))
+# Maximum number of ids sent in a single search[id__in] request by api_read_many
+API_READ_MANY_CHUNK = int(os.getenv('ROBOT_API_READ_MANY_CHUNK', 100))
+# Number of hosts that each process keeps a pool of API connections for
+API_POOL_CONNECTIONS = int(os.getenv('ROBOT_API_POOL_CONNECTIONS', 4))
+# Number of kept-alive connections in each host's pool, at least API_LIST_WORKERS so parallel pages reuse them
+API_POOL_MAXSIZE = int(os.getenv('ROBOT_API_POOL_MAXSIZE', 10))
+# Number of times an idempotent request (list, read or update) is retried after a 5xx response or a connection error
+API_RETRIES = int(os.getenv('ROBOT_API_RETRIES', 3))
+# Base and ceiling in seconds of the jittered exponential backoff between retries
+API_RETRY_BACKOFF = float(os.getenv('ROBOT_API_RETRY_BACKOFF', 0.5))
+API_RETRY_BACKOFF_MAX = float(os.getenv('ROBOT_API_RETRY_BACKOFF_MAX', 10))
+# Consecutive failed requests to an application after which requests to it fail fast
+API_BREAKER_THRESHOLD = int(os.getenv('ROBOT_API_BREAKER_THRESHOLD', 10))
+# Seconds that requests fail fast for before a trial request is let through
+API_BREAKER_COOLDOWN = float(os.getenv('ROBOT_API_BREAKER_COOLDOWN', 30))
+# Maximum number of reads and lists each worker keeps in its API cache
+API_CACHE_SIZE = int(os.getenv('ROBOT_API_CACHE_SIZE', 1024))
+# Seconds that Server records are cached for, 0 disables caching them
+API_CACHE_SERVER_TTL = int(os.getenv('ROBOT_API_CACHE_SERVER_TTL', 300))
+
+"""
+Mainloop Settings
+"""
+# How the mainloop is woken up for changes in the region; 'poll' or 'amqp'
+CHANGE_FEED = os.getenv('ROBOT_CHANGE_FEED', 'poll').lower()
+# Queue in the Celery broker that change notifications for this region are published to
+CHANGE_FEED_QUEUE = f'robot.change_feed.{REGION_NAME}'
+# Seconds between checks of run_robot while it keeps returning work, must be greater than 0
+POLL_MIN_INTERVAL = float(os.getenv('ROBOT_POLL_MIN_INTERVAL', 0.5))
+# Ceiling in seconds that the interval backs off to while the region is idle
+POLL_MAX_INTERVAL = float(os.getenv('ROBOT_POLL_MAX_INTERVAL', 15))
+# Factor the interval grows by after each check that returned no work, must be greater than 1
+POLL_BACKOFF = float(os.getenv('ROBOT_POLL_BACKOFF', 2))
+
+"""
+Task Routing Settings
+"""
+# Ship snapshots of the objects a task acts on in its message, fetched in bulk by the mainloop
+TASK_SNAPSHOTS = os.getenv('ROBOT_TASK_SNAPSHOTS', 'false').lower() == 'true'
+# Seconds after being fetched that a task still uses a snapshot instead of reading the object again, as long as the
+# object has not changed since
+TASK_SNAPSHOT_MAX_AGE = int(os.getenv('ROBOT_TASK_SNAPSHOT_MAX_AGE', 60))
+# Route VM, Backup and Snapshot tasks to a queue per host; 'off' or 'bucket' (host-bucket-<n>)
+HOST_ROUTING = os.getenv('ROBOT_HOST_ROUTING', 'off').lower()
+# Number of host-bucket-<n> queues that servers are hashed into in 'bucket' mode. Also read by supervisord for the
+# number of host-bucket workers, so must be set in the environment of supervisord
+HOST_QUEUE_BUCKETS = int(os.getenv('ROBOT_HOST_QUEUE_BUCKETS', 16))
+# Base and ceiling in seconds of the backoff before a task whose dependency is not ready yet checks it again
+DEPENDENCY_RETRY_BACKOFF = float(os.getenv('ROBOT_DEPENDENCY_RETRY_BACKOFF', 10))
+DEPENDENCY_RETRY_BACKOFF_MAX = float(os.getenv('ROBOT_DEPENDENCY_RETRY_BACKOFF_MAX', 300))
+
+"""
+SSH Pool Settings
+"""
+# Maximum number of connections each worker process has checked out to a single host at once
+SSH_POOL_MAX_PER_HOST = int(os.getenv('ROBOT_SSH_POOL_MAX_PER_HOST', 4))
+# Seconds that a pooled connection may sit unused before it is closed
+SSH_POOL_IDLE_TIMEOUT = float(os.getenv('ROBOT_SSH_POOL_IDLE_TIMEOUT', 300))
+# Seconds between keepalive packets on pooled connections, so firewalls and sshd do not drop them while idle
+SSH_POOL_KEEPALIVE = int(os.getenv('ROBOT_SSH_POOL_KEEPALIVE', 30))
+# Seconds to wait for a connection to a host when SSH_POOL_MAX_PER_HOST are already checked out
+SSH_POOL_CHECKOUT_TIMEOUT = float(os.getenv('ROBOT_SSH_POOL_CHECKOUT_TIMEOUT', 120))
+# Seconds a command run over SSH may take before it is cancelled, unless the caller sets its own. Unset by default, as
+# builds and backups can run for hours; only commands with a known runtime are given a timeout
+SSH_COMMAND_TIMEOUT = os.getenv('ROBOT_SSH_COMMAND_TIMEOUT')
+SSH_COMMAND_TIMEOUT = float(SSH_COMMAND_TIMEOUT) if SSH_COMMAND_TIMEOUT else None
+# Maximum number of bytes of a command's output kept in memory, only the last part of longer output is returned
+SSH_OUTPUT_MAX_BYTES = int(os.getenv('ROBOT_SSH_OUTPUT_MAX_BYTES', 1048576))
+# Seconds to give an operation on one host before also trying the next, when it only needs to succeed on one host
+FANOUT_HEDGE_DELAY = float(os.getenv('ROBOT_FANOUT_HEDGE_DELAY', 2))
+
+"""
+Local State Settings
+"""
+# Directory for state shared between the mainloop and the workers on this host
+ROBOT_STATE_DIR = os.getenv('ROBOT_STATE_DIR', '/opt/robot/state')
+# Cache of facts probed from the KVM hosts, shared by the workers
+HOST_FACTS_DB_PATH = f'{ROBOT_STATE_DIR}/host_facts.db'
+# Seconds that the probed facts of a KVM host are used for before the host is probed again
+HOST_FACTS_TTL = int(os.getenv('ROBOT_HOST_FACTS_TTL', 3600))
+# Registry of dispatched tasks that have not finished yet
+INFLIGHT_DB_PATH = f'{ROBOT_STATE_DIR}/inflight.db'
+# Seconds after which an in flight entry expires even if its task never cleared it
+INFLIGHT_TTL = int(os.getenv('ROBOT_INFLIGHT_TTL', 1800))
+# Admin token shared by the mainloop and the workers so they do not each log in
+TOKEN_PATH = f'{ROBOT_STATE_DIR}/token.json'
+# Seconds that a claim on moving an object into an in-progress state keeps the other workers on this host from doing
+# the same
+TRANSITION_GUARD_TTL = int(os.getenv('ROBOT_TRANSITION_GUARD_TTL', 600))
+# Seconds that a Virtual Router task waits for another task on the same Virtual Router to finish, before it frees its
+# worker and retries later
+VIRTUAL_ROUTER_LOCK_TIMEOUT = float(os.getenv('ROBOT_VIRTUAL_ROUTER_LOCK_TIMEOUT', 30))
+
 """
 Robot Database
 """
@@ -1,6 +1,8 @@
 from .backup import Backup
+from .batch import Batch
 from .ceph import Ceph
 from .phantom_virtual_router import PhantomVirtualRouter
+from .routing import Hosts
 from .snapshot import Snapshot
 from .virtual_router import VirtualRouter
 from .vm import VM
@@ -8,7 +10,9 @@ from .vm import VM
 
 __all__ = [
     'Backup',
+    'Batch',
     'Ceph',
+    'Hosts',
     'PhantomVirtualRouter',
     'Snapshot',
     'VirtualRouter',
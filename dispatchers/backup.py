@@ -1,6 +1,11 @@
 # stdlib
 import logging
+from typing import Optional
+# lib
+from cloudcix.api.iaas import IAAS
 # local
+from .batch import Batch, dispatch
+from .routing import Hosts
 from tasks import backup as backup_tasks
 
 
@@ -12,8 +17,16 @@ class Backup:
     # Network password used to login to the routers
     password: str
 
-    def __init__(self, password: str):
+    # Batch collecting the tasks of the current run, tasks are published immediately if it is None
+    batch: Optional[Batch]
+
+    # Hosts of the objects of the current run, that the tasks are routed to
+    hosts: Hosts
+
+    def __init__(self, password: str, batch: Optional[Batch] = None, hosts: Optional[Hosts] = None):
         self.password = password
+        self.batch = batch
+        self.hosts = hosts if hosts is not None else Hosts()
 
     def build(self, backup_id: int):
         """
@@ -24,7 +37,8 @@ class Backup:
         logging.getLogger('robot.dispatchers.backup.build').debug(
             f'Passing Backup #{backup_id} to the build task queue',
         )
-        backup_tasks.build_backup.delay(backup_id)
+        signature = self.hosts.route(backup_tasks.build_backup.s(backup_id), IAAS.backup, backup_id)
+        dispatch(signature, self.batch)
 
     def scrub(self, backup_id: int):
         """
@@ -35,7 +49,8 @@ class Backup:
         logging.getLogger('robot.dispatchers.backup.scrub').debug(
             f'Passing Backup #{backup_id} to the scrub task queue',
         )
-        backup_tasks.scrub_backup.delay(backup_id)
+        signature = self.hosts.route(backup_tasks.scrub_backup.s(backup_id), IAAS.backup, backup_id)
+        dispatch(signature, self.batch)
 
     def update(self, backup_id: int):
         """
@@ -46,4 +61,5 @@ class Backup:
         logging.getLogger('robot.dispatchers.backup.update').debug(
             f'passsing Backup #{backup_id} to the update task queue',
         )
-        backup_tasks.update_backup.delay(backup_id)
+        signature = self.hosts.route(backup_tasks.update_backup.s(backup_id), IAAS.backup, backup_id)
+        dispatch(signature, self.batch)
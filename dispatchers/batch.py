@@ -0,0 +1,163 @@
+"""
+Batched dispatching of celery tasks.
+
+Dispatchers add the signature of each task to a Batch instead of publishing it straight away. Once the run is complete
+the Batch publishes everything as a single celery group, which sends all of the messages over one producer connection.
+Tasks whose object already has the same task in flight are left out of the group.
+"""
+# stdlib
+import logging
+import threading
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+# lib
+from celery import group
+from celery.canvas import Signature
+# local
+import inflight
+
+__all__ = [
+    'Batch',
+    'dispatch',
+    'task_label',
+]
+
+
+def task_label(task_name: str) -> str:
+    """
+    Generate a short label for a task from its name, for reporting
+    e.g. tasks.vm.build.build_vm -> vm.build
+    :param task_name: The full name of the celery task
+    """
+    parts = task_name.split('.')
+    if len(parts) < 3:
+        return task_name
+    return '.'.join(parts[1:3])
+
+
+class Batch:
+    """
+    Collects task signatures for a run of Robot and publishes them together
+    The in flight registry is only claimed for a task when the batch is published, so a run that fails before then
+    leaves nothing claimed, and the claims of a publish that fails are released again.
+    """
+    logger = logging.getLogger('robot.dispatchers.batch')
+
+    def __init__(self):
+        # Each task, with the task in the batch that it must run after and the task to publish instead if that one
+        # fails, if any
+        self.entries: Deque[Tuple[Signature, Optional[Signature], Optional[Signature]]] = deque()
+        # Dispatchers may add to the batch from several threads, e.g. the concurrent scrub checks
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, signature: Signature):
+        """
+        Add a task to the batch
+        :param signature: The signature of the task to publish when the batch is published
+        """
+        with self._lock:
+            self.entries.append((signature, None, None))
+
+    def link(self, signature: Signature, after: Signature, on_failure: Optional[Signature] = None):
+        """
+        Publish a task as a callback of a task in the batch, so it is only sent once that task has finished
+        If the task it depends on is not published, e.g. because it is already in flight, the task is published on its
+        own instead.
+        :param signature: The signature of the task to run afterwards
+        :param after: The signature of a task in the batch that the task depends on
+        :param on_failure: An errback to run if the task it depends on raises, so the task is not lost with it
+        """
+        with self._lock:
+            self.entries.append((signature, after, on_failure))
+
+    def publish(self) -> Tuple[Dict[str, int], List[Tuple[str, int, str]]]:
+        """
+        Claim the in flight registry for every task in the batch, publish the claimed ones in a single group, and empty
+        the batch
+        :returns: The number of tasks that were queued keyed by task label, and the registry keys of the tasks that
+            were not queued because the same task was already in flight
+        :raises Exception: Any error from publishing the group, once the claims for the group have been released
+        """
+        with self._lock:
+            entries = list(self.entries)
+            self.entries.clear()
+
+        counts: Counter = Counter()
+        skipped: List[Tuple[str, int, str]] = []
+        claimed: List[Tuple[str, int, str]] = []
+        signatures: List[Signature] = []
+        published: Set[int] = set()
+        # Dependent tasks are always added after the task they depend on
+        for signature, after, on_failure in entries:
+            key = inflight.task_key(signature.task, signature.args)
+            if key is not None:
+                if not inflight.claim(*key):
+                    obj_type, obj_id, action = key
+                    self.logger.debug(
+                        f'Not dispatching {action} of {obj_type} #{obj_id}, the same task is already in flight.',
+                    )
+                    skipped.append(key)
+                    continue
+                claimed.append(key)
+            if after is not None and id(after) in published:
+                # Callbacks are passed the result of their parent unless they are immutable
+                after.link(signature.set(immutable=True))
+                if on_failure is not None:
+                    after.link_error(on_failure)
+            else:
+                signatures.append(signature)
+            published.add(id(signature))
+            counts[task_label(signature.task)] += 1
+
+        if len(signatures) > 0:
+            self.logger.debug(f'Publishing {len(signatures)} tasks in a single group')
+            try:
+                group(signatures).apply_async()
+            except Exception:
+                # Nothing was queued, let the next run dispatch the tasks again
+                for key in claimed:
+                    inflight.release(*key)
+                raise
+        return dict(counts), skipped
+
+
+def dispatch(
+        signature: Signature,
+        batch: Optional[Batch] = None,
+        after: Optional[Signature] = None,
+        on_failure: Optional[Signature] = None,
+) -> bool:
+    """
+    Send the task to the batch if there is one, otherwise publish it immediately.
+    Tasks published immediately for an object that already has the same task in flight are dropped, the batch checks
+    its tasks when it is published.
+    :param signature: The signature of the task to dispatch
+    :param batch: The batch collecting the tasks of the current run, if any
+    :param after: A task in the batch that this task depends on, the task is run once it has finished
+    :param on_failure: An errback to run if the task it depends on raises, see Batch.link
+    :returns: A flag stating whether the task was published or added to the batch
+    """
+    if batch is not None:
+        if after is not None:
+            batch.link(signature, after, on_failure)
+        else:
+            batch.add(signature)
+        return True
+
+    key = inflight.task_key(signature.task, signature.args)
+    if key is not None and not inflight.claim(*key):
+        obj_type, obj_id, action = key
+        logging.getLogger('robot.dispatchers.dispatch').debug(
+            f'Not dispatching {action} of {obj_type} #{obj_id}, the same task is already in flight.',
+        )
+        return False
+    try:
+        signature.apply_async()
+    except Exception:
+        if key is not None:
+            inflight.release(*key)
+        raise
+    return True
@@ -1,6 +1,8 @@
 # stdlib
 import logging
+from typing import Optional
 # local
+from .batch import Batch, dispatch
 from tasks import ceph as ceph_tasks
 
 
@@ -12,8 +14,12 @@ class Ceph:
     # Network password used to log into the routers
     password: str
 
-    def __init__(self, password: str):
+    # Batch collecting the tasks of the current run, tasks are published immediately if it is None
+    batch: Optional[Batch]
+
+    def __init__(self, password: str, batch: Optional[Batch] = None):
         self.password = password
+        self.batch = batch
 
     def build(self, ceph_id: int):
         """
@@ -22,4 +28,4 @@ class Ceph:
         """
         # log a message about the dispatch, and pass the request to celery
         logging.getLogger('robot.dispatchers.ceph.build').debug(f'Passing ceph #{ceph_id} to the build task queue.')
-        ceph_tasks.build_ceph.delay(ceph_id)
+        dispatch(ceph_tasks.build_ceph.s(ceph_id), self.batch)
@@ -3,10 +3,10 @@ import logging
 # lib
 from cloudcix.api.iaas import IAAS
 # local
+import api_call
 import metrics
 import state
 import utils
-from cloudcix_token import Token
 
 
 class PhantomVirtualRouter:
@@ -24,8 +24,9 @@ class PhantomVirtualRouter:
         logger = logging.getLogger('robot.dispatchers.phantom_virtual_router.build')
         logger.info(f'Updating phantom virtual router #{virtual_router_id} to state BUILDING')
         # Change the state to BUILDING and report a success to influx
-        response = IAAS.virtual_router.update(
-            token=Token.get_instance().token,
+        response = api_call.call(
+            IAAS.virtual_router,
+            'update',
             pk=virtual_router_id,
             data={'state': state.BUILDING},
         )
@@ -37,8 +38,9 @@ class PhantomVirtualRouter:
             metrics.virtual_router_build_failure()
         logger.info(f'Updating virtual_router #{virtual_router_id} to state RUNNING')
         # Change the state to RUNNING and report a success to influx
-        response = IAAS.virtual_router.update(
-            token=Token.get_instance().token,
+        response = api_call.call(
+            IAAS.virtual_router,
+            'update',
             pk=virtual_router_id,
             data={'state': state.RUNNING},
         )
@@ -64,8 +66,8 @@ class PhantomVirtualRouter:
             return
         if virtual_router['state'] == state.QUIESCE:
             logger.info(f'Updating phantom virtual_router #{virtual_router_id} to state QUIESCING')
-            response = IAAS.virtual_router.partial_update(
-                token=Token.get_instance().token,
+            response = utils.api_partial_update(
+                IAAS.virtual_router,
                 pk=virtual_router_id,
                 data={'state': state.QUIESCING},
             )
@@ -77,8 +79,8 @@ class PhantomVirtualRouter:
                 metrics.virtual_router_quiesce_failure()
                 return
             logger.info(f'Updating phantom virtual_router #{virtual_router_id} to state QUIESCED')
-            response = IAAS.virtual_router.partial_update(
-                token=Token.get_instance().token,
+            response = utils.api_partial_update(
+                IAAS.virtual_router,
                 pk=virtual_router_id,
                 data={'state': state.QUIESCED},
             )
@@ -92,8 +94,8 @@ class PhantomVirtualRouter:
             metrics.virtual_router_quiesce_success()
         elif virtual_router['state'] == state.SCRUB:
             logger.info(f'Updating phantom virtual_router #{virtual_router_id} to state SCRUB_PREP')
-            response = IAAS.virtual_router.partial_update(
-                token=Token.get_instance().token,
+            response = utils.api_partial_update(
+                IAAS.virtual_router,
                 pk=virtual_router_id,
                 data={'state': state.SCRUB_PREP},
             )
@@ -105,8 +107,8 @@ class PhantomVirtualRouter:
                 metrics.virtual_router_quiesce_failure()
                 return
             logger.info(f'Updating phantom virtual_router #{virtual_router_id} to state SCRUB_QUEUE')
-            response = IAAS.virtual_router.partial_update(
-                token=Token.get_instance().token,
+            response = utils.api_partial_update(
+                IAAS.virtual_router,
                 pk=virtual_router_id,
                 data={'state': state.SCRUB_QUEUE},
             )
@@ -133,8 +135,9 @@ class PhantomVirtualRouter:
         """
         logger = logging.getLogger('robot.dispatchers.phantom_virtual_router.restart')
         logger.info(f'Updating virtual_router #{virtual_router_id} to state RESTARTING')
-        response = IAAS.virtual_router.update(
-            token=Token.get_instance().token,
+        response = api_call.call(
+            IAAS.virtual_router,
+            'update',
             pk=virtual_router_id,
             data={'state': state.RESTARTING},
         )
@@ -146,8 +149,9 @@ class PhantomVirtualRouter:
             metrics.virtual_router_restart_failure()
         logger.info(f'Updating phantom virtual_router #{virtual_router_id} to state RUNNING')
         # Change the state of the virtual_router to RUNNING and report a success to influx
-        response = IAAS.virtual_router.update(
-            token=Token.get_instance().token,
+        response = api_call.call(
+            IAAS.virtual_router,
+            'update',
             pk=virtual_router_id,
             data={'state': state.RUNNING},
         )
@@ -170,8 +174,8 @@ class PhantomVirtualRouter:
         logger.debug(f'Scrubbing phantom virtual_router #{virtual_router_id}')
         logger.info(f'Updating phantom virtual_router #{virtual_router_id} to state SCRUBBING')
 
-        response = IAAS.virtual_router.partial_update(
-            token=Token.get_instance().token,
+        response = utils.api_partial_update(
+            IAAS.virtual_router,
             pk=virtual_router_id,
             data={'state': state.SCRUBBING},
         )
@@ -185,8 +189,8 @@ class PhantomVirtualRouter:
 
         logger.debug(f'Closing phantom virtual_router #{virtual_router_id}')
         logger.info(f'Updating phantom virtual_router #{virtual_router_id} to state CLOSED')
-        response = IAAS.virtual_router.partial_update(
-            token=Token.get_instance().token,
+        response = utils.api_partial_update(
+            IAAS.virtual_router,
             pk=virtual_router_id,
             data={'state': state.CLOSED},
         )
@@ -207,7 +211,9 @@ class PhantomVirtualRouter:
         :param virtual_router_id: The virtual_router data from the CloudCIX API
         """
         logger = logging.getLogger('robot.dispatchers.phantom_virtual_router.update')
-        virtual_router = IAAS.virtual_router.read(token=Token.get_instance().token, pk=virtual_router_id)
+        virtual_router = utils.api_read(IAAS.virtual_router, virtual_router_id)
+        if not bool(virtual_router):
+            return
 
         progress_state = state.RUNNING_UPDATING
         stable_state = state.RUNNING
@@ -216,8 +222,9 @@ class PhantomVirtualRouter:
             stable_state = state.QUIESCED
 
         logger.info(f'Updating phantom virtual_router #{virtual_router_id} to in progress state.')
-        response = IAAS.virtual_router.update(
-            token=Token.get_instance().token,
+        response = api_call.call(
+            IAAS.virtual_router,
+            'update',
             pk=virtual_router_id,
             data={'state': progress_state},
         )
@@ -229,8 +236,9 @@ class PhantomVirtualRouter:
             metrics.virtual_router_update_failure()
         # Change the state of the virtual_router to RUNNING and report a success to influx
         logger.info(f'Updating phantom virtual_router #{virtual_router_id} to stable state.')
-        response = IAAS.virtual_router.update(
-            token=Token.get_instance().token,
+        response = api_call.call(
+            IAAS.virtual_router,
+            'update',
             pk=virtual_router_id,
             data={'state': stable_state},
         )
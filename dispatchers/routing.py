@@ -0,0 +1,102 @@
+"""
+Host-affine routing of celery tasks.
+
+When HOST_ROUTING is set to 'bucket', tasks that act on a single hypervisor are sent to a queue for their host instead
+of the default 'celery' queue. Servers are hashed into HOST_QUEUE_BUCKETS queues, named host-bucket-<n>, and each queue
+is consumed by one worker process, so work on the same host runs in order without the tasks queueing up on the host
+ResourceLock, while different hosts proceed in parallel.
+
+The hosts of the objects of a run are read in bulk by `Hosts.fetch` before their tasks are dispatched. Tasks whose host
+is not known are left on their default queue.
+"""
+# stdlib
+import logging
+import zlib
+from typing import Dict, Iterable, Optional
+# lib
+from celery.canvas import Signature
+from cloudcix.api.iaas import IAAS
+from cloudcix.client import Client
+# local
+import settings
+import utils
+
+__all__ = [
+    'enabled',
+    'host_queue',
+    'Hosts',
+    'route',
+]
+
+LOGGER = logging.getLogger('robot.dispatchers.routing')
+
+
+def enabled() -> bool:
+    """
+    Check whether host-affine routing is turned on
+    """
+    return settings.HOST_ROUTING == 'bucket'
+
+
+def host_queue(server_id: int) -> str:
+    """
+    Generate the name of the queue that tasks for the given server are sent to
+    :param server_id: The id of the server the task acts on
+    """
+    bucket = zlib.crc32(str(server_id).encode()) % settings.HOST_QUEUE_BUCKETS
+    return f'host-bucket-{bucket}'
+
+
+def route(signature: Signature, server_id: Optional[int]) -> Signature:
+    """
+    Route the task to the queue of its host. Tasks are left on their default queue if the host is not known
+    :param signature: The signature of the task to route
+    :param server_id: The id of the server the task acts on
+    """
+    if server_id is None or not enabled():
+        return signature
+    queue = host_queue(server_id)
+    LOGGER.debug(f'Routing {signature.task} to queue {queue}')
+    return signature.set(queue=queue)
+
+
+class Hosts:
+    """
+    The servers that the objects of a run live on, read in bulk so that routing a task does not read its object
+    """
+
+    def __init__(self):
+        self.server_ids: Dict[Client, Dict[int, Optional[int]]] = {}
+
+    def fetch(self, client: Client, ids: Iterable[int]):
+        """
+        Bulk read the objects and store the id of the server each one lives on, if routing is enabled
+        :param client: The client of the objects, one of IAAS.vm, IAAS.backup or IAAS.snapshot
+        :param ids: The ids of the objects
+        """
+        if not enabled():
+            return
+        server_ids = self.server_ids.setdefault(client, {})
+        wanted = [pk for pk in ids if pk not in server_ids]
+        if len(wanted) == 0:
+            return
+        for pk, obj in utils.api_read_many(client, wanted).items():
+            if client is IAAS.vm:
+                server_ids[pk] = obj.get('server_id')
+            else:
+                # Backups and Snapshots live on the server of their VM
+                server_ids[pk] = obj.get('vm', {}).get('server_id')
+
+    def route(self, signature: Signature, client: Client, obj_id: int) -> Signature:
+        """
+        Route a task for the given object to the queue of the host the object lives on
+        :param signature: The signature of the task to route
+        :param client: The client of the object, one of IAAS.vm, IAAS.backup or IAAS.snapshot
+        :param obj_id: The id of the object
+        """
+        if not enabled():
+            return signature
+        server_id = self.server_ids.get(client, {}).get(obj_id)
+        if server_id is None:
+            LOGGER.debug(f'Host of {signature.task} for #{obj_id} is not known, leaving it on its default queue')
+        return route(signature, server_id)
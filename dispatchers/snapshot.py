@@ -1,6 +1,11 @@
 # stdlib
 import logging
+from typing import Optional
+# lib
+from cloudcix.api.iaas import IAAS
 # local
+from .batch import Batch, dispatch
+from .routing import Hosts
 from tasks import snapshot as snapshot_tasks
 
 
@@ -12,8 +17,16 @@ class Snapshot:
     # Network password used to login to the routers
     password: str
 
-    def __init__(self, password: str):
+    # Batch collecting the tasks of the current run, tasks are published immediately if it is None
+    batch: Optional[Batch]
+
+    # Hosts of the objects of the current run, that the tasks are routed to
+    hosts: Hosts
+
+    def __init__(self, password: str, batch: Optional[Batch] = None, hosts: Optional[Hosts] = None):
         self.password = password
+        self.batch = batch
+        self.hosts = hosts if hosts is not None else Hosts()
 
     def build(self, snapshot_id: int):
         """
@@ -24,7 +37,8 @@ class Snapshot:
         logging.getLogger('robot.dispatchers.snapshot.build').debug(
             f'Passing Snapshot #{snapshot_id} to the build task queue',
         )
-        snapshot_tasks.build_snapshot.delay(snapshot_id)
+        signature = self.hosts.route(snapshot_tasks.build_snapshot.s(snapshot_id), IAAS.snapshot, snapshot_id)
+        dispatch(signature, self.batch)
 
     def scrub(self, snapshot_id: int):
         """
@@ -35,7 +49,8 @@ class Snapshot:
         logging.getLogger('robot.dispatchers.snapshot.scrub').debug(
             f'Passing Snapshot #{snapshot_id} to the scrub task queue',
         )
-        snapshot_tasks.scrub_snapshot.delay(snapshot_id)
+        signature = self.hosts.route(snapshot_tasks.scrub_snapshot.s(snapshot_id), IAAS.snapshot, snapshot_id)
+        dispatch(signature, self.batch)
 
     def update(self, snapshot_id: int):
         """
@@ -46,4 +61,5 @@ class Snapshot:
         logging.getLogger('robot.dispatchers.snapshot.update').debug(
             f'passsing Snapshot #{snapshot_id} to the update task queue',
         )
-        snapshot_tasks.update_snapshot.delay(snapshot_id)
+        signature = self.hosts.route(snapshot_tasks.update_snapshot.s(snapshot_id), IAAS.snapshot, snapshot_id)
+        dispatch(signature, self.batch)
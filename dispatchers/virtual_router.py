@@ -1,7 +1,12 @@
 # stdlib
 import logging
+from typing import Any, Dict, Optional
 # from datetime import datetime, timedelta
+# lib
+from celery.canvas import Signature
 # local
+from .batch import Batch, dispatch
+from prefetch import Snapshots
 # import tasks
 from tasks import virtual_router as virtual_router_tasks
 
@@ -14,25 +19,50 @@ class VirtualRouter:
     # Network password used to login to the routers
     password: str
 
-    def __init__(self, password: str):
+    # Batch collecting the tasks of the current run, tasks are published immediately if it is None
+    batch: Optional[Batch]
+
+    # Snapshots fetched for the current run, shipped with the tasks of the virtual_routers they cover
+    snapshots: Optional[Snapshots]
+
+    def __init__(self, password: str, batch: Optional[Batch] = None, snapshots: Optional[Snapshots] = None):
         self.password = password
+        self.batch = batch
+        self.snapshots = snapshots
+
+    def _task_kwargs(self, virtual_router_id: int) -> Dict[str, Any]:
+        """
+        Generate the kwargs to send to the task along with the id of the virtual_router
+        """
+        if self.snapshots is None:
+            return {}
+        payload = self.snapshots.for_virtual_router(virtual_router_id)
+        if payload is None:
+            return {}
+        return {'snapshots': payload}
 
-    def build(self, virtual_router_id: int):
+    def build(self, virtual_router_id: int) -> Optional[Signature]:
         """
         Dispatches a celery task to build the specified virtual_router
         :param virtual_router_id: The id of the virtual_router to build
+        :returns: The signature of the build task while it waits in the batch, for tasks that depend on it to follow
         """
         # log a message about the dispatch, and pass the request to celery
         logging.getLogger('robot.dispatchers.virtual_router.build').debug(
             f'Passing virtual_router #{virtual_router_id} to the build task queue',
         )
-        virtual_router_tasks.build_virtual_router.delay(virtual_router_id)
+        kwargs = self._task_kwargs(virtual_router_id)
+        signature = virtual_router_tasks.build_virtual_router.s(virtual_router_id, **kwargs)
+        dispatched = dispatch(signature, self.batch)
         # Reset debug logs of firewall rules after 15min
         # commenting the firewall rule debugging until logging is sorted out
         # logging.getLogger('robot.dispatchers.virtual_router.debug_logging').debug(
         #     f'Passing virtual_router #{virtual_router_id} to the debug_logs task queue after virtual_router build',
         # )
         # tasks.debug.s(virtual_router_id).apply_async(eta=datetime.now() + timedelta(seconds=15 * 60))
+        if dispatched and self.batch is not None:
+            return signature
+        return None
 
     def quiesce(self, virtual_router_id: int):
         """
@@ -43,7 +73,9 @@ class VirtualRouter:
         logging.getLogger('robot.dispatchers.virtual_router.quiesce').debug(
             f'Passing virtual_router #{virtual_router_id} to the quiesce task queue',
         )
-        virtual_router_tasks.quiesce_virtual_router.delay(virtual_router_id)
+        kwargs = self._task_kwargs(virtual_router_id)
+        signature = virtual_router_tasks.quiesce_virtual_router.s(virtual_router_id, **kwargs)
+        dispatch(signature, self.batch)
 
     def restart(self, virtual_router_id: int):
         """
@@ -54,7 +86,9 @@ class VirtualRouter:
         logging.getLogger('robot.dispatchers.virtual_router.restart').debug(
             f'Passing virtual_router #{virtual_router_id} to the restart task queue',
         )
-        virtual_router_tasks.restart_virtual_router.delay(virtual_router_id)
+        kwargs = self._task_kwargs(virtual_router_id)
+        signature = virtual_router_tasks.restart_virtual_router.s(virtual_router_id, **kwargs)
+        dispatch(signature, self.batch)
 
     def scrub(self, virtual_router_id: int):
         """
@@ -65,7 +99,7 @@ class VirtualRouter:
         logging.getLogger('robot.dispatchers.virtual_router.scrub').debug(
             f'Passing virtual_router #{virtual_router_id} to the scrub task queue',
         )
-        virtual_router_tasks.scrub_virtual_router.delay(virtual_router_id)
+        dispatch(virtual_router_tasks.scrub_virtual_router.s(virtual_router_id), self.batch)
 
     def update(self, virtual_router_id: int):
         """
@@ -76,7 +110,9 @@ class VirtualRouter:
         logging.getLogger('robot.dispatchers.virtual_router.update').debug(
             f'Passing virtual_router #{virtual_router_id} to the update task queue',
         )
-        virtual_router_tasks.update_virtual_router.delay(virtual_router_id)
+        kwargs = self._task_kwargs(virtual_router_id)
+        signature = virtual_router_tasks.update_virtual_router.s(virtual_router_id, **kwargs)
+        dispatch(signature, self.batch)
         # Reset debug logs of firewall rules after 15min
         # commenting the firewall rule debugging until logging is sorted out
         # logging.getLogger('robot.dispatchers.vrf.debug_logging').debug(
@@ -1,6 +1,14 @@
 # stdlib
 import logging
+from typing import Any, Dict, Optional
+# lib
+from celery.canvas import Signature
+from cloudcix.api.iaas import IAAS
 # local
+from . import routing
+from .batch import Batch, dispatch
+from .routing import Hosts
+from prefetch import Snapshots
 from tasks import vm as vm_tasks
 
 
@@ -12,17 +20,65 @@ class VM:
     # Network password used to login to the routers
     password: str
 
-    def __init__(self, password: str):
+    # Batch collecting the tasks of the current run, tasks are published immediately if it is None
+    batch: Optional[Batch]
+
+    # Snapshots fetched for the current run, shipped with the tasks of the VMs they cover
+    snapshots: Optional[Snapshots]
+
+    # Hosts of the VMs of the current run that have no snapshot, that the tasks are routed to
+    hosts: Hosts
+
+    def __init__(
+            self,
+            password: str,
+            batch: Optional[Batch] = None,
+            snapshots: Optional[Snapshots] = None,
+            hosts: Optional[Hosts] = None,
+    ):
         self.password = password
+        self.batch = batch
+        self.snapshots = snapshots
+        self.hosts = hosts if hosts is not None else Hosts()
+
+    def _task_kwargs(self, vm_id: int) -> Dict[str, Any]:
+        """
+        Generate the kwargs to send to the task along with the id of the VM
+        """
+        if self.snapshots is None:
+            return {}
+        payload = self.snapshots.for_vm(vm_id)
+        if payload is None:
+            return {}
+        return {'snapshots': payload}
+
+    def _route(self, signature: Signature, vm_id: int) -> Signature:
+        """
+        Route the task to its host, using the snapshot of the VM to find the host if there is one
+        """
+        snapshot = self.snapshots.get('vm', vm_id) if self.snapshots is not None else None
+        if snapshot is not None:
+            return routing.route(signature, snapshot['object']['server_id'])
+        return self.hosts.route(signature, IAAS.vm, vm_id)
 
-    def build(self, vm_id: int):
+    def build(self, vm_id: int, after: Optional[Signature] = None):
         """
         Dispatches a celery task to build the specified vm
         :param vm_id: The id of the VM to build
+        :param after: The build task of the VM's Virtual Router if it is being built in the same run
         """
         # log a message about the dispatch, and pass the request to celery
         logging.getLogger('robot.dispatchers.vm.build').debug(f'Passing VM #{vm_id} to the build task queue.')
-        vm_tasks.build_vm.delay(vm_id)
+        kwargs = self._task_kwargs(vm_id)
+        if after is not None:
+            # The Virtual Router will have changed by the time the build runs, so it must be read again
+            kwargs.get('snapshots', {}).pop('virtual_router', None)
+        signature = self._route(vm_tasks.build_vm.s(vm_id, **kwargs), vm_id)
+        on_failure = None
+        if after is not None:
+            # If the Virtual Router build raises, publish the VM build anyway. It waits for the Virtual Router itself
+            on_failure = vm_tasks.build_vm_anyway.s(signature=dict(signature))
+        dispatch(signature, self.batch, after, on_failure)
 
     def quiesce(self, vm_id: int):
         """
@@ -31,7 +87,8 @@ class VM:
         """
         # log a message about the dispatch, and pass the request to celery
         logging.getLogger('robot.dispatchers.vm.quiesce').debug(f'Passing VM #{vm_id} to the quiesce task queue.')
-        vm_tasks.quiesce_vm.delay(vm_id)
+        signature = self._route(vm_tasks.quiesce_vm.s(vm_id, **self._task_kwargs(vm_id)), vm_id)
+        dispatch(signature, self.batch)
 
     def restart(self, vm_id: int):
         """
@@ -40,7 +97,8 @@ class VM:
         """
         # log a message about the dispatch, and pass the request to celery
         logging.getLogger('robot.dispatchers.vm.restart').debug(f'Passing VM #{vm_id} to the restart task queue.')
-        vm_tasks.restart_vm.delay(vm_id)
+        signature = self._route(vm_tasks.restart_vm.s(vm_id, **self._task_kwargs(vm_id)), vm_id)
+        dispatch(signature, self.batch)
 
     def scrub(self, vm_id: int):
         """
@@ -49,7 +107,8 @@ class VM:
         """
         # log a message about the dispatch, and pass the request to celery
         logging.getLogger('robot.dispatchers.vm.scrub').debug(f'Passing VM #{vm_id} to the scrub task queue.')
-        vm_tasks.scrub_vm.delay(vm_id)
+        signature = self.hosts.route(vm_tasks.scrub_vm.s(vm_id), IAAS.vm, vm_id)
+        dispatch(signature, self.batch)
 
     def update(self, vm_id: int):
         """
@@ -58,4 +117,5 @@ class VM:
         """
         # log a message about the dispatch, and pass the request to celery
         logging.getLogger('robot.dispatchers.vm.update').debug(f'Passing VM #{vm_id} to the update task queue.')
-        vm_tasks.update_vm.delay(vm_id)
+        signature = self._route(vm_tasks.update_vm.s(vm_id, **self._task_kwargs(vm_id)), vm_id)
+        dispatch(signature, self.batch)
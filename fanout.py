@@ -0,0 +1,121 @@
+"""
+Run an operation over SSH on several hosts at once, instead of trying them one after another.
+
+The operation only needs to succeed on one of the hosts, e.g. a command on any one Ceph monitor. Hosts are tried in
+order of health, and the next host is started if the current one has not finished within FANOUT_HEDGE_DELAY seconds,
+so a dead host costs at most that delay rather than a full connect timeout. The operation runs on one host at a time,
+and once it has succeeded it is not run on any other, so operations must bound their own run time, e.g. with a command
+timeout, or a hanging host holds up the rest.
+The health of each host is remembered by the worker process, so hosts that failed to connect are tried last next time.
+"""
+# stdlib
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+# lib
+from paramiko import SSHClient, SSHException
+# local
+import settings
+import ssh_pool
+
+__all__ = [
+    'first',
+    'ordered',
+]
+
+LOGGER = logging.getLogger('robot.fanout')
+
+# Runs the operation on a host, given the host and a client connected to it. Returns whether the operation succeeded
+# and its result
+Operation = Callable[[str, SSHClient], Tuple[bool, Any]]
+
+# Number of consecutive failed attempts on each host
+_failures: Dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def _record(host: str, healthy: bool):
+    with _lock:
+        if healthy:
+            _failures.pop(host, None)
+        else:
+            _failures[host] = _failures.get(host, 0) + 1
+
+
+def _attempt(host: str, username: str, operation: Operation) -> Tuple[bool, Any]:
+    """
+    Connect to the host and run the operation on it, recording the health of the host
+    """
+    client = None
+    try:
+        client = ssh_pool.checkout(host, username)
+        success, result = operation(host, client)
+    except (OSError, SSHException):
+        LOGGER.warning(f'Could not run operation on {username}@{host}.', exc_info=True)
+        _record(host, False)
+        return False, None
+    finally:
+        ssh_pool.checkin(client)
+    _record(host, True)
+    return success, result
+
+
+def ordered(hosts: Sequence[str]) -> List[str]:
+    """
+    Sort hosts so the ones that have failed least recently are tried first, keeping the given order otherwise
+    :param hosts: The IP addresses of the hosts
+    :returns: The hosts in the order they should be tried
+    """
+    with _lock:
+        return sorted(hosts, key=lambda host: _failures.get(host, 0))
+
+
+def first(hosts: Sequence[str], username: str, operation: Operation) -> Optional[Tuple[str, Any]]:
+    """
+    Run the operation on the hosts until it succeeds on one of them
+    Attempts still connecting once the operation has succeeded are left to finish in the background, and give their
+    connections back to the pool without running the operation.
+    :param hosts: The IP addresses of the hosts
+    :param username: The user to log in to the hosts as
+    :param operation: The operation to run. It is never run on two hosts at once, so it must not block indefinitely
+    :returns: The host the operation succeeded on and its result, or None if it failed on every host
+    """
+    condition = threading.Condition()
+    # One run of the operation at a time, so it only ever succeeds once
+    running = threading.Lock()
+    outcome: Dict[str, Tuple[str, Any]] = {}
+    ended = 0
+
+    def guarded(host: str, client: SSHClient) -> Tuple[bool, Any]:
+        with running:
+            if outcome:
+                return False, None
+            return operation(host, client)
+
+    def attempt(host: str):
+        nonlocal ended
+        success: bool = False
+        result: Any = None
+        try:
+            success, result = _attempt(host, username, guarded)
+        finally:
+            with condition:
+                if success and not outcome:
+                    outcome['winner'] = (host, result)
+                ended += 1
+                condition.notify_all()
+
+    ranked = ordered(hosts)
+    for started, host in enumerate(ranked, start=1):
+        threading.Thread(target=attempt, args=(host,), name=f'fanout-{host}', daemon=True).start()
+        # Give the attempt a head start before hedging with the next host, or move on at once if every attempt so far
+        # has failed
+        with condition:
+            condition.wait_for(
+                lambda: bool(outcome) or ended == started,
+                timeout=settings.FANOUT_HEDGE_DELAY if started < len(ranked) else None,
+            )
+            if outcome:
+                return outcome['winner']
+    return None
+
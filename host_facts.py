@@ -0,0 +1,246 @@
+"""
+Cache of facts about the KVM hosts that the build and update tasks would otherwise probe for on every task.
+
+The facts of a host are gathered by one probe script, sent as a single batch over SSH:
+    - the UUID of the libvirt secret for the Ceph volumes
+    - the vlans whose bridge is defined in /etc/netplan/ and up on the host
+The drives of a VM are probed on their own, only for the VM that needs them, as target name -> source name.
+
+They are kept in a SQLite database in the local state directory, so every worker process on the host shares them, and
+expire after HOST_FACTS_TTL seconds. Only this Robot changes the bridges and drives on the hosts of its region, so every
+task that changes them calls `invalidate` once it has:
+    - the bridge build and scrub of a VM for the bridges of the host, inside the ResourceLock of the host so no other
+      task decides on the bridges in between
+    - the update of a VM that adds or removes drives, and the backup of a VM, for the drives of the VM
+Each invalidation moves the facts on to a new generation, and a probe only stores what it found if no invalidation
+happened while it ran, so a probe that started before a change can not cache what the host looked like before it.
+"""
+# stdlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import Any, Dict, Optional, Tuple
+# lib
+import opentracing
+from jaeger_client import Span
+from paramiko import SSHException
+# local
+import settings
+from mixins import LinuxMixin
+from utils import JINJA_ENV, local_lock
+
+__all__ = [
+    'drive_map',
+    'get',
+    'invalidate',
+]
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS facts ('
+    'host TEXT NOT NULL, '
+    'scope TEXT NOT NULL, '
+    'data TEXT, '
+    'expires REAL NOT NULL, '
+    'generation INTEGER NOT NULL, '
+    'PRIMARY KEY (host, scope))'
+)
+
+READ = 'SELECT data, expires, generation FROM facts WHERE host = ? AND scope = ?'
+
+# Store what a probe found, only if the facts were not invalidated since the probe read their generation
+WRITE = (
+    'INSERT INTO facts (host, scope, data, expires, generation) VALUES (?, ?, ?, ?, ?) '
+    'ON CONFLICT (host, scope) DO UPDATE SET data = excluded.data, expires = excluded.expires '
+    'WHERE facts.generation = excluded.generation'
+)
+
+# Forget the facts and move them on to the next generation
+INVALIDATE = (
+    'INSERT INTO facts (host, scope, data, expires, generation) VALUES (?, ?, NULL, 0, 1) '
+    'ON CONFLICT (host, scope) DO UPDATE SET data = NULL, expires = 0, generation = facts.generation + 1'
+)
+
+# The scope of the facts of the host itself, the drives of a VM are scoped by the name of the VM
+HOST = ''
+
+# The templates run by the probe script, in the order their output is parsed
+PROBE_TEMPLATES = (
+    'vm/kvm/commands/get_ceph_secret.j2',
+    'vm/kvm/commands/list_bridges.j2',
+)
+
+LOGGER = logging.getLogger('robot.host_facts')
+
+# Seconds a probe may run for. Probes only query virsh and the network config, so one that takes longer is stuck
+PROBE_TIMEOUT = 60
+
+
+class _Probe(LinuxMixin):
+    logger = LOGGER
+
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(settings.HOST_FACTS_DB_PATH), exist_ok=True)
+    # Autocommit mode, every statement used here is atomic on its own
+    connection = sqlite3.connect(settings.HOST_FACTS_DB_PATH, timeout=5, isolation_level=None)
+    connection.execute(SCHEMA)
+    return connection
+
+
+def _read(host_ip: str, scope: str) -> Tuple[Optional[Any], Optional[int]]:
+    """
+    Read cached facts
+    :returns: The facts if they are cached and fresh, and the generation to store newly probed facts under, which is
+        None if the cache could not be read
+    """
+    try:
+        with closing(_connect()) as connection:
+            row = connection.execute(READ, (host_ip, scope)).fetchone()
+    except sqlite3.Error:
+        LOGGER.error(f'Could not read cached facts for host {host_ip}.', exc_info=True)
+        return None, None
+    if row is None:
+        return None, 0
+    data, expires, generation = row
+    if data is None or expires <= time.time():
+        return None, generation
+    return json.loads(data), generation
+
+
+def _write(host_ip: str, scope: str, facts: Any, generation: int):
+    try:
+        with closing(_connect()) as connection:
+            connection.execute(
+                WRITE,
+                (host_ip, scope, json.dumps(facts), time.time() + settings.HOST_FACTS_TTL, generation),
+            )
+    except sqlite3.Error:
+        LOGGER.error(f'Could not cache facts for host {host_ip}.', exc_info=True)
+
+
+def _run(host_ip: str, commands: Tuple[str, ...], span: Span) -> Optional[Tuple[str, ...]]:
+    """
+    Run probe commands on the host as one batch
+    :returns: The stdout of each command, or None if they could not be run or did not all finish
+    """
+    client = None
+    try:
+        client = _Probe.open_client(host_ip, 'administrator')
+        results = _Probe.deploy_batch(list(commands), client, span, timeout=PROBE_TIMEOUT, merge_stderr=False)
+    except (OSError, SSHException, TimeoutError):
+        LOGGER.error(f'Exception occurred while probing host {host_ip}.', exc_info=True)
+        return None
+    finally:
+        _Probe.release_client(client)
+
+    for result in results:
+        if result.status is None:
+            LOGGER.error(f'Probe of host {host_ip} did not finish.')
+            return None
+        if result.stderr:
+            LOGGER.warning(f'Probe of host {host_ip} generated stderr.\n{result.stderr}')
+    return tuple(result.stdout for result in results)
+
+
+def _probe(host_ip: str, span: Span) -> Optional[Dict[str, Any]]:
+    """
+    Run the probe script on the host and parse its output into facts
+    :returns: The facts of the host, or None if the probe could not be run or did not finish
+    """
+    commands = tuple(
+        JINJA_ENV.get_template(template).render(host_sudo_passwd=settings.NETWORK_PASSWORD)
+        for template in PROBE_TEMPLATES
+    )
+    child_span = opentracing.tracer.start_span('probe_host_facts', child_of=span)
+    try:
+        output = _run(host_ip, commands, child_span)
+    finally:
+        child_span.finish()
+    if output is None:
+        return None
+    secret, bridges = output
+    return {'ceph_secret_uuid': secret.strip(), 'bridges': bridges.split()}
+
+
+def get(host_ip: str, span: Span, refresh: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Get the facts of a KVM host, probing the host only if there are no fresh facts for it in the cache
+    :param host_ip: The IP address of the host
+    :param span: The span used for tracing the task that's currently running
+    :param refresh: Whether to probe the host even if there are fresh facts for it
+    :returns: The facts of the host, with the keys `ceph_secret_uuid` and `bridges`, or None if the host could not be
+        probed
+    """
+    if not refresh:
+        facts, _ = _read(host_ip, HOST)
+        if facts is not None:
+            return facts
+
+    # Only one process probes a host at once, the others use what it found
+    with local_lock(f'host_facts_{host_ip}'):
+        facts, generation = _read(host_ip, HOST)
+        if facts is not None and not refresh:
+            return facts
+        facts = _probe(host_ip, span)
+        if facts is not None and generation is not None:
+            _write(host_ip, HOST, facts, generation)
+    return facts
+
+
+def drive_map(host_ip: str, vm_identifier: str, span: Span) -> Optional[Dict[str, str]]:
+    """
+    Get the drives of a VM on its host, as target name -> source name, probing the host only if there is no fresh drive
+    map for the VM in the cache
+    Only the update of the VM reads its drives, so there is no need to keep other processes from probing them at once.
+    :param host_ip: The IP address of the host of the VM
+    :param vm_identifier: The name of the VM on the host
+    :param span: The span used for tracing the task that's currently running
+    :returns: The drive map, or None if the host could not be probed or the VM has no drives on it
+    """
+    drives, generation = _read(host_ip, vm_identifier)
+    if drives is not None:
+        return drives
+
+    command = JINJA_ENV.get_template('vm/kvm/commands/list_drives.j2').render(
+        host_sudo_passwd=settings.NETWORK_PASSWORD,
+        vm_identifier=vm_identifier,
+    )
+    child_span = opentracing.tracer.start_span('list_drives', child_of=span)
+    try:
+        output = _run(host_ip, (command,), child_span)
+    finally:
+        child_span.finish()
+    if output is None:
+        return None
+
+    drives = {}
+    # Expect output as lines of `<target_name> <source_name>`
+    for line in output[0].splitlines():
+        parts = line.split(' ')
+        if len(parts) != 2:
+            LOGGER.warning(f'Got invalid line from drive list of VM {vm_identifier}\nLine: {line}')
+            continue
+        target, source = parts
+        drives[target] = source
+    # There should be at least one drive returned. If not, something went wrong
+    if not drives:
+        return None
+    if generation is not None:
+        _write(host_ip, vm_identifier, drives, generation)
+    return drives
+
+
+def invalidate(host_ip: str, vm_identifier: Optional[str] = None):
+    """
+    Forget facts about a host after a task has changed it, including any probe of them that is still running
+    :param host_ip: The IP address of the host
+    :param vm_identifier: The name of the VM whose drives changed, or None if the bridges of the host changed
+    """
+    try:
+        with closing(_connect()) as connection:
+            connection.execute(INVALIDATE, (host_ip, vm_identifier or HOST))
+    except sqlite3.Error:
+        LOGGER.error(f'Could not invalidate cached facts for host {host_ip}.', exc_info=True)
@@ -0,0 +1,98 @@
+"""
+Shared keep-alive connection pool for the cloudcix API clients of a process.
+
+Every cloudcix Client creates its own requests Session when the library is imported, which leaves one small pool per
+service and, in the Celery prefork workers, sessions that were created before the fork and so share sockets with the
+parent. install() points every IAAS, Membership and Support client at a single Session owned by the current process,
+whose pool size per host is set by API_POOL_MAXSIZE. A new Session is created and installed in each forked child.
+"""
+# stdlib
+import logging
+import os
+import threading
+from typing import Optional, Tuple
+# lib
+import requests
+from cloudcix.api import IAAS, Membership, Support
+from cloudcix.client import Client
+from requests.adapters import HTTPAdapter
+# local
+import settings
+
+__all__ = [
+    'install',
+    'session',
+    'stats',
+]
+
+# The applications whose clients Robot uses, directly or to get its token
+APPLICATIONS = (IAAS, Membership, Support)
+
+_session: Optional[requests.Session] = None
+_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def _create_session() -> requests.Session:
+    new_session = requests.Session()
+    new_session.verify = True
+    adapter = HTTPAdapter(pool_connections=settings.API_POOL_CONNECTIONS, pool_maxsize=settings.API_POOL_MAXSIZE)
+    new_session.mount('https://', adapter)
+    new_session.mount('http://', adapter)
+    return new_session
+
+
+def session() -> requests.Session:
+    """
+    Get the Session of the current process, creating it if this process does not have one yet
+    """
+    global _session, _pid
+    with _lock:
+        if _session is None or _pid != os.getpid():
+            _session = _create_session()
+            _pid = os.getpid()
+        return _session
+
+
+def install():
+    """
+    Point every client of the applications Robot uses at the Session of the current process
+    """
+    shared = session()
+    count = 0
+    for application in APPLICATIONS:
+        for client in vars(application).values():
+            if isinstance(client, Client):
+                client._session = shared
+                count += 1
+    logging.getLogger('robot.http_pool').debug(f'Installed the shared API session on {count} clients in #{_pid}')
+
+
+def _reinstall_after_fork():
+    global _session
+    # The parent's Session holds the parent's sockets, the child must never use it
+    _session = None
+    install()
+
+
+def stats() -> Tuple[int, int]:
+    """
+    :returns: The number of requests sent and the number of connections opened by the Session of this process. The
+              difference between the two is the number of requests that reused a kept-alive connection
+    """
+    if _session is None:
+        return 0, 0
+    num_requests = 0
+    num_connections = 0
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            num_requests += pool.num_requests
+            num_connections += pool.num_connections
+    return num_requests, num_connections
+
+
+os.register_at_fork(after_in_child=_reinstall_after_fork)
@@ -0,0 +1,149 @@
+"""
+Registry of tasks that have been dispatched but have not finished yet, so the same object is not dispatched twice.
+
+Entries are keyed by (object type, object id, action) and expire after a TTL, in case a worker dies without clearing
+its entry. The registry is a SQLite database in the local state directory, shared by the mainloop and the workers on
+the host through the file system, so it needs no extra service.
+"""
+# stdlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Sequence, Tuple
+# local
+import settings
+
+__all__ = [
+    'claim',
+    'release',
+    'release_task',
+    'task_key',
+]
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS inflight ('
+    'obj_type TEXT NOT NULL, '
+    'obj_id INTEGER NOT NULL, '
+    'action TEXT NOT NULL, '
+    'expires REAL NOT NULL, '
+    'PRIMARY KEY (obj_type, obj_id, action))'
+)
+
+# Insert the entry, or take over an existing one only if it has already expired
+CLAIM = (
+    'INSERT INTO inflight (obj_type, obj_id, action, expires) VALUES (?, ?, ?, ?) '
+    'ON CONFLICT (obj_type, obj_id, action) DO UPDATE SET expires = excluded.expires '
+    'WHERE inflight.expires <= ?'
+)
+
+RELEASE = 'DELETE FROM inflight WHERE obj_type = ? AND obj_id = ? AND action = ?'
+
+LOGGER = logging.getLogger('robot.inflight')
+
+
+_connection: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Get the process's connection to the registry, opening it on first use
+    Must be called with the lock held
+    """
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(settings.INFLIGHT_DB_PATH), exist_ok=True)
+        # Autocommit mode, every statement used here is atomic on its own. The connection is shared by the threads of
+        # the process, which take turns through the lock
+        connection = sqlite3.connect(
+            settings.INFLIGHT_DB_PATH,
+            timeout=5,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.execute(SCHEMA)
+        _connection = connection
+    return _connection
+
+
+def _execute(statement: str, parameters: Tuple) -> sqlite3.Cursor:
+    global _connection
+    with _lock:
+        try:
+            return _connect().execute(statement, parameters)
+        except sqlite3.Error:
+            # Open a fresh connection next time, in case this one is broken
+            if _connection is not None:
+                _connection.close()
+                _connection = None
+            raise
+
+
+def _reset_after_fork():
+    global _connection, _lock
+    # A connection must not be shared with the parent process
+    _connection = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def task_key(task_name: str, args: Optional[Sequence]) -> Optional[Tuple[str, int, str]]:
+    """
+    Generate the registry key for a task from its name and arguments
+    e.g. tasks.vm.build.build_vm(5) -> ('vm', 5, 'build')
+    :param task_name: The full name of the celery task
+    :param args: The positional arguments of the task, the first of which is the object id
+    :returns: The key, or None if the task does not act on a single object
+    """
+    parts = task_name.split('.')
+    if len(parts) != 4 or parts[0] != 'tasks' or not args or not isinstance(args[0], int):
+        return None
+    return parts[1], args[0], parts[2]
+
+
+def claim(obj_type: str, obj_id: int, action: str, ttl: Optional[int] = None) -> bool:
+    """
+    Attempt to register a task for the object as in flight
+    :param obj_type: The type of the object e.g. vm
+    :param obj_id: The id of the object
+    :param action: The action the task performs e.g. build
+    :param ttl: Seconds after which the entry expires. Defaults to settings.INFLIGHT_TTL
+    :returns: A flag stating whether the caller should dispatch the task. False only if a live entry already exists
+    """
+    now = time.time()
+    expires = now + (ttl or settings.INFLIGHT_TTL)
+    try:
+        cursor = _execute(CLAIM, (obj_type, obj_id, action, expires, now))
+        return cursor.rowcount == 1
+    except sqlite3.Error:
+        # Never block dispatching because of the registry, the tasks check the state of the object themselves
+        LOGGER.error(f'Could not claim in flight entry for {obj_type} #{obj_id} {action}.', exc_info=True)
+        return True
+
+
+def release(obj_type: str, obj_id: int, action: str):
+    """
+    Remove the in flight entry for the object, if there is one
+    :param obj_type: The type of the object e.g. vm
+    :param obj_id: The id of the object
+    :param action: The action the task performs e.g. build
+    """
+    try:
+        _execute(RELEASE, (obj_type, obj_id, action))
+    except sqlite3.Error:
+        LOGGER.error(f'Could not release in flight entry for {obj_type} #{obj_id} {action}.', exc_info=True)
+
+
+def release_task(task_name: str, args: Optional[Sequence]):
+    """
+    Remove the in flight entry for a finished task
+    :param task_name: The full name of the celery task
+    :param args: The positional arguments the task was called with
+    """
+    key = task_key(task_name, args)
+    if key is not None:
+        release(*key)
@@ -1,12 +1,19 @@
 # stdlib
 import logging
-import time
+from typing import Optional
 # lib
 from cloudcix.api.iaas import IAAS
-from cloudcix_token import Token
 # local
+import api_call
 import metrics
-from settings import LOGSTASH_ENABLE
+from change_feed import ChangeFeed, get_change_feed
+from poll_scheduler import PollScheduler
+from settings import (
+    LOGSTASH_ENABLE,
+    POLL_BACKOFF,
+    POLL_MAX_INTERVAL,
+    POLL_MIN_INTERVAL,
+)
 from robot import Robot
 from utils import setup_root_logger
 
@@ -32,10 +39,7 @@ def run_robot_get():
     logger = logging.getLogger('robot.mainloop.run_robot_get')
     # send run_robot list request
     try:
-        response = IAAS.run_robot.list(token=Token.get_instance().token)
-        # Token expire error "detail":"JWT token is expired. Please login again."
-        if response.status_code == 401 and 'token is expired' in response.json()['detail']:
-            run_robot_get()
+        response = api_call.call(IAAS.run_robot, 'list')
         if response.status_code != 200:
             logger.error(
                 f'HTTP {response.status_code} error occurred when attempting to fetch run_robot _metadata;\n'
@@ -64,10 +68,7 @@ def run_robot_post(project_ids):
     logger = logging.getLogger('robot.mainloop.run_robot_post')
     # send run_robot post request
     data = {'project_ids': project_ids}
-    response = IAAS.run_robot.create(token=Token.get_instance().token, data=data)
-    # Token expire error "detail":"JWT token is expired. Please login again."
-    if response.status_code == 401 and 'token is expired' in response.json()['detail']:
-        run_robot_post(project_ids)
+    response = api_call.call(IAAS.run_robot, 'create', data=data)
     if response.status_code != 200:
         logger.error(
             f'HTTP {response.status_code} error occurred when attempting to reset run_robot for project_ids '
@@ -77,12 +78,16 @@ def run_robot_post(project_ids):
     logger.debug(f'HTTP {response.status_code}, Acknowledged to reset run_robot for project_ids # {project_ids}.')
 
 
-def mainloop():
+def mainloop(feed: Optional[ChangeFeed] = None):
     """
     Run once 'while mainloop' at the start.
+    :param feed: The change feed that wakes the mainloop between checks. Defaults to the one in settings
     """
     # setup logging
     setup_logging()
+    if feed is None:
+        feed = get_change_feed()
+    scheduler = PollScheduler(POLL_MIN_INTERVAL, POLL_MAX_INTERVAL, POLL_BACKOFF)
 
     while True:
         # Send info about up-time
@@ -103,17 +108,36 @@ def mainloop():
             logger.debug('Robot so is waking up and preparing for run.')
 
             robot = Robot(backups, cephs, snapshots, virtual_routers, vms)
-            robot()
+            pending = robot()
             # Robot started run
             logger.debug('Initiating Robot for run.')
 
-            run_robot_post(project_ids)
-            # acknowledge run_robot to reset requested projects
-            logger.debug(f'Acknowledged run_robot api that requested projects id # {project_ids} are dispatched.')
+            # Leave run_robot set for the projects with tasks that are still in flight, so those tasks are dispatched
+            # again once they have finished
+            if pending is None:
+                pending = set(project_ids)
+            dispatched = [project_id for project_id in project_ids if project_id not in pending]
+            if len(dispatched) > 0:
+                run_robot_post(dispatched)
+                # acknowledge run_robot to reset requested projects
+                logger.debug(f'Acknowledged run_robot api that requested projects id # {dispatched} are dispatched.')
+            if len(pending) > 0:
+                logger.debug(
+                    f'Not resetting run_robot for projects # {sorted(pending)}, some tasks were still in flight.',
+                )
+            # There may be more work straight behind this run, so check again soon. A run that only found tasks still
+            # in flight leaves the interval unchanged, as they are neither new work nor a sign of a quiet region
+            if robot.queued > 0 or len(pending) == 0:
+                scheduler.hit()
         else:
-            logger.debug('No changes found for Robot so is going back to sleep for 15 seconds.')
-            # No changes in region, Robot going to sleep for 15 seconds
-            time.sleep(15)
+            # No changes in region, back off the interval
+            scheduler.miss()
+            logger.debug(f'No changes found for Robot so is waiting up to {scheduler.interval} seconds for a change.')
+        metrics.mainloop_poll_schedule(scheduler.interval, scheduler.hit_ratio)
+
+        # Wait until the feed signals a change or the poll interval passes
+        if feed.wait(scheduler.interval):
+            logger.debug('Change feed signalled a change in the region.')
 
 
 # mainloop starting point
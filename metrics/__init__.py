@@ -1,7 +1,26 @@
+from .api import (
+    cache_stats as api_cache_stats,
+    connection_stats as api_connection_stats,
+    request as api_request,
+)
 from .heartbeat import heartbeat
+from .mainloop import (
+    poll_schedule as mainloop_poll_schedule,
+    tasks_queued as mainloop_tasks_queued,
+)
 from .misc import (
     current_commit,
 )
+from .phase import (
+    duration as phase_duration,
+)
+from .ssh import (
+    command_stats as ssh_command_stats,
+    pool_stats as ssh_pool_stats,
+)
+from .telemetry import (
+    queue_stats as telemetry_queue_stats,
+)
 from .backup import (
     build_failure as backup_build_failure,
     build_success as backup_build_success,
@@ -48,10 +67,24 @@ from .vm import (
 )
 
 __all__ = [
+    # api
+    'api_cache_stats',
+    'api_connection_stats',
+    'api_request',
     # heartbeat
     'heartbeat',
+    # mainloop
+    'mainloop_poll_schedule',
+    'mainloop_tasks_queued',
     # misc
     'current_commit',
+    # phase
+    'phase_duration',
+    # ssh
+    'ssh_command_stats',
+    'ssh_pool_stats',
+    # telemetry
+    'telemetry_queue_stats',
     # backup
     'backup_build_failure',
     'backup_build_success',
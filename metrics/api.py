@@ -0,0 +1,38 @@
+# lib
+from cloudcix_metrics import prepare_metrics, Metric
+# local
+from settings import REGION_NAME
+
+
+def cache_stats(hits: int, misses: int):
+    """
+    Sends a data packet to Influx reporting the API cache counters of a worker
+    :param hits: The number of reads and lists served from the cache since the worker started
+    :param misses: The number of reads and lists that had to be sent to the API since the worker started
+    """
+    tags = {'region': REGION_NAME}
+    prepare_metrics(lambda: Metric('api_cache_hits', hits, tags))
+    prepare_metrics(lambda: Metric('api_cache_misses', misses, tags))
+
+
+def connection_stats(requests: int, connections: int):
+    """
+    Sends a data packet to Influx reporting how well a worker reuses its pooled API connections
+    :param requests: The number of API requests sent since the worker started
+    :param connections: The number of connections opened for them
+    """
+    tags = {'region': REGION_NAME}
+    prepare_metrics(lambda: Metric('api_requests', requests, tags))
+    prepare_metrics(lambda: Metric('api_connections', connections, tags))
+
+
+def request(endpoint: str, method: str, status: int, seconds: float):
+    """
+    Sends a data packet to Influx for a request made to the API
+    :param endpoint: The application and service of the client, e.g. iaas.vm/
+    :param method: The client method that was called
+    :param status: The HTTP status of the response, 0 if the API could not be reached
+    :param seconds: The time taken to get the response
+    """
+    tags = {'region': REGION_NAME, 'endpoint': endpoint, 'method': method, 'status': str(status)}
+    prepare_metrics(lambda: Metric('api_request_seconds', seconds, tags))
@@ -0,0 +1,28 @@
+# stdlib
+from typing import Dict
+# lib
+from cloudcix_metrics import prepare_metrics, Metric
+# local
+from settings import REGION_NAME
+
+
+def poll_schedule(interval: float, hit_ratio: float):
+    """
+    Sends a data packet to Influx reporting the state of the mainloop poll scheduler
+    :param interval: The number of seconds the mainloop will wait before its next check of run_robot
+    :param hit_ratio: The fraction of recent checks of run_robot that returned work
+    """
+    tags = {'region': REGION_NAME}
+    prepare_metrics(lambda: Metric('mainloop_poll_interval', interval, tags))
+    prepare_metrics(lambda: Metric('mainloop_poll_hit_ratio', hit_ratio, tags))
+
+
+def tasks_queued(counts: Dict[str, int]):
+    """
+    Sends a data packet to Influx for each type of task queued in a run of Robot
+    :param counts: The number of tasks queued, keyed by task label e.g. vm.build
+    """
+    for label, count in counts.items():
+        tags = {'region': REGION_NAME, 'task': label}
+        # Bind the loop variables now, the metric may be prepared after the loop has moved on
+        prepare_metrics(lambda count=count, tags=tags: Metric('mainloop_tasks_queued', count, tags))
@@ -2,7 +2,7 @@
 from cloudcix_metrics import prepare_metrics, Metric
 # local
 from settings import REGION_NAME
-from utils import get_current_git_sha
+import utils
 
 
 def current_commit():
@@ -11,4 +11,4 @@ def current_commit():
     Grafana will display this at the top of each Robot's dashboard
     :param sha: The commit sha obtained from git
     """
-    prepare_metrics(lambda: Metric('robot_commit', get_current_git_sha(), {'region': REGION_NAME}))
+    prepare_metrics(lambda: Metric('robot_commit', utils.get_current_git_sha(), {'region': REGION_NAME}))
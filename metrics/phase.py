@@ -0,0 +1,16 @@
+# lib
+from cloudcix_metrics import prepare_metrics, Metric
+# local
+from settings import REGION_NAME
+
+
+def duration(obj_type: str, action: str, step: str, seconds: float):
+    """
+    Sends a data packet to Influx reporting how long a step of a task's phase took
+    :param obj_type: The type of object the task acted on, e.g. backup
+    :param action: The action the task carried out, e.g. build
+    :param step: The step of the phase, one of read, begin, act, finish or unresource
+    :param seconds: The time taken by the step
+    """
+    tags = {'region': REGION_NAME, 'obj_type': obj_type, 'action': action, 'step': step}
+    prepare_metrics(lambda: Metric('phase_seconds', seconds, tags))
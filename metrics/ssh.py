@@ -0,0 +1,27 @@
+# lib
+from cloudcix_metrics import prepare_metrics, Metric
+# local
+from settings import REGION_NAME
+
+
+def pool_stats(handshakes: int, reuses: int):
+    """
+    Sends a data packet to Influx reporting how well a worker reuses its pooled SSH connections
+    :param handshakes: The number of connections opened with a full handshake since the worker started
+    :param reuses: The number of times an already open connection was handed out since the worker started
+    """
+    tags = {'region': REGION_NAME}
+    prepare_metrics(lambda: Metric('ssh_handshakes', handshakes, tags))
+    prepare_metrics(lambda: Metric('ssh_reuses', reuses, tags))
+
+
+def command_stats(bytes_read: int, wait_seconds: float):
+    """
+    Sends a data packet to Influx reporting how much output a command run over SSH produced and how long was spent
+    waiting on the host for it
+    :param bytes_read: The number of bytes read from the command's stdout and stderr
+    :param wait_seconds: The time spent blocked waiting for the host to send output or finish the command
+    """
+    tags = {'region': REGION_NAME}
+    prepare_metrics(lambda: Metric('ssh_command_bytes', bytes_read, tags))
+    prepare_metrics(lambda: Metric('ssh_command_wait_seconds', wait_seconds, tags))
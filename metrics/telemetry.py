@@ -0,0 +1,15 @@
+# lib
+from cloudcix_metrics import prepare_metrics, Metric
+# local
+from settings import REGION_NAME
+
+
+def queue_stats(depth: int, dropped: int):
+    """
+    Sends a data packet to Influx reporting the state of a worker's telemetry queue
+    :param depth: The number of spans and log flushes waiting to be sent
+    :param dropped: The number of spans and log flushes dropped since the worker started because the queue was full
+    """
+    tags = {'region': REGION_NAME}
+    prepare_metrics(lambda: Metric('telemetry_queue_depth', depth, tags))
+    prepare_metrics(lambda: Metric('telemetry_dropped', dropped, tags))
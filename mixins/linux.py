@@ -2,71 +2,321 @@
 mixin class containing methods that are needed by linux vm task classes
 methods included;
     - method to deploy a given command to a given host
-    - a helper method to fully retrieve the response from paramiko outputs
+    - a helper method to fully retrieve the response from paramiko outputs, blocking in select while the host is
+      silent and cancelling commands that run past their timeout
+    - method to deploy several commands to a host as one script, and split the output of each back out
+    - methods to borrow a connected client from the worker's SSH pool and give it back
 """
 # stdlib
+import codecs
 import logging
+import re
+import select
+import time
+import uuid
 from collections import deque
-from typing import Deque, Tuple
+from typing import Deque, List, NamedTuple, Optional, Tuple
 # lib
 import opentracing
 from jaeger_client import Span
 from paramiko import SSHClient
 # local
+import metrics
+import settings
+import ssh_pool
 
 __all__ = [
+    'CommandResult',
     'LinuxMixin',
 ]
 
+# Maximum number of bytes taken from the channel in one read
+READ_SIZE = 32768
+# Longest time to block in select before checking the channel again, guards against a missed wakeup
+SELECT_INTERVAL = 5
+
+
+class CommandResult(NamedTuple):
+    """
+    The output of one command of a batch sent with LinuxMixin.deploy_batch
+    """
+    stdout: str
+    stderr: str
+    # None if the command's output could not be found
+    status: Optional[int]
+
+
+class _OutputBuffer:
+    """
+    Collects the output of a command, keeping only the last `limit` bytes of it
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.chunks: Deque[bytes] = deque()
+        self.size = 0
+        self.total = 0
+        self.dropped = 0
+
+    def append(self, chunk: bytes):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self.total += len(chunk)
+        while self.size > self.limit:
+            excess = self.size - self.limit
+            head = self.chunks.popleft()
+            if len(head) > excess:
+                self.chunks.appendleft(head[excess:])
+                head = head[:excess]
+            self.size -= len(head)
+            self.dropped += len(head)
+
+    def text(self) -> str:
+        return b''.join(self.chunks).decode(errors='replace')
+
+
+class _LineForwarder:
+    """
+    Sends the output of a command to a logger one complete line at a time, as it is received
+    """
+
+    def __init__(self, logger: logging.Logger, hostname: str):
+        self.logger = logger
+        self.hostname = hostname
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.partial = ''
+
+    def feed(self, chunk: bytes):
+        *lines, self.partial = (self.partial + self.decoder.decode(chunk)).split('\n')
+        for line in lines:
+            self.logger.debug('Linux Host %s: %s', self.hostname, line)
+
+    def flush(self):
+        self.partial += self.decoder.decode(b'', final=True)
+        if self.partial:
+            self.logger.debug('Linux Host %s: %s', self.hostname, self.partial)
+            self.partial = ''
+
+
+def _batch_script(sentinel: str, commands: List[str]) -> str:
+    """
+    Build the script that runs a batch of commands, delimiting the output of each with sentinel lines
+    Each command runs in its own subshell, and the script carries on to the next command whatever the exit status of
+    the previous one.
+    :param sentinel: The token the sentinel lines start with, unique to the batch
+    :param commands: The commands to run, in order
+    :returns: The script to run on the host
+    """
+    script = []
+    for index, command in enumerate(commands):
+        script.append(
+            f"printf '%s\\n' '{sentinel}:BEGIN:{index}'; printf '%s\\n' '{sentinel}:BEGIN:{index}' >&2\n"
+            # The leading no-op keeps the subshell valid if the command renders empty
+            f'(\n:\n{command}\n)\n'
+            f"__robot_status=$?; printf '\\n%s\\n' \"{sentinel}:END:{index}:$__robot_status\"; "
+            f"printf '\\n%s\\n' '{sentinel}:END:{index}' >&2\n",
+        )
+    return ''.join(script)
+
+
+def _split_batch_output(
+        sentinel: str,
+        count: int,
+        stdout: str,
+        stderr: str,
+        merge_stderr: bool,
+) -> List[CommandResult]:
+    """
+    Split the output of a batch script back into the output of each of its commands
+    :param sentinel: The token the sentinel lines of the batch start with
+    :param count: The number of commands in the batch
+    :param stdout: The stdout of the whole script
+    :param stderr: The stderr of the whole script
+    :param merge_stderr: Whether to append the stderr of each command to its stdout and leave its stderr empty
+    :returns: The result of each command, in order. A command whose output could not be found has a status of None
+    """
+    out_sections = {
+        int(index): (text, int(status))
+        for index, text, status in re.findall(
+            rf'^{sentinel}:BEGIN:(\d+)\n(.*?)\n{sentinel}:END:\1:(\d+)$',
+            stdout,
+            flags=re.M | re.S,
+        )
+    }
+    err_sections = {
+        int(index): text
+        for index, text in re.findall(
+            rf'^{sentinel}:BEGIN:(\d+)\n(.*?)\n{sentinel}:END:\1$',
+            stderr,
+            flags=re.M | re.S,
+        )
+    }
+    results = []
+    for index in range(count):
+        out, status = out_sections.get(index, ('', None))
+        err = err_sections.get(index, '')
+        if merge_stderr:
+            out, err = out + err, ''
+        results.append(CommandResult(out, err, status))
+    return results
+
 
 class LinuxMixin:
     logger: logging.Logger
 
     @classmethod
-    def deploy(cls, command: str, client: SSHClient, span: Span) -> Tuple[str, str]:
+    def open_client(cls, host: str, username: str) -> SSHClient:
+        """
+        Get a client connected to the Linux host, reusing one of this worker's pooled connections if one is free
+        :param host: The IP address of the host
+        :param username: The user to log in to the host as
+        :return: The connected client, which must be given back with `release_client` in a finally block
+        """
+        return ssh_pool.checkout(host, username)
+
+    @classmethod
+    def release_client(cls, client: Optional[SSHClient]):
+        """
+        Give a client from `open_client` back to the pool, for the next task on this worker to reuse
+        :param client: The client, or None if `open_client` failed
+        """
+        ssh_pool.checkin(client)
+
+    @classmethod
+    def deploy(
+            cls,
+            command: str,
+            client: SSHClient,
+            span: Span,
+            timeout: Optional[float] = None,
+            stream: bool = False,
+    ) -> Tuple[str, str]:
         """
         Deploy the given `command` to the Linux host accessible via the supplied `client`
         :param command: The command to run on the host
         :param client: A paramiko.Client instance that is connected to the host
             The client is passed instead of the host_ip so we can avoid having to open multiple connections
         :param span: The span used for tracing the task that's currently running
+        :param timeout: Seconds the command may run for before it is cancelled, defaults to SSH_COMMAND_TIMEOUT. No
+            limit if both are None
+        :param stream: Whether to forward each line of output to the debug log as soon as it is received
         :return: The messages retrieved from stdout and stderr of the command
+        :raises TimeoutError: If the command did not finish within the timeout
+        """
+        # stderr is added to output as stderr is not evaluated properly, needs to be removed.
+        output, _ = cls._execute(command, client, span, timeout, stream, merge_stderr=True)
+        return output, ''
+
+    @classmethod
+    def deploy_batch(
+            cls,
+            commands: List[str],
+            client: SSHClient,
+            span: Span,
+            timeout: Optional[float] = None,
+            stream: bool = False,
+            merge_stderr: bool = True,
+    ) -> List[CommandResult]:
+        """
+        Deploy several commands to the Linux host accessible via the supplied `client` as a single remote script, to
+        save a full exec and close round trip for each of them
+        Each command runs in its own subshell, in order, and the script carries on to the next command whatever the
+        exit status of the previous one. The output of each command is delimited by sentinel lines and split back out.
+        :param commands: The commands to run on the host
+        :param client: A paramiko.Client instance that is connected to the host
+        :param span: The span used for tracing the task that's currently running
+        :param timeout: Seconds the whole script may run for before it is cancelled, defaults to SSH_COMMAND_TIMEOUT. No
+            limit if both are None
+        :param stream: Whether to forward each line of output to the debug log as soon as it is received
+        :param merge_stderr: Whether to append the stderr of each command to its stdout and leave its stderr empty,
+            which matches the output of `deploy`
+        :return: The result of each command, in the same order as `commands`. A command whose output could not be
+            found, because the script was cut short or its output was too long to keep, has a status of None
+        :raises TimeoutError: If the script did not finish within the timeout
+        """
+        # A fresh token per batch, so no output of the commands themselves can be mistaken for a sentinel
+        sentinel = f'ROBOT-BATCH-{uuid.uuid4().hex}'
+        script = _batch_script(sentinel, commands)
+        stdout, stderr = cls._execute(script, client, span, timeout, stream, merge_stderr=False)
+        return _split_batch_output(sentinel, len(commands), stdout, stderr, merge_stderr)
+
+    @classmethod
+    def _execute(
+            cls,
+            command: str,
+            client: SSHClient,
+            span: Span,
+            timeout: Optional[float],
+            stream: bool,
+            merge_stderr: bool,
+    ) -> Tuple[str, str]:
+        """
+        Run the command on the host and read its output until it finishes, blocking in select while the command
+        produces none
+        :param merge_stderr: Whether to collect stderr into the stdout buffer in the order it is received
+        :return: The stdout and stderr of the command
         """
         hostname = client.get_transport().sock.getpeername()[0]
-        cls.logger.debug(f'Executing command {command} to Linux Host {hostname}')
+        cls.logger.debug('Executing command %s to Linux Host %s', command, hostname)
+        if timeout is None:
+            timeout = settings.SSH_COMMAND_TIMEOUT
 
         # Run the command via the client
         child_span = opentracing.tracer.start_span('exec_command', child_of=span)
-        _, stdout, stderr = client.exec_command(command)
+        _, stdout, _ = client.exec_command(command)
         cls.logger.debug(f'Executed command to Linux Host {hostname}')
         child_span.finish()
 
-        # Read from stdout and stderr, keep going until the connection is closed
+        # Read from stdout and stderr until the host signals the end of the output
         channel = stdout.channel
-        output_fragments: Deque[str] = deque()
-        error_fragments: Deque[str] = deque()
+        output = _OutputBuffer(settings.SSH_OUTPUT_MAX_BYTES)
+        error = output if merge_stderr else _OutputBuffer(settings.SSH_OUTPUT_MAX_BYTES)
+        lines = _LineForwarder(cls.logger, hostname) if stream else None
+        waited = 0.0
+        deadline = None if timeout is None else time.monotonic() + timeout
         child_span = opentracing.tracer.start_span('read_channel', child_of=span)
-        while True:
-            # Check the status of the connection, and read any remaining output
-            closed = channel.closed
-            while channel.recv_ready():
-                output_fragments.append(stdout.read().decode())  # Read the entirety of stdout
-
-            while channel.recv_stderr_ready():
-                # error_fragments.append(stderr.read().decode())  # Read the entirety of stderr
-                # temporarily adding stderr to output as stderr is not evaluated properly, need to be removed.
-                output_fragments.append(stderr.read().decode())
-
-            if closed:
-                break
-        cls.logger.debug(f'Completed read of stdout and stderr from Linux Host {hostname}')
-        child_span.finish()
-
-        # Sorting out the output and the error
-        output = ''.join(output_fragments)
-        error = ''.join(error_fragments)
+        try:
+            while True:
+                if channel.recv_ready():
+                    buffer, chunk = output, channel.recv(READ_SIZE)
+                elif channel.recv_stderr_ready():
+                    buffer, chunk = error, channel.recv_stderr(READ_SIZE)
+                elif channel.eof_received or channel.closed:
+                    break
+                else:
+                    remaining = SELECT_INTERVAL if deadline is None else deadline - time.monotonic()
+                    if remaining <= 0:
+                        channel.close()
+                        raise TimeoutError(f'Command to Linux Host {hostname} did not finish within {timeout} seconds')
+                    start = time.monotonic()
+                    select.select([channel], [], [], min(remaining, SELECT_INTERVAL))
+                    waited += time.monotonic() - start
+                    continue
+                buffer.append(chunk)
+                if lines is not None:
+                    lines.feed(chunk)
+            if lines is not None:
+                lines.flush()
+            # The exit status follows the end of the output, wait for it so the channel closes cleanly on the
+            # pooled connection
+            channel.status_event.wait(None if deadline is None else max(deadline - time.monotonic(), 0))
+        finally:
+            total = output.total if merge_stderr else output.total + error.total
+            child_span.set_tag('bytes_read', total)
+            child_span.set_tag('wait_seconds', waited)
+            child_span.finish()
+            metrics.ssh_command_stats(total, waited)
+        cls.logger.debug(
+            f'Completed read of {total} bytes of stdout and stderr from Linux Host {hostname}, '
+            f'{waited:.2f}s spent waiting on the host',
+        )
+        if output.dropped > 0 or error.dropped > 0:
+            cls.logger.warning(
+                f'Output of command to Linux Host {hostname} exceeded {settings.SSH_OUTPUT_MAX_BYTES} bytes, only the '
+                'last part was kept',
+            )
 
-        return output, error
+        return output.text(), '' if merge_stderr else error.text()
 
     @classmethod
     def netplan_bridge_setup(cls, bridge: str, client: SSHClient, filename: str, requester: str, span: Span) -> bool:
@@ -80,42 +330,52 @@ class LinuxMixin:
         """
         success = True
         hostname = client.get_transport().sock.getpeername()[0]
+        # The client is pooled, so the SFTP session must be closed rather than left to end with the connection
         sftp = client.open_sftp()
-        file_exists = True
         try:
-            child_span = opentracing.tracer.start_span('netplan_bridge_check', child_of=span)
-            sftp.open(filename, mode='r')
-            child_span.finish()
-        except IOError:
-            file_exists = False
+            file_exists = True
+            try:
+                child_span = opentracing.tracer.start_span('netplan_bridge_check', child_of=span)
+                sftp.open(filename, mode='r').close()
+                child_span.finish()
+            except IOError:
+                file_exists = False
 
-        if file_exists:
-            return success
+            if file_exists:
+                return success
 
-        cls.logger.debug(f'Requester #{requester} :Bridge file {filename} not found, so creating the bridge.')
-        temp_file = f'/tmp/{filename}'
-        try:
-            with sftp.open(temp_file, mode='w', bufsize=1) as yaml:
-                yaml.write(bridge)
-            cls.logger.debug(
-                f'Requester #{requester}: Successfully wrote file {temp_file} to target #{hostname}',
-            )
-            # move temp file to netplan dir and apply netplan changes
-            netplan_cmd = f'sudo mv {temp_file} /etc/netplan/{filename} && sudo netplan apply'
-            child_span = opentracing.tracer.start_span('netplan_bridge_create', child_of=span)
-            stdout, stderr = cls.deploy(netplan_cmd, client, child_span)
-            if stderr:
-                cls.logger.error(
-                    f'Requester #{requester}: Applying netplan to target #{hostname} generated stderr: \n{stderr}',
-                )
-            else:
+            cls.logger.debug(f'Requester #{requester} :Bridge file {filename} not found, so creating the bridge.')
+            temp_file = f'/tmp/{filename}'
+            try:
+                with sftp.open(temp_file, mode='w', bufsize=1) as yaml:
+                    yaml.write(bridge)
                 cls.logger.debug(
-                    f'Requester #{requester}: Applying netplan to target #{hostname} generated stdout: \n{stdout}',
+                    f'Requester #{requester}: Successfully wrote file {temp_file} to target #{hostname}',
                 )
-        except IOError:
-            cls.logger.error(
-                f'Requester #{requester}: Failed to write {temp_file} to target #{hostname}',
-                exc_info=True,
-            )
-            success = False
-        return success
+                # move temp file to netplan dir and apply netplan changes, netplan applies are serialised on the host
+                netplan_cmd = (
+                    f'sudo mv {temp_file} /etc/netplan/{filename} && '
+                    'sudo flock /run/lock/robot-netplan.lock netplan apply'
+                )
+                child_span = opentracing.tracer.start_span('netplan_bridge_create', child_of=span)
+                stdout, stderr = cls.deploy(netplan_cmd, client, child_span)
+                if stderr:
+                    cls.logger.error(
+                        f'Requester #{requester}: Applying netplan to target #{hostname} generated stderr: \n{stderr}',
+                    )
+                else:
+                    cls.logger.debug(
+                        'Requester #%s: Applying netplan to target #%s generated stdout: \n%s',
+                        requester,
+                        hostname,
+                        stdout,
+                    )
+            except IOError:
+                cls.logger.error(
+                    f'Requester #{requester}: Failed to write {temp_file} to target #{hostname}',
+                    exc_info=True,
+                )
+                success = False
+            return success
+        finally:
+            sftp.close()
@@ -25,7 +25,7 @@ class WindowsMixin:
         :param cmd: command to execute on the host
         :param span: The span used for tracing the task that's currently running
         """
-        cls.logger.debug(f'Deploying command to Windows Host {management_ip}\n{cmd}')
+        cls.logger.debug('Deploying command to Windows Host %s\n%s', management_ip, cmd)
         session = Session(management_ip, auth=('administrator', NETWORK_PASSWORD))
         child_span = opentracing.tracer.start_span('run_ps', child_of=span)
         response = session.run_ps(cmd)
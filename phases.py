@@ -0,0 +1,333 @@
+"""
+Table driven engine for the phases a task takes an object through.
+
+Every task reads its object, checks that it is still in a state the action picks objects up in, moves it into the
+in-progress state for the action, reads the Server it lives on, hands it to the handler for that type of Server and
+then either moves it into the finished state and runs any follow up work, or unresources it and emails the failure. The
+states come from the filter lists in state.py, so a task only declares what is particular to it in a Phase.
+
+Each step is timed and reported through metrics.phase_duration with the same names for every object type and action.
+"""
+# stdlib
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+# lib
+import opentracing
+from cloudcix.api.iaas import IAAS
+from cloudcix.client import Client
+from jaeger_client import Span
+# local
+import api_call
+import metrics
+import prefetch
+import state
+import transitions
+import utils
+
+__all__ = [
+    'LINUX_SERVERS',
+    'Phase',
+    'run',
+    'TABLE',
+    'WINDOWS_SERVERS',
+]
+
+# The states each action picks objects up in, mapped to the in-progress state the object is held in while the action
+# runs and the state it is left in when the action succeeds
+TABLE: Dict[str, Dict[int, Tuple[int, int]]] = {
+    'build': {source: (state.BUILDING, state.RUNNING) for source in state.BUILD_FILTERS},
+    'quiesce': {state.QUIESCE: (state.QUIESCING, state.QUIESCED), state.SCRUB: (state.SCRUB_PREP, state.SCRUB_QUEUE)},
+    'restart': {source: (state.RESTARTING, state.RUNNING) for source in state.RESTART_FILTERS},
+    'scrub': {state.SCRUB: (state.SCRUBBING, state.CLOSED), state.SCRUB_QUEUE: (state.SCRUBBING, state.CLOSED)},
+    'update': {
+        state.RUNNING_UPDATE: (state.RUNNING_UPDATING, state.RUNNING),
+        state.QUIESCED_UPDATE: (state.QUIESCED_UPDATING, state.QUIESCED),
+    },
+}
+
+# Types of Server that each family of handlers supports
+WINDOWS_SERVERS = ['HyperV']
+LINUX_SERVERS = ['KVM', 'GPU A100']
+
+
+class Phase:
+    """
+    Declares how a task carries out one action on one type of object
+    """
+
+    def __init__(
+            self,
+            obj_type: str,
+            action: str,
+            client: Client,
+            handlers: Dict[str, Callable[[Dict[str, Any], Span], bool]],
+            server_id: Callable[[Dict[str, Any]], int],
+            failure_metric: Callable[[], None],
+            failure_email: Callable[[Dict[str, Any]], None],
+            success_metric: Optional[Callable[[], None]] = None,
+            finished_data: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+            on_success: Optional[Callable[[Dict[str, Any], Span], None]] = None,
+            sources: Optional[Iterable[int]] = None,
+            deleted_ok: bool = False,
+    ):
+        """
+        :param obj_type: The name of the type of object, e.g. backup
+        :param action: The action carried out, one of the keys of TABLE
+        :param client: The client used to read and update the object
+        :param handlers: The handlers for the action keyed by Server type name
+        :param server_id: Gets the id of the Server the object lives on
+        :param failure_metric: Metric sent when the action fails
+        :param failure_email: Sends the email that tells the user the action failed
+        :param success_metric: Metric sent when the action succeeds
+        :param finished_data: Extra fields sent with the update to the finished state
+        :param on_success: Follow up work run once the object is in the finished state. The object still holds the state
+            it was picked up in and the Server it lives on, under server_data
+        :param sources: Limits the states the object may be picked up in to a subset of those in TABLE for the action
+        :param deleted_ok: Whether the object may already have been deleted from the API, in which case the task just
+            returns instead of failing
+        """
+        states = TABLE[action]
+        if sources is not None:
+            states = {source: states[source] for source in sources}
+        for source, (progress, finished) in states.items():
+            if not (state.is_legal(source, progress) and state.is_legal(progress, finished)):
+                raise ValueError(
+                    f'{obj_type} {action} moves objects from {state.STATE_NAMES[source]} through '
+                    f'{state.STATE_NAMES[progress]} to {state.STATE_NAMES[finished]}, which is not legal.',
+                )
+        # The name of the type of object, e.g. backup, used in logs, spans and metrics
+        self.obj_type = obj_type
+        # The action carried out, one of the keys of TABLE
+        self.action = action
+        # The client used to read and update the object
+        self.client = client
+        # The states the object may be picked up in, mapped to its in-progress and finished states
+        self.states: Dict[int, Tuple[int, int]] = states
+        # The handlers for the action keyed by Server type name, each returning whether the action succeeded
+        self.handlers: Dict[str, Callable[[Dict[str, Any], Span], bool]] = handlers
+        # Gets the id of the Server the object lives on
+        self.server_id: Callable[[Dict[str, Any]], int] = server_id
+        # Extra fields sent with the update to the finished state
+        self.finished_data: Callable[[Dict[str, Any]], Dict[str, Any]] = finished_data or (lambda obj: {})
+        # Metric sent when the action succeeds, if there is one
+        self.success_metric: Optional[Callable[[], None]] = success_metric
+        # Metric sent when the action fails
+        self.failure_metric: Callable[[], None] = failure_metric
+        # Sends the email that tells the user the action failed
+        self.failure_email: Callable[[Dict[str, Any]], None] = failure_email
+        # Follow up work run once the object is in the finished state, if there is any
+        self.on_success: Optional[Callable[[Dict[str, Any], Span], None]] = on_success
+        # Whether the object may already have been deleted from the API by the time the task runs
+        self.deleted_ok = deleted_ok
+
+    @property
+    def label(self) -> str:
+        """
+        The name of the object type as it appears in logs, e.g. Backup
+        """
+        return self.obj_type.replace('_', ' ').title()
+
+
+def _timed(phase: Phase, step: str, started: float):
+    """
+    Report how long a step of a phase took
+    :param phase: The phase being run
+    :param step: The name of the step, e.g. read
+    :param started: The time.monotonic() value from when the step started
+    """
+    metrics.phase_duration(phase.obj_type, phase.action, step, time.monotonic() - started)
+
+
+def _read(phase: Phase, pk: int, snapshots: Optional[Dict[str, Any]], span: Span) -> Optional[Dict[str, Any]]:
+    """
+    Read the object the phase acts on
+    :param phase: The phase being run
+    :param pk: The id of the object
+    :param snapshots: The snapshots shipped with the task, keyed by object type
+    :param span: The span of the read
+    :returns: The object, an empty dict if it could not be read, or None if it was already deleted and the phase
+        allows that
+    """
+    if not phase.deleted_ok:
+        return prefetch.read(phase.client, pk, snapshots, phase.obj_type, span=span)
+
+    # Don't use utils so we can check the response code
+    response = api_call.call(phase.client, 'read', pk=pk, span=span)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        logging.getLogger(f'robot.tasks.{phase.obj_type}.{phase.action}').error(
+            f'HTTP {response.status_code} error occurred when attempting to fetch {phase.label} #{pk}.\n'
+            f'Response Text: {response.content.decode()}',
+        )
+        return {}
+    return response.json()['content']
+
+
+def _unresource(phase: Phase, obj: Dict[str, Any], span: Span):
+    """
+    Unresource the object because something went wrong, and let the user know
+    :param phase: The phase that failed
+    :param obj: The object that the phase failed on
+    :param span: The span of the task
+    """
+    logger = logging.getLogger(f'robot.tasks.{phase.obj_type}.{phase.action}')
+    pk = obj['id']
+    phase.failure_metric()
+    started = time.monotonic()
+
+    # Update state to UNRESOURCED in the API
+    child_span = opentracing.tracer.start_span('update_to_unresourced', child_of=span)
+    response = utils.api_partial_update(phase.client, pk=pk, data={'state': state.UNRESOURCED}, span=child_span)
+    child_span.finish()
+
+    if response.status_code != 200:
+        logger.error(
+            f'Could not update {phase.label} #{pk} to state UNRESOURCED.\nResponse: {response.content.decode()}.',
+        )
+
+    child_span = opentracing.tracer.start_span('send_email', child_of=span)
+    try:
+        phase.failure_email(obj)
+    except Exception:
+        logger.error(f'Failed to send {phase.action} failure email for {phase.label} #{pk}', exc_info=True)
+    child_span.finish()
+    _timed(phase, 'unresource', started)
+
+
+def _act(phase: Phase, obj: Dict[str, Any], snapshots: Optional[Dict[str, Any]], span: Span) -> bool:
+    """
+    Read the Server the object lives on and pass the object to the handler for that type of Server
+    :param phase: The phase being run
+    :param obj: The object to carry the action out on
+    :param snapshots: The snapshots shipped with the task, keyed by object type
+    :param span: The span of the task
+    :returns: A flag stating whether the action succeeded
+    """
+    logger = logging.getLogger(f'robot.tasks.{phase.obj_type}.{phase.action}')
+    pk = obj['id']
+
+    # Backups and Snapshots live on the Server of their VM
+    span_name = 'read_vm_server' if phase.obj_type == 'vm' else f'read_{phase.obj_type}_vm_server'
+    child_span = opentracing.tracer.start_span(span_name, child_of=span)
+    server = prefetch.read(IAAS.server, phase.server_id(obj), snapshots, 'server', span=child_span)
+    child_span.finish()
+    if not bool(server):
+        logger.error(f'Could not {phase.action} {phase.label} #{pk} as the associated server was not readable')
+        span.set_tag('return_reason', 'server_not_read')
+        return False
+    server_type = server['type']['name']
+    obj['server_data'] = server
+
+    success = False
+    child_span = opentracing.tracer.start_span(phase.action, child_of=span)
+    try:
+        handler = phase.handlers.get(server_type)
+        if handler is not None:
+            success = handler(obj, child_span)
+            child_span.set_tag('server_type', server_type)
+        else:
+            error = f'Unsupported server type #{server_type} for {phase.label} #{pk}.'
+            logger.error(error)
+            obj['errors'].append(error)
+            child_span.set_tag('server_type', 'unsupported')
+    except Exception as err:
+        error = f'An unexpected error occurred when attempting to {phase.action} {phase.label} #{pk}.'
+        logger.error(error, exc_info=True)
+        obj['errors'].append(f'{error} Error: {err}')
+    child_span.finish()
+    span.set_tag('return_reason', f'success: {success}')
+
+    if not success:
+        obj.pop('server_data')
+    return success
+
+
+def run(phase: Phase, pk: int, span: Span, snapshots: Optional[Dict[str, Any]] = None):
+    """
+    Carry the action of a phase out on an object
+    :param phase: The phase to run
+    :param pk: The id of the object
+    :param span: The span of the task
+    :param snapshots: The snapshots shipped with the task, keyed by object type
+    """
+    logger = logging.getLogger(f'robot.tasks.{phase.obj_type}.{phase.action}')
+    logger.info(f'Commencing {phase.action} of {phase.label} #{pk}')
+
+    # Read the object
+    started = time.monotonic()
+    child_span = opentracing.tracer.start_span(f'read_{phase.obj_type}', child_of=span)
+    obj = _read(phase, pk, snapshots, child_span)
+    child_span.finish()
+    _timed(phase, 'read', started)
+
+    if obj is None:
+        logger.info(f'Received {phase.action} task for {phase.label} #{pk} but it was already deleted from the API')
+        span.set_tag('return_reason', 'already_deleted')
+        return
+
+    # Ensure it is not empty
+    if not bool(obj):
+        # Rely on the utils method for logging
+        phase.failure_metric()
+        span.set_tag('return_reason', f'invalid_{phase.obj_type}_id')
+        return
+
+    # Ensure that the object is still in a state this action picks objects up in
+    source = obj['state']
+    if source not in phase.states:
+        logger.warning(
+            f'Cancelling {phase.action} of {phase.label} #{pk}. Expected state to be one of '
+            f'{[state.STATE_NAMES[valid] for valid in phase.states]}, found {state.STATE_NAMES.get(source, source)}.',
+        )
+        span.set_tag('return_reason', 'not_in_valid_state')
+        return
+    progress, finished = phase.states[source]
+
+    # Move the object into the in-progress state, unless another worker already has
+    started = time.monotonic()
+    child_span = opentracing.tracer.start_span(f'update_to_{state.STATE_NAMES[progress]}', child_of=span)
+    won = transitions.begin(phase.client, obj, progress, span=child_span)
+    child_span.finish()
+    _timed(phase, 'begin', started)
+
+    if not won:
+        phase.failure_metric()
+        span.set_tag('return_reason', 'could_not_update_state')
+        return
+
+    # Carry out the action
+    obj['errors'] = []
+    started = time.monotonic()
+    success = _act(phase, obj, snapshots, span)
+    _timed(phase, 'act', started)
+
+    if not success:
+        logger.error(f'Failed to {phase.action} {phase.label} #{pk}')
+        _unresource(phase, obj, span)
+        return
+
+    logger.info(f'Successfully completed {phase.action} of {phase.label} #{pk}')
+    started = time.monotonic()
+    child_span = opentracing.tracer.start_span(f'update_to_{state.STATE_NAMES[finished]}', child_of=span)
+    response = utils.api_partial_update(
+        phase.client,
+        pk=pk,
+        data={'state': finished, **phase.finished_data(obj)},
+        span=child_span,
+    )
+    child_span.finish()
+    _timed(phase, 'finish', started)
+
+    if response.status_code != 200:
+        logger.error(
+            f'Could not update {phase.label} #{pk} to state {state.STATE_NAMES[finished].upper()}.\n'
+            f'Response: {response.content.decode()}.',
+        )
+        phase.failure_metric()
+        return
+    if phase.success_metric is not None:
+        phase.success_metric()
+    if phase.on_success is not None:
+        phase.on_success(obj, span)
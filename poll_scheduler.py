@@ -0,0 +1,65 @@
+"""
+Adaptive scheduler for the mainloop checks of run_robot.
+
+While run_robot keeps returning work the interval is held at the minimum, so a burst of requests is dispatched as it
+arrives. Each check that returns nothing grows the interval by the backoff factor until it reaches the ceiling.
+"""
+# stdlib
+from collections import deque
+from typing import Deque
+
+__all__ = [
+    'PollScheduler',
+]
+
+
+class PollScheduler:
+    """
+    Keeps track of the current poll interval and the hit ratio over a window of recent checks
+    """
+    # Number of recent checks the hit ratio is calculated over
+    WINDOW = 100
+
+    # The number of seconds to wait before the next check
+    interval: float
+
+    def __init__(self, min_interval: float, max_interval: float, backoff: float = 2.0):
+        """
+        :param min_interval: The interval used while checks keep returning work
+        :param max_interval: The ceiling the interval backs off to while the region is idle
+        :param backoff: The factor the interval grows by after each check that returned nothing
+        :raises ValueError: If the minimum interval is not positive or the backoff does not grow the interval
+        """
+        if min_interval <= 0:
+            raise ValueError(f'The minimum poll interval must be greater than 0, got {min_interval}.')
+        if backoff <= 1:
+            raise ValueError(f'The poll backoff must be greater than 1, got {backoff}.')
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        # Start tight so that anything queued up while Robot was down gets picked up quickly
+        self.interval = self.min_interval
+        self._results: Deque[bool] = deque(maxlen=self.WINDOW)
+
+    def hit(self):
+        """
+        Record a check that returned work and tighten the interval
+        """
+        self._results.append(True)
+        self.interval = self.min_interval
+
+    def miss(self):
+        """
+        Record a check that returned no work and back off the interval
+        """
+        self._results.append(False)
+        self.interval = min(self.interval * self.backoff, self.max_interval)
+
+    @property
+    def hit_ratio(self) -> float:
+        """
+        The fraction of the recent checks that returned work
+        """
+        if len(self._results) == 0:
+            return 0.0
+        return sum(self._results) / len(self._results)
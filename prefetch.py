@@ -0,0 +1,201 @@
+"""
+Snapshots of API objects fetched by the mainloop and shipped to the tasks in their messages.
+
+When TASK_SNAPSHOTS is enabled, Robot reads every VM and Virtual Router of a run, and the Servers and Virtual Routers
+the VMs depend on, with a few bulk list requests. Each task is then sent the snapshots of the objects it would
+otherwise start by reading. A snapshot records when it was fetched and the `updated` timestamp of its object. A task
+only considers a snapshot younger than TASK_SNAPSHOT_MAX_AGE, so a message that sat in the queue falls back to a fresh
+read. Before using it, the task checks with a list request filtered on a later `updated` that the object has not
+changed since, which returns nothing unless it has. If it has changed the request returns the object itself, so it
+costs no more than a read, and the response is empty for the objects that did not change.
+
+Snapshots end up in the broker, so no secrets are shipped in them. Secret fields that the tasks never read are dropped
+from the snapshots, and objects holding a secret that the tasks do need are not snapshotted at all, so their tasks read
+them fresh from the API.
+"""
+# stdlib
+import copy
+import logging
+import time
+from typing import Any, Dict, Iterable, Optional
+# lib
+from cloudcix.api.iaas import IAAS
+from cloudcix.client import Client
+# local
+import api_call
+import settings
+import utils
+
+__all__ = [
+    'enabled',
+    'read',
+    'Snapshots',
+]
+
+LOGGER = logging.getLogger('robot.prefetch')
+
+# Secret fields that no task reads from the objects it is sent, so are dropped from the snapshots
+DROPPED_FIELDS = frozenset({'admin_password'})
+# Secret fields that the tasks need, e.g. the VPN keys of a Virtual Router. Objects holding one are not snapshotted
+SECRET_FIELDS = frozenset({'ike_pre_shared_key'})
+
+
+def _strip(value: Any) -> Any:
+    """
+    Copy an object without its dropped fields, at any depth
+    :raises ValueError: If the object holds a secret that the tasks need
+    """
+    if isinstance(value, dict):
+        if any(value.get(field) for field in SECRET_FIELDS):
+            raise ValueError('Object holds a secret')
+        return {key: _strip(item) for key, item in value.items() if key not in DROPPED_FIELDS}
+    if isinstance(value, list):
+        return [_strip(item) for item in value]
+    return value
+
+
+def enabled() -> bool:
+    """
+    Check whether snapshots are shipped with the tasks
+    """
+    return settings.TASK_SNAPSHOTS
+
+
+class Snapshots:
+    """
+    The snapshots fetched for a run of Robot, keyed by object type and id
+    """
+
+    def __init__(self):
+        self.objects: Dict[str, Dict[int, Dict[str, Any]]] = {}
+
+    def fetch(self, obj_type: str, client: Client, ids: Iterable[int]):
+        """
+        Bulk read the objects and store a snapshot of each
+        :param obj_type: The name the snapshots are stored under, e.g. vm
+        :param client: The client to read the objects with
+        :param ids: The ids of the objects to read
+        """
+        fetched = time.time()
+        objects = self.objects.setdefault(obj_type, {})
+        wanted = [pk for pk in ids if pk not in objects]
+        if len(wanted) == 0:
+            return
+        for pk, obj in utils.api_read_many(client, wanted).items():
+            try:
+                obj = _strip(obj)
+            except ValueError:
+                LOGGER.debug(f'Not snapshotting {obj_type} #{pk} as it holds secrets, its tasks will read it instead')
+                continue
+            objects[pk] = {'fetched': fetched, 'updated': obj.get('updated'), 'object': obj}
+
+    def get(self, obj_type: str, pk: Optional[int]) -> Optional[Dict[str, Any]]:
+        """
+        Get the snapshot of an object, if it was fetched
+        :param obj_type: The name the snapshot was stored under, e.g. vm
+        :param pk: The id of the object
+        """
+        if pk is None:
+            return None
+        return self.objects.get(obj_type, {}).get(pk)
+
+    def fetch_run(self, vm_ids: Iterable[int], virtual_router_ids: Iterable[int]):
+        """
+        Fetch the snapshots needed by the VM and Virtual Router tasks of a run
+        :param vm_ids: The ids of the VMs dispatched in the run
+        :param virtual_router_ids: The ids of the Virtual Routers dispatched in the run
+        """
+        self.fetch('vm', IAAS.vm, vm_ids)
+        vms = [snapshot['object'] for snapshot in self.objects.get('vm', {}).values()]
+        self.fetch('server', IAAS.server, {vm['server_id'] for vm in vms})
+        self.fetch(
+            'virtual_router',
+            IAAS.virtual_router,
+            {*virtual_router_ids, *(vm['project']['virtual_router_id'] for vm in vms)},
+        )
+        LOGGER.debug(
+            f'Prefetched snapshots of {", ".join(f"{len(v)} {k}" for k, v in self.objects.items())} records',
+        )
+
+    def for_vm(self, vm_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Collect the snapshots for a VM task; the VM, its Server and the Virtual Router of its Project
+        :param vm_id: The id of the VM
+        :returns: The snapshots keyed by object type, or None if the VM was not fetched
+        """
+        vm = self.get('vm', vm_id)
+        if vm is None:
+            return None
+        payload = {'vm': vm}
+        server = self.get('server', vm['object']['server_id'])
+        if server is not None:
+            payload['server'] = server
+        virtual_router = self.get('virtual_router', vm['object']['project']['virtual_router_id'])
+        if virtual_router is not None:
+            payload['virtual_router'] = virtual_router
+        return payload
+
+    def for_virtual_router(self, virtual_router_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Collect the snapshots for a Virtual Router task
+        :param virtual_router_id: The id of the Virtual Router
+        :returns: The snapshots keyed by object type, or None if the Virtual Router was not fetched
+        """
+        virtual_router = self.get('virtual_router', virtual_router_id)
+        if virtual_router is None:
+            return None
+        return {'virtual_router': virtual_router}
+
+
+def read(
+        client: Client,
+        pk: int,
+        snapshots: Optional[Dict[str, Any]],
+        obj_type: str,
+        **kwargs,
+) -> Dict[str, Any]:
+    """
+    Use the snapshot of an object shipped with the task if it is still fresh and the object has not changed since,
+    otherwise read the object from the API
+    :param client: The client to read the object with if there is no usable snapshot
+    :param pk: The id of the object
+    :param snapshots: The snapshots shipped with the task, keyed by object type
+    :param obj_type: The key of the object's snapshot, e.g. vm
+    :param kwargs: Any extra kwargs to pass to the request (ie spans)
+    :returns: The object, or an empty dict if it could not be read
+    """
+    snapshot = (snapshots or {}).get(obj_type)
+    if snapshot is not None and snapshot['object'].get('id') == pk and snapshot['updated'] is not None:
+        age = time.time() - snapshot['fetched']
+        if age <= settings.TASK_SNAPSHOT_MAX_AGE:
+            obj = _current(client, snapshot, obj_type, **kwargs)
+            if obj is not None:
+                return obj
+        else:
+            LOGGER.debug(f'Snapshot of {obj_type} #{pk} is {age:.1f}s old, reading it again')
+    return utils.api_read(client, pk, **kwargs)
+
+
+def _current(client: Client, snapshot: Dict[str, Any], obj_type: str, **kwargs) -> Optional[Dict[str, Any]]:
+    """
+    Check whether the object of a snapshot has been updated since it was fetched, by listing it filtered on a later
+    `updated`
+    :param client: The client to list the object with
+    :param snapshot: The snapshot of the object
+    :param obj_type: The key of the object's snapshot, e.g. vm
+    :param kwargs: Any extra kwargs to pass to the request (ie spans)
+    :returns: A copy of the snapshot's object if it has not changed, the new version of the object if it has, or None
+        if the check failed
+    """
+    pk = snapshot['object']['id']
+    params = {'search[id]': pk, 'search[updated__gt]': snapshot['updated']}
+    response = api_call.call(client, 'list', params=params, **kwargs)
+    if response.status_code != 200:
+        LOGGER.debug(f'HTTP {response.status_code} checking {obj_type} #{pk} for changes, reading it instead')
+        return None
+    content = response.json()['content']
+    if len(content) > 0:
+        LOGGER.debug(f'{obj_type} #{pk} has changed since its snapshot was fetched, using the new version')
+        return content[0]
+    LOGGER.debug(f'Using snapshot of {obj_type} #{pk} updated at {snapshot["updated"]}, it has not changed since')
+    return copy.deepcopy(snapshot['object'])
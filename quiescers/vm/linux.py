@@ -7,13 +7,12 @@ quiescer class for linux vms
 """
 # stdlib
 import logging
-import socket
 from typing import Any, Dict, Optional
 # lib
 import opentracing
 from jaeger_client import Span
 from netaddr import IPAddress
-from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+from paramiko import SSHException
 # local
 import settings
 from mixins import LinuxMixin
@@ -82,24 +81,15 @@ class Linux(LinuxMixin):
         child_span = opentracing.tracer.start_span('generate_command', child_of=span)
         cmd = JINJA_ENV.get_template('vm/kvm/commands/quiesce.j2').render(**template_data)
         child_span.finish()
-        Linux.logger.debug(f'Generated VM quiesce command for VM #{vm_id}\n{cmd}')
+        Linux.logger.debug('Generated VM quiesce command for VM #%s\n%s', vm_id, cmd)
 
         # Open a client and run the two necessary commands on the host
         quiesced = False
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        client = None
         try:
             # Try connecting to the host and running the necessary commands
-            sock.connect((host_ip, 22))
-            client.connect(
-                hostname=host_ip,
-                username='administrator',
-                pkey=key,
-                timeout=30,
-                sock=sock,
-            )  # No need for password as it should have keys
+            # No need for password as it should have keys
+            client = Linux.open_client(host_ip, 'administrator')
             span.set_tag('host', host_ip)
 
             # Attempt to execute the quiesce command
@@ -109,7 +99,7 @@ class Linux(LinuxMixin):
             child_span.finish()
 
             if stdout:
-                Linux.logger.debug(f'VM quiesce command for VM #{vm_id} generated stdout.\n{stdout}')
+                Linux.logger.debug('VM quiesce command for VM #%s generated stdout.\n%s', vm_id, stdout)
                 quiesced = True
             if stderr:
                 error = f'VM quiesce command for VM #{vm_id} generated stderr.\n{stderr}.'
@@ -121,7 +111,7 @@ class Linux(LinuxMixin):
             vm_data['errors'].append(f'{error} Error: {err}')
             span.set_tag('failed_reason', 'ssh_error')
         finally:
-            client.close()
+            Linux.release_client(client)
         return quiesced
 
     @staticmethod
@@ -94,7 +94,7 @@ class Windows(WindowsMixin):
             # Check the stdout and stderr for messages
             if response.std_out:
                 msg = response.std_out.strip()
-                Windows.logger.debug(f'VM quiesce command for VM #{vm_id} generated stdout\n{msg}')
+                Windows.logger.debug('VM quiesce command for VM #%s generated stdout\n%s', vm_id, msg)
                 quiesced = f'{template_data["vm_identifier"]} Successfully Quiesced.' in msg
             # Check if the error was parsed to ensure we're not logging invalid std_err output
             if response.std_err and '#< CLIXML\r\n' not in response.std_err:
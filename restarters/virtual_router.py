@@ -8,16 +8,14 @@ restarter class for virtual_routers
 
 # stdlib
 import logging
-import socket
 from typing import Any, Dict
 # lib
 import opentracing
-from cloudcix.lock import ResourceLock
 from jaeger_client import Span
-from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+from paramiko import SSHException
 # local
 from builders import VirtualRouter as VirtualRouterBuilder
-from utils import JINJA_ENV, Targets
+from utils import JINJA_ENV
 
 
 __all__ = [
@@ -79,15 +77,17 @@ class VirtualRouter(VirtualRouterBuilder):
         child_span = opentracing.tracer.start_span('generate_ip_commands', child_of=span)
         restart_bash_script = JINJA_ENV.get_template('virtual_router/commands/restart.j2').render(**template_data)
         VirtualRouter.logger.debug(
-            f'Generated restart bash script for virtual_router #{virtual_router_id}\n{restart_bash_script}',
+            'Generated restart bash script for virtual_router #%s\n%s',
+            virtual_router_id,
+            restart_bash_script,
         )
 
         firewall_nft = JINJA_ENV.get_template('virtual_router/features/firewall.j2').render(**template_data)
-        VirtualRouter.logger.debug(f'Generated firewall nft for virtual_router #{virtual_router_id}\n{firewall_nft}')
+        VirtualRouter.logger.debug('Generated firewall nft for virtual_router #%s\n%s', virtual_router_id, firewall_nft)
 
         if len(virtual_router_data['vpns']) > 0:
             vpn_conf = JINJA_ENV.get_template('virtual_router/features/vpn.j2').render(**template_data)
-            VirtualRouter.logger.debug(f'Generated vpn conf for virtual_router #{virtual_router_id}\n{vpn_conf}')
+            VirtualRouter.logger.debug('Generated vpn conf for virtual_router #%s\n%s', virtual_router_id, vpn_conf)
         child_span.finish()
 
         # Log onto PodNet box and run bash script
@@ -95,15 +95,12 @@ class VirtualRouter(VirtualRouterBuilder):
         management_ip = template_data.pop('management_ip')
         restarted = False
 
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        client = None
+        sftp = None
         try:
             # Try connecting to the host and running the necessary commands
             # No need for password as it should have keys
-            sock.connect((management_ip, 22))
-            client.connect(hostname=management_ip, username='robot', pkey=key, timeout=30, sock=sock)
+            client = VirtualRouter.open_client(management_ip, 'robot')
             span.set_tag('host', management_ip)
 
             # Firstly, Write Firewall rules file .nft and vpn.conf file(if any) to PodNet box
@@ -145,18 +142,8 @@ class VirtualRouter(VirtualRouterBuilder):
                 f'Executing Virtual Router restart commands for virtual_router #{virtual_router_id}',
             )
             child_span = opentracing.tracer.start_span('restart_virtual_router', child_of=span)
-            if len(virtual_router_data['vpns']) > 0:
-                # for vpns swanctl load command applied which is a critical section.
-                # Critical section
-                requestor = f'Apply Swanctl for Restart Virtual Router #{virtual_router_id}'
-                target = Targets.PODNET.generate_id(
-                    region_id=virtual_router_data['project']['region_id'],
-                    router_id=virtual_router_data['router_id'],
-                )
-                with ResourceLock(target, requestor, child_span):
-                    stdout, stderr = VirtualRouter.deploy(restart_bash_script, client, child_span)
-            else:
-                stdout, stderr = VirtualRouter.deploy(restart_bash_script, client, child_span)
+            # swanctl loads are serialised on the PodNet itself, so the script runs without the PodNet lock
+            stdout, stderr = VirtualRouter.deploy(restart_bash_script, client, child_span)
             child_span.finish()
             if stderr:
                 VirtualRouter.logger.error(
@@ -166,8 +153,9 @@ class VirtualRouter(VirtualRouterBuilder):
                 virtual_router_data['errors'].append(stderr)
             else:
                 VirtualRouter.logger.debug(
-                    f'Virtual Router restart commands for virtual_router #{virtual_router_id} generated stdout.'
-                    f'\n{stdout}',
+                    'Virtual Router restart commands for virtual_router #%s generated stdout.\n%s',
+                    virtual_router_id,
+                    stdout,
                 )
                 restarted = True
 
@@ -177,6 +165,9 @@ class VirtualRouter(VirtualRouterBuilder):
             virtual_router_data['errors'].append(error)
             span.set_tag('failed_reason', 'ssh_error')
         finally:
-            client.close()
+            # The connection is pooled, so the SFTP session has to be closed explicitly
+            if sftp is not None:
+                sftp.close()
+            VirtualRouter.release_client(client)
 
         return restarted
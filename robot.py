@@ -2,14 +2,20 @@
 new robot that uses a class, methods and instance variables to clean up the code
 """
 # stdlib
+import asyncio
 import logging
-from typing import Optional, Union
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
 # lib
+from celery.canvas import Signature
 from cloudcix.api.iaas import IAAS
+from cloudcix.client import Client
 # local
 import dispatchers
+import metrics
 import settings
+import prefetch
 import utils
+from api_async import AsyncAPI
 from state import SCRUB_QUEUE
 
 
@@ -20,6 +26,16 @@ class Robot:
     """
     # logger instance for logging information that happens during the main loop
     logger: logging.Logger
+    # batch collecting the tasks dispatched during a run, published in one go at the end of the run
+    batch: dispatchers.Batch
+    # snapshots of the objects of a run, shipped with their tasks if TASK_SNAPSHOTS is enabled
+    prefetched: Optional[prefetch.Snapshots]
+    # hosts of the objects of a run, that their tasks are routed to if HOST_ROUTING is enabled
+    hosts: dispatchers.Hosts
+    # build tasks of the virtual routers built in this run, keyed by id, that the builds of their VMs are chained to
+    virtual_router_builds: Dict[int, Signature]
+    # number of tasks queued by the last publish of the batch
+    queued: int = 0
     # Keep track of whether or not the script has detected a SIGTERM signal
     sigterm_recv: bool = False
     # backup dispatcher
@@ -31,33 +47,41 @@ class Robot:
     # virtual_router dispatcher
     virtual_router_dispatcher: Union[dispatchers.PhantomVirtualRouter, dispatchers.VirtualRouter]
     # backup
-    backups: list
+    backups: Dict[str, List[int]]
     # ceph
-    cephs: list
+    cephs: Dict[str, List[int]]
     # snapshots
-    snapshots: list
+    snapshots: Dict[str, List[int]]
     # virtual routers
-    virtual_routers: list
+    virtual_routers: Dict[str, List[int]]
     # vms
-    vms: list
+    vms: Dict[str, List[int]]
 
     def __init__(
             self,
-            backups: list,
-            cephs: list,
-            snapshots: list,
-            virtual_routers: list,
-            vms: list,
+            backups: Dict[str, List[int]],
+            cephs: Dict[str, List[int]],
+            snapshots: Dict[str, List[int]],
+            virtual_routers: Dict[str, List[int]],
+            vms: Dict[str, List[int]],
     ):
         # Instantiate a logger instance
         self.logger = logging.getLogger('robot.mainloop')
         # Instantiate the dispatchers
-        self.backup_dispatcher = dispatchers.Backup(settings.NETWORK_PASSWORD)
-        self.ceph_dispatcher = dispatchers.Ceph(settings.NETWORK_PASSWORD)
-        self.snapshot_dispatcher = dispatchers.Snapshot(settings.NETWORK_PASSWORD)
-        self.vm_dispatcher = dispatchers.VM(settings.NETWORK_PASSWORD)
+        self.batch = dispatchers.Batch()
+        self.prefetched = prefetch.Snapshots() if prefetch.enabled() else None
+        self.hosts = dispatchers.Hosts()
+        self.virtual_router_builds = {}
+        self.backup_dispatcher = dispatchers.Backup(settings.NETWORK_PASSWORD, self.batch, self.hosts)
+        self.ceph_dispatcher = dispatchers.Ceph(settings.NETWORK_PASSWORD, self.batch)
+        self.snapshot_dispatcher = dispatchers.Snapshot(settings.NETWORK_PASSWORD, self.batch, self.hosts)
+        self.vm_dispatcher = dispatchers.VM(settings.NETWORK_PASSWORD, self.batch, self.prefetched, self.hosts)
         if settings.VIRTUAL_ROUTERS_ENABLED:
-            self.virtual_router_dispatcher = dispatchers.VirtualRouter(settings.NETWORK_PASSWORD)
+            self.virtual_router_dispatcher = dispatchers.VirtualRouter(
+                settings.NETWORK_PASSWORD,
+                self.batch,
+                self.prefetched,
+            )
         else:
             self.virtual_router_dispatcher = dispatchers.PhantomVirtualRouter()
         # Instantiate backups
@@ -71,10 +95,13 @@ class Robot:
         # Instantiate vms
         self.vms = vms
 
-    def __call__(self):
+    def __call__(self) -> Optional[Set[int]]:
         """
         This is the main looping part of the robot.
         This method will loop until an exception occurs or a sigterm is received
+        :returns: The ids of the projects with tasks that were left out of the run because the same task was still in
+            flight. run_robot must be left set for these projects so the next run dispatches the tasks again. None if
+            the projects of those tasks could not be found, in which case it must be left set for every project
         """
         self.logger.info('Commencing robot loop.')
 
@@ -105,6 +132,37 @@ class Robot:
         self.vms_to_update += self.vms['quiesced_update']
         self.vms_to_restart = self.vms['restart']
 
+        # Read the VMs and Virtual Routers of the run in bulk, so their tasks do not start by reading them one by one
+        if self.prefetched is not None:
+            self.prefetched.fetch_run(
+                [*self.vms_to_build, *self.vms_to_quiesce, *self.vms_to_update, *self.vms_to_restart],
+                [
+                    *self.virtual_routers_to_build,
+                    *self.virtual_routers_to_quiesce,
+                    *self.virtual_routers_to_update,
+                    *self.virtual_routers_to_restart,
+                ],
+            )
+
+        # Find the hosts of the Backups, Snapshots and VMs of the run in bulk, so routing their tasks does not read them
+        # one by one. VMs with a snapshot are routed by the server in it
+        self.hosts.fetch(
+            IAAS.backup,
+            [*self.backups_to_build, *self.backups_to_update, *self.backups_to_scrub],
+        )
+        self.hosts.fetch(
+            IAAS.snapshot,
+            [*self.snapshots_to_build, *self.snapshots_to_update, *self.snapshots_to_scrub],
+        )
+        self.hosts.fetch(
+            IAAS.vm,
+            [
+                vm_id
+                for vm_id in [*self.vms_to_build, *self.vms_to_quiesce, *self.vms_to_update, *self.vms_to_restart]
+                if self.prefetched is None or self.prefetched.get('vm', vm_id) is None
+            ],
+        )
+
         # Handle loop events in separate functions
         # ############################################################## #
         #                              BUILD                             #
@@ -142,8 +200,78 @@ class Robot:
         self._backup_scrub()
         self._snapshot_scrub()
 
+        # Publish all of the tasks dispatched in this run together
+        skipped = self._publish()
+        pending = self._pending_projects(skipped)
+
         # Flush the loggers
         utils.flush_logstash()
+        return pending
+
+    def _publish(self) -> List[Tuple[str, int, str]]:
+        """
+        Publish the batch of tasks collected from the dispatchers and report how many of each were queued
+        :returns: The in flight registry keys of the tasks that were left out because the same task was still in
+            flight
+        """
+        counts, skipped = self.batch.publish()
+        self.queued = sum(counts.values())
+        if len(skipped) > 0:
+            self.logger.info(f'Left out {len(skipped)} tasks that are still in flight from an earlier run.')
+        if len(counts) > 0:
+            summary = ', '.join(f'{label}: {count}' for label, count in sorted(counts.items()))
+            self.logger.info(f'Queued {self.queued} tasks. {summary}')
+            metrics.mainloop_tasks_queued(counts)
+        return skipped
+
+    def _pending_projects(self, skipped: List[Tuple[str, int, str]]) -> Optional[Set[int]]:
+        """
+        Find the projects of the tasks that were left out of the run
+        :param skipped: The in flight registry keys of the tasks that were left out
+        :returns: The ids of the projects, or None if the project of any of the tasks could not be found
+        """
+        ids: Dict[str, Set[int]] = {}
+        for obj_type, obj_id, _ in skipped:
+            ids.setdefault(obj_type, set()).add(obj_id)
+        projects: Set[int] = set()
+        vm_ids = ids.pop('vm', set())
+        # Backups and Snapshots belong to the project of their VM
+        for obj_type, client in (('backup', IAAS.backup), ('snapshot', IAAS.snapshot)):
+            objects = self._read_left_out(obj_type, client, ids.pop(obj_type, set()))
+            if objects is None:
+                return None
+            vm_ids.update(obj['vm']['id'] for obj in objects)
+        cephs = self._read_left_out('ceph', IAAS.ceph, ids.pop('ceph', set()))
+        vms = self._read_left_out('vm', IAAS.vm, vm_ids)
+        virtual_routers = self._read_left_out('virtual_router', IAAS.virtual_router, ids.pop('virtual_router', set()))
+        if cephs is None or vms is None or virtual_routers is None or len(ids) > 0:
+            return None
+        projects.update(ceph['project_id'] for ceph in cephs)
+        projects.update(obj['project']['id'] for obj in [*vms, *virtual_routers])
+        return projects
+
+    def _read_left_out(self, obj_type: str, client: Client, ids: Iterable[int]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Read the objects of tasks that were left out of the run, using their snapshots where they were prefetched
+        :param obj_type: The name the snapshots of the objects are stored under, e.g. vm
+        :param client: The client to read the objects that were not prefetched with
+        :param ids: The ids of the objects
+        :returns: The objects, or None if any of them could not be read
+        """
+        objects = []
+        missing = []
+        for pk in ids:
+            snapshot = self.prefetched.get(obj_type, pk) if self.prefetched is not None else None
+            if snapshot is not None:
+                objects.append(snapshot['object'])
+            else:
+                missing.append(pk)
+        if len(missing) > 0:
+            found = utils.api_read_many(client, missing)
+            if len(found) < len(missing):
+                return None
+            objects.extend(found.values())
+        return objects
 
     # ############################################################## #
     #                              BUILD                             #
@@ -178,14 +306,39 @@ class Robot:
         Sends virtual_routers to build dispatcher, and asynchronously build them
         """
         for virtual_router_id in self.virtual_routers_to_build:
-            self.virtual_router_dispatcher.build(virtual_router_id)
+            signature = self.virtual_router_dispatcher.build(virtual_router_id)
+            if signature is not None:
+                self.virtual_router_builds[virtual_router_id] = signature
 
     def _vm_build(self):
         """
-        Sends vms to build dispatcher, and asynchronously build them
+        Sends vms to build dispatcher, and asynchronously build them.
+        VMs whose virtual router is built in the same run are built once that build has finished
         """
+        dependencies = self._vm_build_dependencies()
         for vm_id in self.vms_to_build:
-            self.vm_dispatcher.build(vm_id)
+            self.vm_dispatcher.build(vm_id, after=self.virtual_router_builds.get(dependencies.get(vm_id)))
+
+    def _vm_build_dependencies(self) -> Dict[int, int]:
+        """
+        Find the virtual router of each VM to build, if any virtual routers are being built in this run
+        :returns: The id of the virtual router of each VM, keyed by VM id
+        """
+        if len(self.virtual_router_builds) == 0 or len(self.vms_to_build) == 0:
+            return {}
+        vms = {}
+        if self.prefetched is not None:
+            for vm_id in self.vms_to_build:
+                snapshot = self.prefetched.get('vm', vm_id)
+                if snapshot is not None:
+                    vms[vm_id] = snapshot['object']
+        missing = [vm_id for vm_id in self.vms_to_build if vm_id not in vms]
+        if len(missing) > 0:
+            vms.update(utils.api_read_many(IAAS.vm, missing))
+        dependencies = {vm_id: vm['project']['virtual_router_id'] for vm_id, vm in vms.items()}
+        chained = sum(1 for vr_id in dependencies.values() if vr_id in self.virtual_router_builds)
+        self.logger.debug(f'Chaining {chained} VM builds to the builds of their virtual routers')
+        return dependencies
 
     # ############################################################## #
     #                             QUIESCE                            #
@@ -267,8 +420,17 @@ class Robot:
         This gets run once a day at midnight, once we're sure it works
         """
         self.logger.info(f'Commencing scrub checks with updated__lte={timestamp}')
-        self._vm_scrub(timestamp)
-        self._virtual_router_scrub(timestamp)
+
+        # The VM and Virtual Router listings are independent, so page through both at the same time
+        async def scrub_checks(api: AsyncAPI):
+            await asyncio.gather(
+                api.submit(self._vm_scrub, timestamp),
+                api.submit(self._virtual_router_scrub, timestamp),
+            )
+
+        AsyncAPI.run(scrub_checks)
+        # Publish all of the scrub tasks together
+        self._publish()
         # Flush the loggers
         utils.flush_logstash()
 
@@ -296,7 +458,7 @@ class Robot:
             params['search[updated__lte]'] = timestamp
 
         # Retrieve the virtual_routers from the API and run loop to dispatch.
-        for virtual_router in utils.api_list(IAAS.virtual_router, params):
+        for virtual_router in utils.api_iter(IAAS.virtual_router, params):
             self.virtual_router_dispatcher.scrub(virtual_router['id'])
 
     def _vm_scrub(self, timestamp: Optional[int]):
@@ -309,5 +471,5 @@ class Robot:
             params['search[updated__lte]'] = timestamp
 
         # Retrieve the VMs from the API and run loop to dispatch.
-        for vm in utils.api_list(IAAS.vm, params):
+        for vm in utils.api_iter(IAAS.vm, params):
             self.vm_dispatcher.scrub(vm['id'])
@@ -6,13 +6,12 @@ scrubber class for linux backups
 """
 # stdlib
 import logging
-import socket
 from typing import Any, Dict, Optional
 # lib
 import opentracing
 from jaeger_client import Span
 from netaddr import IPAddress
-from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+from paramiko import SSHException
 # local
 import settings
 import utils
@@ -81,20 +80,11 @@ class Linux(LinuxMixin):
 
         # Open a client and run the command
         scrubbed = False
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        client = None
         try:
             # Try connecting to the host and running the necessary commands
-            sock.connect((host_ip, 22))
-            client.connect(
-                hostname=host_ip,
-                username='administrator',
-                pkey=key,
-                timeout=30,
-                sock=sock,
-            )  # No need for password as it should have keys
+            # No need for password as it should have keys
+            client = Linux.open_client(host_ip, 'administrator')
             span.set_tag('host', host_ip)
 
             # Now attempt to execute the backup scrub command
@@ -104,7 +94,7 @@ class Linux(LinuxMixin):
             child_span.finish()
 
             if stdout:
-                Linux.logger.debug(f'Backup scrub command for Backup #{backup_id} generated stdout\n{stdout}.')
+                Linux.logger.debug('Backup scrub command for Backup #%s generated stdout\n%s.', backup_id, stdout)
                 if 'removed' in stdout:
                     scrubbed = True
 
@@ -117,7 +107,7 @@ class Linux(LinuxMixin):
             backup_data['errors'].append(f'{error} Error: {err}')
             span.set_tag('failed_reason', 'ssh_error')
         finally:
-            client.close()
+            Linux.release_client(client)
         return scrubbed
 
     @staticmethod
@@ -177,6 +167,6 @@ class Linux(LinuxMixin):
         :returns: A flag stating whether or not the job was successful
         """
         cmd = utils.JINJA_ENV.get_template('backup/kvm/commands/scrub.j2').render(**template_data)
-        Linux.logger.debug(f'Generated backup scrub command for Backup #{backup_id}\n{cmd}')
+        Linux.logger.debug('Generated backup scrub command for Backup #%s\n%s', backup_id, cmd)
 
         return cmd
@@ -6,13 +6,12 @@ scrubber class for linux snapshots
 """
 # stdlib
 import logging
-import socket
 from typing import Any, Dict, Optional
 # lib
 import opentracing
 from jaeger_client import Span
 from netaddr import IPAddress
-from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+from paramiko import SSHException
 # local
 import settings
 import utils
@@ -85,20 +84,11 @@ class Linux(LinuxMixin):
 
         # Open a client and run the command
         scrubbed = False
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        client = None
         try:
             # Try connecting to the host and running the necessary commands
-            sock.connect((host_ip, 22))
-            client.connect(
-                hostname=host_ip,
-                username='administrator',
-                pkey=key,
-                timeout=30,
-                sock=sock,
-            )  # No need for password as it should have keys
+            # No need for password as it should have keys
+            client = Linux.open_client(host_ip, 'administrator')
             span.set_tag('host', host_ip)
 
             # Now attempt to execute the snapshot scrub command
@@ -108,7 +98,7 @@ class Linux(LinuxMixin):
             child_span.finish()
 
             if stdout:
-                Linux.logger.debug(f'Snapshot scrub command for Snapshot #{snapshot_id} generated stdout\n{stdout}.')
+                Linux.logger.debug('Snapshot scrub command for Snapshot #%s generated stdout\n%s.', snapshot_id, stdout)
                 if 'deleted' in stdout:
                     scrubbed = True
 
@@ -121,7 +111,7 @@ class Linux(LinuxMixin):
             snapshot_data['errors'].append(f'{error} Error: {err}')
             span.set_tag('failed_reason', 'ssh_error')
         finally:
-            client.close()
+            Linux.release_client(client)
         return scrubbed
 
     @staticmethod
@@ -170,6 +160,6 @@ class Linux(LinuxMixin):
         :returns: A flag stating whether or not the job was successful
         """
         cmd = utils.JINJA_ENV.get_template('snapshot/kvm/commands/scrub.j2').render(**template_data)
-        Linux.logger.debug(f'Generated snapshot scrub command for Snapshot #{snapshot_id}\n{cmd}')
+        Linux.logger.debug('Generated snapshot scrub command for Snapshot #%s\n%s', snapshot_id, cmd)
 
         return cmd
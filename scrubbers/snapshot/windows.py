@@ -96,7 +96,7 @@ class Windows(WindowsMixin):
             # Check the stdout and stderr for messages
             if response.std_out:
                 msg = response.std_out.strip()
-                Windows.logger.debug(f'Snapshot scrub command for Snapshot #{snapshot_id} generated stdout\n{msg}')
+                Windows.logger.debug('Snapshot scrub command for Snapshot #%s generated stdout\n%s', snapshot_id, msg)
                 scrubbed = True
             # Check if the error was parsed to ensure we're not logging invalid std_err output
             if response.std_err and '#< CLIXML\r\n' not in response.std_err:
@@ -8,19 +8,17 @@ scrubber class for virtual_routers
 
 # stdlib
 import logging
-import socket
 from collections import deque
 from typing import Any, Deque, Dict, Optional
 # lib
 import opentracing
 from cloudcix.api.iaas import IAAS
-from cloudcix.lock import ResourceLock
 from jaeger_client import Span
-from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+from paramiko import SSHException
 # local
 import settings
 from mixins import LinuxMixin
-from utils import api_list, JINJA_ENV, Targets
+from utils import api_list, JINJA_ENV
 
 
 __all__ = [
@@ -87,7 +85,9 @@ class VirtualRouter(LinuxMixin):
         child_span = opentracing.tracer.start_span('generate_ip_commands', child_of=span)
         scrub_bash_script = JINJA_ENV.get_template('virtual_router/commands/scrub.j2').render(**template_data)
         VirtualRouter.logger.debug(
-            f'Generated scrub bash script for virtual_router #{virtual_router_id}\n{scrub_bash_script}',
+            'Generated scrub bash script for virtual_router #%s\n%s',
+            virtual_router_id,
+            scrub_bash_script,
         )
         child_span.finish()
 
@@ -95,15 +95,11 @@ class VirtualRouter(LinuxMixin):
         management_ip = template_data.pop('management_ip')
         scrubbed = False
 
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        client = None
         try:
             # Try connecting to the host and running the necessary commands
             # No need for password as it should have keys
-            sock.connect((management_ip, 22))
-            client.connect(hostname=management_ip, username='robot', pkey=key, timeout=30, sock=sock)
+            client = VirtualRouter.open_client(management_ip, 'robot')
             span.set_tag('host', management_ip)
 
             # Attempt to execute ALL of the virtual router scrub commands
@@ -111,18 +107,8 @@ class VirtualRouter(LinuxMixin):
                 f'Executing Virtual Router scrub commands for virtual_router #{virtual_router_id}',
             )
             child_span = opentracing.tracer.start_span('scrub_virtual_router', child_of=span)
-            if len(virtual_router_data['vpns']) > 0:
-                # for vpns swanctl load command applied which is a critical section.
-                # Critical section
-                requestor = f'Apply Swanctl for Scrub Virtual Router #{virtual_router_id}'
-                target = Targets.PODNET.generate_id(
-                    region_id=virtual_router_data['project']['region_id'],
-                    router_id=virtual_router_data['router_id'],
-                )
-                with ResourceLock(target, requestor, child_span):
-                    stdout, stderr = VirtualRouter.deploy(scrub_bash_script, client, child_span)
-            else:
-                stdout, stderr = VirtualRouter.deploy(scrub_bash_script, client, child_span)
+            # swanctl loads are serialised on the PodNet itself, so the script runs without the PodNet lock
+            stdout, stderr = VirtualRouter.deploy(scrub_bash_script, client, child_span)
             child_span.finish()
             if stderr:
                 VirtualRouter.logger.error(
@@ -132,8 +118,9 @@ class VirtualRouter(LinuxMixin):
                 virtual_router_data['errors'].append(stderr)
             else:
                 VirtualRouter.logger.debug(
-                    f'Virtual Router scrub commands for virtual_router #{virtual_router_id} generated stdout.'
-                    f'\n{stdout}',
+                    'Virtual Router scrub commands for virtual_router #%s generated stdout.\n%s',
+                    virtual_router_id,
+                    stdout,
                 )
                 scrubbed = True
 
@@ -143,7 +130,7 @@ class VirtualRouter(LinuxMixin):
             virtual_router_data['errors'].append(error)
             span.set_tag('failed_reason', 'ssh_error')
         finally:
-            client.close()
+            VirtualRouter.release_client(client)
 
         return scrubbed
 
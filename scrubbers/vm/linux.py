@@ -6,7 +6,6 @@ scrubber class for linux vms
 """
 # stdlib
 import logging
-import socket
 from typing import Any, Dict, List, Optional
 
 # lib
@@ -15,12 +14,13 @@ from cloudcix.api.iaas import IAAS
 from cloudcix.lock import ResourceLock
 from jaeger_client import Span
 from netaddr import IPAddress
-from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+from paramiko import SSHException
 # local
+import host_facts
 import settings
 import state
 from mixins import LinuxMixin
-from utils import api_list, JINJA_ENV, Targets
+from utils import api_iter, JINJA_ENV, Targets
 
 
 __all__ = [
@@ -95,20 +95,11 @@ class Linux(LinuxMixin):
 
         # Open a client and run the two necessary commands on the host
         scrubbed = False
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        client = None
         try:
             # Try connecting to the host and running the necessary commands
-            sock.connect((host_ip, 22))
-            client.connect(
-                hostname=host_ip,
-                username='administrator',
-                pkey=key,
-                timeout=30,
-                sock=sock,
-            )  # No need for password as it should have keys
+            # No need for password as it should have keys
+            client = Linux.open_client(host_ip, 'administrator')
             span.set_tag('host', host_ip)
 
             # Now attempt to execute the vm scrub command
@@ -118,7 +109,7 @@ class Linux(LinuxMixin):
             child_span.finish()
 
             if stdout:
-                Linux.logger.debug(f'VM scrub command for VM #{vm_id} generated stdout.\n{stdout}')
+                Linux.logger.debug('VM scrub command for VM #%s generated stdout.\n%s', vm_id, stdout)
                 scrubbed = True
             if stderr:
                 Linux.logger.error(f'VM scrub command for VM #{vm_id} generated stderr.\n{stderr}')
@@ -129,7 +120,7 @@ class Linux(LinuxMixin):
             vm_data['errors'].append(f'{error} Error: {err}')
             span.set_tag('failed_reason', 'ssh_error')
         finally:
-            client.close()
+            Linux.release_client(client)
         return scrubbed
 
     @staticmethod
@@ -187,7 +178,7 @@ class Linux(LinuxMixin):
         """
         # Render the VM scrub command
         vm_cmd = JINJA_ENV.get_template('vm/kvm/commands/scrub.j2').render(**template_data)
-        Linux.logger.debug(f'Generated vm scrub command for VM #{vm_id}\n{vm_cmd}')
+        Linux.logger.debug('Generated vm scrub command for VM #%s\n%s', vm_id, vm_cmd)
 
         return vm_cmd
 
@@ -222,21 +213,19 @@ class Linux(LinuxMixin):
             region_id=region_id,
             endpoint=endpoint,
         )
-        child_span = opentracing.tracer.start_span('api_list_other_vms', child_of=span)
-        with ResourceLock(target, requestor, child_span):
-            other_vms_on_server = api_list(IAAS.vm, params, span=span)
-        child_span.finish()
-
         # Get all subnet vlans of the VM
         subnet_vlans = []
         for ip in vm_data['ip_addresses']:
             subnet_vlans.append(ip['subnet']['vlan'])
 
-        # For each vm in other_vms_on_server, get a list of their subnet vlans
-        other_vms_subnet_vlans = []
-        for vm in other_vms_on_server:
-            for ip in vm['ip_addresses']:
-                other_vms_subnet_vlans.append(ip['subnet']['vlan'])
+        # For each of the other VMs on the server, collect their subnet vlans as the pages arrive
+        other_vms_subnet_vlans = set()
+        child_span = opentracing.tracer.start_span('api_list_other_vms', child_of=span)
+        with ResourceLock(target, requestor, child_span):
+            for vm in api_iter(IAAS.vm, params, span=span):
+                for ip in vm['ip_addresses']:
+                    other_vms_subnet_vlans.add(ip['subnet']['vlan'])
+        child_span.finish()
 
         # if a vlan is not in other_vms_subnet_vlans,
         # add to remove list as it is not in use by another vm on VM's server
@@ -275,24 +264,15 @@ class Linux(LinuxMixin):
             host_sudo_passwd=settings.NETWORK_PASSWORD,
             vlans_to_be_removed=vlans_to_be_removed,
         )
-        Linux.logger.debug(f'Generated bridge scrub command for VM #{vm_id}\n{bridge_scrub_cmd}')
+        Linux.logger.debug('Generated bridge scrub command for VM #%s\n%s', vm_id, bridge_scrub_cmd)
 
         removed = False
         # Open a client and run the necessary commands on the host
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        client = None
         try:
             # Try connecting to the host and running the necessary commands
-            sock.connect((host_ip, 22))
-            client.connect(
-                hostname=host_ip,
-                username='administrator',
-                pkey=key,
-                timeout=30,
-                sock=sock,
-            )  # No need for password as it should have keys
+            # No need for password as it should have keys
+            client = Linux.open_client(host_ip, 'administrator')
             span.set_tag('host', host_ip)
 
             Linux.logger.debug(f'Deleting bridges # {", ".join(vlans_to_be_removed)} for VM #{vm_id}')
@@ -308,13 +288,17 @@ class Linux(LinuxMixin):
                 server_id=vm_data['server_id'],
             )
             with ResourceLock(target, requestor, child_span):
-                stdout, stderr = Linux.deploy(bridge_scrub_cmd, client, child_span)
+                try:
+                    stdout, stderr = Linux.deploy(bridge_scrub_cmd, client, child_span)
+                finally:
+                    # Still inside the lock, so no other task decides on the bridges of the host before this
+                    host_facts.invalidate(host_ip)
             child_span.finish()
             # In this case it is observed that for a successful deletion of bridge, stdout and stderr are None
             # so considering this as success
             removed = True
             if stdout:
-                Linux.logger.debug(f'Bridge scrub command for VM #{vm_id} generated stdout\n{stdout}')
+                Linux.logger.debug('Bridge scrub command for VM #%s generated stdout\n%s', vm_id, stdout)
             if stderr:
                 Linux.logger.error(f'Bridge scrub command for VM #{vm_id} generated stderr\n{stderr}')
                 removed = False
@@ -325,5 +309,5 @@ class Linux(LinuxMixin):
             vm_data['errors'].append(f'{error} Error: {err}')
             span.set_tag('failed_reason', 'ssh_error')
         finally:
-            client.close()
+            Linux.release_client(client)
         return removed
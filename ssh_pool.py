@@ -0,0 +1,191 @@
+"""
+Per-process pool of SSH connections to the hosts and PodNets that Robot manages.
+
+Opening a connection costs a TCP connect, a key exchange and a public key authentication, and every builder, updater,
+scrubber, quiescer and restarter used to pay it for each connection it opened, parsing the private key from disk each
+time as well. The pool keeps the authenticated connections of a worker process open between uses, keyed by
+(host, username):
+    - the private key is parsed once per process
+    - idle connections are kept alive with transport keepalives, and closed once idle for longer than
+      SSH_POOL_IDLE_TIMEOUT
+    - a connection is checked to still be usable before it is handed out again
+    - at most SSH_POOL_MAX_PER_HOST connections to a host are checked out at once, further checkouts wait for one
+Clients are handed out through LinuxMixin.open_client and returned with LinuxMixin.release_client.
+"""
+# stdlib
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+# lib
+from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+# local
+import settings
+
+__all__ = [
+    'checkin',
+    'checkout',
+    'clear',
+    'stats',
+]
+
+KEY_PATH = '/root/.ssh/id_rsa'
+LOGGER = logging.getLogger('robot.ssh_pool')
+
+Key = Tuple[str, str]
+
+_key: Optional[RSAKey] = None
+_idle: Dict[Key, Deque[Tuple[SSHClient, float]]] = {}
+_limits: Dict[Key, threading.BoundedSemaphore] = {}
+# The pool key of each client that is checked out, by id of the client
+_checked_out: Dict[int, Key] = {}
+_handshakes = 0
+_reuses = 0
+_lock = threading.Lock()
+
+
+def _private_key() -> RSAKey:
+    global _key
+    if _key is None:
+        _key = RSAKey.from_private_key_file(KEY_PATH)
+    return _key
+
+
+def _healthy(client: SSHClient) -> bool:
+    transport = client.get_transport()
+    if transport is None or not transport.is_active():
+        return False
+    try:
+        # Cheap round trip through the transport, fails if the host has dropped the connection
+        transport.send_ignore()
+    except (OSError, EOFError, SSHException):
+        return False
+    return True
+
+
+def _connect(host: str, username: str) -> SSHClient:
+    client = SSHClient()
+    client.set_missing_host_key_policy(AutoAddPolicy())
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+    try:
+        sock.connect((host, 22))
+        # No need for password as it should have keys
+        client.connect(hostname=host, username=username, pkey=_private_key(), timeout=30, sock=sock)
+    except BaseException:
+        client.close()
+        sock.close()
+        raise
+    client.get_transport().set_keepalive(settings.SSH_POOL_KEEPALIVE)
+    return client
+
+
+def _evict_idle(now: float):
+    """
+    Close every idle connection of the process that has not been used for SSH_POOL_IDLE_TIMEOUT seconds.
+    Must be called with the lock held
+    """
+    for idle in _idle.values():
+        while len(idle) > 0 and now - idle[0][1] > settings.SSH_POOL_IDLE_TIMEOUT:
+            client, _ = idle.popleft()
+            client.close()
+
+
+def checkout(host: str, username: str) -> SSHClient:
+    """
+    Get a connected client for the host, reusing an idle connection if there is a usable one
+    :param host: The IP address of the host
+    :param username: The user to log in to the host as
+    :returns: A connected client, that must be given back with checkin once it is no longer needed
+    :raises SSHException: If no connection to the host was free within SSH_POOL_CHECKOUT_TIMEOUT seconds
+    :raises OSError: If the host could not be reached
+    """
+    global _handshakes, _reuses
+    key = (host, username)
+    with _lock:
+        limit = _limits.setdefault(key, threading.BoundedSemaphore(settings.SSH_POOL_MAX_PER_HOST))
+    if not limit.acquire(timeout=settings.SSH_POOL_CHECKOUT_TIMEOUT):
+        raise SSHException(f'Timed out waiting for a free connection to {username}@{host}')
+
+    try:
+        while True:
+            with _lock:
+                _evict_idle(time.monotonic())
+                idle = _idle.get(key)
+                client = idle.pop()[0] if idle else None
+            if client is None:
+                break
+            if _healthy(client):
+                with _lock:
+                    _reuses += 1
+                    _checked_out[id(client)] = key
+                return client
+            LOGGER.debug(f'Discarding broken pooled connection to {username}@{host}')
+            client.close()
+
+        client = _connect(host, username)
+        with _lock:
+            _handshakes += 1
+            _checked_out[id(client)] = key
+        return client
+    except BaseException:
+        limit.release()
+        raise
+
+
+def checkin(client: Optional[SSHClient]):
+    """
+    Give a client back to the pool, or close it if it is no longer usable
+    :param client: A client returned by checkout. None is ignored so callers can check in unconditionally
+    """
+    if client is None:
+        return
+    with _lock:
+        key = _checked_out.pop(id(client), None)
+    if key is None:
+        # Not one of ours, e.g. checked out before the process forked
+        client.close()
+        return
+    transport = client.get_transport()
+    with _lock:
+        if transport is not None and transport.is_active():
+            _idle.setdefault(key, deque()).append((client, time.monotonic()))
+        else:
+            client.close()
+        _evict_idle(time.monotonic())
+    _limits[key].release()
+
+
+def clear():
+    """
+    Close every idle connection of the process
+    """
+    with _lock:
+        for idle in _idle.values():
+            while len(idle) > 0:
+                idle.popleft()[0].close()
+
+
+def stats() -> Tuple[int, int]:
+    """
+    :returns: The number of connections opened with a full handshake, and the number of times an open connection was
+              handed out again, since the process started
+    """
+    return _handshakes, _reuses
+
+
+def _reset_after_fork():
+    global _idle, _limits, _checked_out, _handshakes, _reuses, _lock
+    # The parent's connections are driven by transport threads that do not exist in the child. They are dropped, not
+    # closed, as closing them would also end them for the parent
+    _idle = {}
+    _limits = {}
+    _checked_out = {}
+    _handshakes = 0
+    _reuses = 0
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
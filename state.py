@@ -52,3 +52,31 @@ STATE_NAMES = {
     17: 'scrubbing',
     99: 'closed',
 }
+
+# Legal transitions out of each state that Robot performs, the keys are the states Robot picks objects up in and the
+# in-progress states it moves them through
+TRANSITIONS = {
+    REQUESTED: (BUILDING, UNRESOURCED),
+    BUILDING: (RUNNING, UNRESOURCED),
+    QUIESCE: (QUIESCING, UNRESOURCED),
+    QUIESCING: (QUIESCED, UNRESOURCED),
+    RESTART: (RESTARTING, UNRESOURCED),
+    RESTARTING: (RUNNING, UNRESOURCED),
+    RUNNING_UPDATE: (RUNNING_UPDATING, UNRESOURCED),
+    RUNNING_UPDATING: (RUNNING, UNRESOURCED),
+    QUIESCED_UPDATE: (QUIESCED_UPDATING, UNRESOURCED),
+    QUIESCED_UPDATING: (QUIESCED, UNRESOURCED),
+    SCRUB: (SCRUB_PREP, SCRUBBING, UNRESOURCED),
+    SCRUB_PREP: (SCRUB_QUEUE, UNRESOURCED),
+    SCRUB_QUEUE: (SCRUBBING, UNRESOURCED),
+    SCRUBBING: (CLOSED, UNRESOURCED),
+}
+
+
+def is_legal(current: int, target: int) -> bool:
+    """
+    Check whether Robot may move an object from one state to another
+    :param current: The state the object is in
+    :param target: The state to move the object to
+    """
+    return target in TRANSITIONS.get(current, ())
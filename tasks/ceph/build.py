@@ -8,10 +8,10 @@ from jaeger_client import Span
 # local
 import metrics
 import state
+import transitions
 import utils
 from builders import Ceph
 from celery_app import app
-from cloudcix_token import Token
 from email_notifier import EmailNotifier
 
 __all__ = [
@@ -28,8 +28,8 @@ def _unresource(ceph: Dict[str, Any], span: Span):
 
     # Update state to UNRESOURCED in the API
     child_span = opentracing.tracer.start_span('update_to_unresourced', child_of=span)
-    response = IAAS.ceph.partial_update(
-        token=Token.get_instance().token,
+    response = utils.api_partial_update(
+        IAAS.ceph,
         pk=ceph_id,
         data={'state': state.UNRESOURCED},
         span=child_span,
@@ -99,18 +99,10 @@ def _build_ceph(ceph_id: int, span: Span):
     ceph['errors'] = []
 
     # If all is well and good here, update the Ceph state to BUILDING and pass the data to the builder
-    response = IAAS.ceph.partial_update(
-        token=Token.get_instance().token,
-        pk=ceph_id,
-        data={'state': state.BUILDING},
-        span=child_span,
-    )
+    won = transitions.begin(IAAS.ceph, ceph, state.BUILDING, span=child_span)
     child_span.finish()
 
-    if response.status_code != 200:
-        logger.error(
-            f'Could not update Ceph #{ceph_id} to state BUILDING. \nResponse: {response.content.decode()}.',
-        )
+    if not won:
         metrics.ceph_build_failure()
         span.set_tag('return_reason', 'could_not_update_state')
         return
@@ -133,8 +125,8 @@ def _build_ceph(ceph_id: int, span: Span):
 
         # Update state to RUNNING in the API
         child_span = opentracing.tracer.start_span('update_to_running', child_of=span)
-        response = IAAS.ceph.partial_update(
-            token=Token.get_instance().token,
+        response = utils.api_partial_update(
+            IAAS.ceph,
             pk=ceph_id,
             data={'state': state.RUNNING},
             span=child_span,
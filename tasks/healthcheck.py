@@ -3,6 +3,8 @@ File containing methods for monitoring if Robot is running as intended
 """
 
 # stdlib
+import asyncio
+import functools
 import logging
 from datetime import datetime, timedelta
 from dateutil.parser import isoparse
@@ -11,9 +13,10 @@ from typing import Any, Dict
 # lib
 from cloudcix.api import IAAS, Support
 # local
+import api_call
+from api_async import AsyncAPI
 import state
 import utils
-from cloudcix_token import Token
 
 INFRASTRUCTURE_DELAY = 5
 VM_BUILD_DELAY = 15
@@ -30,41 +33,55 @@ LOGGER = logging.getLogger('robot.tasks.healthcheck')
 def find_stuck_infra(interval_mins: int):
 
     logging.getLogger('robot.tasks.healthcheck').info('Running healthcheck')
-    vms = _find_stuck_vms(interval_mins)
-    vrfs = _find_stuck_virtual_routers(interval_mins)
+    AsyncAPI.run(functools.partial(_find_stuck_infra, interval_mins=interval_mins))
+
+
+async def _find_stuck_infra(api: AsyncAPI, interval_mins: int):
+    """
+    Look for stuck VMs and Virtual Routers, and check and create the tickets for all of them concurrently
+    """
+    vms, vrfs = await asyncio.gather(
+        _find_stuck_vms(api, interval_mins),
+        _find_stuck_virtual_routers(api, interval_mins),
+    )
 
     if len(vms) == 0 and len(vrfs) == 0:
         LOGGER.info('Healthcheck passed')
         return
     LOGGER.warning('Infrastructure was found stuck in an unstable state')
 
-    # Create a ticket if required
-    for item in (*vms, *vrfs):
-        if 'name' in item:
-            label = f'VM #{item["id"]}'
-        else:
-            label = f'Virtual Router #{item["id"]}'
-
-        warrantor_reference = _create_warrantor_reference(label, item['state'])
-        client = item['project']['reseller_id']
-        warrantor = item['project']['region_id']
-        ticket = _find_warrantor_ticket(warrantor_reference, warrantor, client)
-        if ticket is not None:
-            LOGGER.info(f'{label} already has a ticket. Skipping.')
-            continue
-
-        LOGGER.info(f'Creating ticket for {label} in state {item["state"]}')
-        _create_warrantor_ticket({
-            'client': client,
-            'label': label,
-            'warrantor_reference': warrantor_reference,
-            'state_name': state.STATE_NAMES[item['state']],
-            'updated': item['updated'],
-            'warrantor': warrantor,
-        })
-
-
-def _find_stuck_vms(interval_mins: int):
+    await asyncio.gather(*(_report_stuck_item(api, item) for item in (*vms, *vrfs)))
+
+
+async def _report_stuck_item(api: AsyncAPI, item: Dict[str, Any]):
+    """
+    Create a ticket for a stuck item if required
+    """
+    if 'name' in item:
+        label = f'VM #{item["id"]}'
+    else:
+        label = f'Virtual Router #{item["id"]}'
+
+    warrantor_reference = _create_warrantor_reference(label, item['state'])
+    client = item['project']['reseller_id']
+    warrantor = item['project']['region_id']
+    ticket = await api.submit(_find_warrantor_ticket, warrantor_reference, warrantor, client)
+    if ticket is not None:
+        LOGGER.info(f'{label} already has a ticket. Skipping.')
+        return
+
+    LOGGER.info(f'Creating ticket for {label} in state {item["state"]}')
+    await api.submit(_create_warrantor_ticket, {
+        'client': client,
+        'label': label,
+        'warrantor_reference': warrantor_reference,
+        'state_name': state.STATE_NAMES[item['state']],
+        'updated': item['updated'],
+        'warrantor': warrantor,
+    })
+
+
+async def _find_stuck_vms(api: AsyncAPI, interval_mins: int):
     """
     Get all VMs that have been in unstable states for too long
     """
@@ -73,12 +90,11 @@ def _find_stuck_vms(interval_mins: int):
     start_time = (datetime.utcnow() - timedelta(minutes=VM_BUILD_DELAY + interval_mins)).isoformat()
     end_time = (datetime.utcnow() - timedelta(minutes=VM_BUILD_DELAY)).isoformat()
 
-    params = {
+    building_params = {
         'search[updated__gt]': start_time,
         'search[updated__lt]': end_time,
         'search[state]': state.BUILDING,
     }
-    vms = utils.api_list(IAAS.vm, params)
 
     start_time = (datetime.utcnow() - timedelta(minutes=INFRASTRUCTURE_DELAY + interval_mins)).isoformat()
     end_time = (datetime.utcnow() - timedelta(minutes=INFRASTRUCTURE_DELAY)).isoformat()
@@ -88,11 +104,12 @@ def _find_stuck_vms(interval_mins: int):
         'exclude[state__in]': [*state.STABLE_STATES, state.BUILDING],
         'order': 'state',
     }
-    vms.extend(utils.api_list(IAAS.vm, params))
+    vms, other_vms = await asyncio.gather(api.list(IAAS.vm, building_params), api.list(IAAS.vm, params))
+    vms.extend(other_vms)
     return vms
 
 
-def _find_stuck_virtual_routers(interval_mins: int):
+async def _find_stuck_virtual_routers(api: AsyncAPI, interval_mins: int):
     start_time = (datetime.utcnow() - timedelta(minutes=INFRASTRUCTURE_DELAY + interval_mins)).isoformat()
     end_time = (datetime.utcnow() - timedelta(minutes=INFRASTRUCTURE_DELAY)).isoformat()
 
@@ -102,7 +119,7 @@ def _find_stuck_virtual_routers(interval_mins: int):
         'exclude[state__in]': state.STABLE_STATES,
         'order': 'state',
     }
-    return utils.api_list(IAAS.virtual_router, params)
+    return await api.list(IAAS.virtual_router, params)
 
 
 def _create_warrantor_reference(identifier: str, state_id: int):
@@ -137,8 +154,9 @@ def _create_warrantor_ticket(item: Dict[str, Any]):
             f'{item["label"]} entered state {item["state_name"]} at {updated} and has not completed.'
         ),
     }
-    response = Support.ticket.create(
-        token=Token.get_instance().token,
+    response = api_call.call(
+        Support.ticket,
+        'create',
         transaction_type_id=WARRANTOR_TICKET_TYPE,
         data=data,
     )
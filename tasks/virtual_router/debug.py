@@ -6,10 +6,10 @@ from cloudcix.api.iaas import IAAS
 from jaeger_client import Span
 # local
 import metrics
+import settings
 import state
 import utils
 from celery_app import app
-from cloudcix_token import Token
 from email_notifier import EmailNotifier
 from updaters import VirtualRouter as VirtualRouterUpdater
 
@@ -18,14 +18,22 @@ __all__ = [
 ]
 
 
-@app.task
-def debug_logs(virtual_router_id: int):
+@app.task(bind=True, max_retries=None)
+def debug_logs(self, virtual_router_id: int):
     """
     Helper function that wraps the actual task in a span, meaning we don't have to remember to call .finish
     """
     span = opentracing.tracer.start_span('tasks.virtual_router.debug_logs')
     span.set_tag('virtual_router_id', virtual_router_id)
-    _debug_logs(virtual_router_id, span)
+    # Tasks for the same Virtual Router must not overlap now that the queue runs them concurrently. If another one is
+    # running, free the worker and retry later instead of waiting for it to finish
+    try:
+        with utils.local_lock(f'virtual_router_{virtual_router_id}', timeout=settings.VIRTUAL_ROUTER_LOCK_TIMEOUT):
+            _debug_logs(virtual_router_id, span)
+    except utils.LocalLockTimeout:
+        span.set_tag('return_reason', 'virtual_router_busy')
+        span.finish()
+        raise self.retry(countdown=utils.dependency_backoff(self.request.retries))
     span.finish()
 
     # Flush the loggers here so it's not in the span
@@ -110,8 +118,8 @@ def _debug_logs(virtual_router_id: int, span: Span):
         # as the next tasks would take care of this.
         if virtual_router['state'] == state.RUNNING:
             child_span = opentracing.tracer.start_span('debug_to_false', child_of=span)
-            response = IAAS.virtual_router.partial_update(
-                token=Token.get_instance().token,
+            response = utils.api_partial_update(
+                IAAS.virtual_router,
                 pk=virtual_router_id,
                 data={'debug': False},
                 span=child_span,
@@ -1,15 +1,18 @@
 # stdlib
 import logging
+from typing import Any, Dict, Optional
 # lib
 import opentracing
 from cloudcix.api.iaas import IAAS
 from jaeger_client import Span
 # local
 import metrics
+import prefetch
+import settings
 import state
+import transitions
 import utils
 from celery_app import app
-from cloudcix_token import Token
 from email_notifier import EmailNotifier
 from restarters import VirtualRouter as VirtualRouterRestarter
 
@@ -18,21 +21,29 @@ __all__ = [
 ]
 
 
-@app.task
-def restart_virtual_router(virtual_router_id: int):
+@app.task(bind=True, max_retries=None)
+def restart_virtual_router(self, virtual_router_id: int, snapshots: Optional[Dict[str, Any]] = None):
     """
     Helper function that wraps the actual task in a span, meaning we don't have to remember to call .finish
     """
     span = opentracing.tracer.start_span('tasks.restart_virtual_router')
     span.set_tag('virtual_router_id', virtual_router_id)
-    _restart_virtual_router(virtual_router_id, span)
+    # Tasks for the same Virtual Router must not overlap now that the queue runs them concurrently. If another one is
+    # running, free the worker and retry later instead of waiting for it to finish
+    try:
+        with utils.local_lock(f'virtual_router_{virtual_router_id}', timeout=settings.VIRTUAL_ROUTER_LOCK_TIMEOUT):
+            _restart_virtual_router(virtual_router_id, span, snapshots)
+    except utils.LocalLockTimeout:
+        span.set_tag('return_reason', 'virtual_router_busy')
+        span.finish()
+        raise self.retry(countdown=utils.dependency_backoff(self.request.retries))
     span.finish()
 
     # Flush the loggers here so it's not in the span
     utils.flush_logstash()
 
 
-def _restart_virtual_router(virtual_router_id: int, span: Span):
+def _restart_virtual_router(virtual_router_id: int, span: Span, snapshots: Optional[Dict[str, Any]] = None):
     """
     Task to restart the specified virtual_router
     """
@@ -41,7 +52,13 @@ def _restart_virtual_router(virtual_router_id: int, span: Span):
 
     # Read the virtual_router
     child_span = opentracing.tracer.start_span('read_virtual_router', child_of=span)
-    virtual_router = utils.api_read(IAAS.virtual_router, virtual_router_id, span=child_span)
+    virtual_router = prefetch.read(
+        IAAS.virtual_router,
+        virtual_router_id,
+        snapshots,
+        'virtual_router',
+        span=child_span,
+    )
     child_span.finish()
 
     # Ensure it is not empty
@@ -63,20 +80,11 @@ def _restart_virtual_router(virtual_router_id: int, span: Span):
 
     # Update to intermediate state here (RESTARTING - 13)
     child_span = opentracing.tracer.start_span('update_to_restarting', child_of=span)
-    response = IAAS.virtual_router.partial_update(
-        token=Token.get_instance().token,
-        pk=virtual_router_id,
-        data={'state': state.RESTARTING},
-        span=child_span,
-    )
+    won = transitions.begin(IAAS.virtual_router, virtual_router, state.RESTARTING, span=child_span)
     child_span.finish()
 
     # Ensure the update was successful
-    if response.status_code != 200:
-        logger.error(
-            f'Could not update VM #{virtual_router_id} to the necessary RESTARTING.\n'
-            f'Response: {response.content.decode()}.',
-        )
+    if not won:
         span.set_tag('return_reason', 'could_not_update_state')
         metrics.virtual_router_restart_failure()
         # Update to Unresourced?
@@ -102,8 +110,8 @@ def _restart_virtual_router(virtual_router_id: int, span: Span):
 
         # Update state to RUNNING in the API
         child_span = opentracing.tracer.start_span('update_to_running', child_of=span)
-        response = IAAS.virtual_router.partial_update(
-            token=Token.get_instance().token,
+        response = utils.api_partial_update(
+            IAAS.virtual_router,
             pk=virtual_router_id,
             data={'state': state.RUNNING},
             span=child_span,
@@ -121,8 +129,8 @@ def _restart_virtual_router(virtual_router_id: int, span: Span):
 
         # Update state to UNRESOURCED in the API
         child_span = opentracing.tracer.start_span('update_to_unresourced', child_of=span)
-        response = IAAS.virtual_router.partial_update(
-            token=Token.get_instance().token,
+        response = utils.api_partial_update(
+            IAAS.virtual_router,
             pk=virtual_router_id,
             data={'state': state.UNRESOURCED},
             span=child_span,
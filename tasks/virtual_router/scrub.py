@@ -1,16 +1,18 @@
 # stdlib
 import logging
-from datetime import datetime, timedelta
+from typing import Optional
 # lib
 import opentracing
 from cloudcix.api.iaas import IAAS
 from jaeger_client import Span
 # local
+import api_call
 import metrics
+import settings
 import state
+import transitions
 import utils
 from celery_app import app
-from cloudcix_token import Token
 from email_notifier import EmailNotifier
 from scrubbers import VirtualRouter as VirtualRouterScrubber
 
@@ -19,23 +21,37 @@ __all__ = [
 ]
 
 
-@app.task
-def scrub_virtual_router(virtual_router_id: int):
+@app.task(bind=True, max_retries=None)
+def scrub_virtual_router(self, virtual_router_id: int, attempt: int = 0):
     """
     Helper function that wraps the actual task in a span, meaning we don't have to remember to call .finish
     """
     span = opentracing.tracer.start_span('tasks.scrub_virtual_router')
     span.set_tag('virtual_router_id', virtual_router_id)
-    _scrub_virtual_router(virtual_router_id, span)
+    # Tasks for the same Virtual Router must not overlap now that the queue runs them concurrently. If another one is
+    # running, free the worker and retry later instead of waiting for it to finish
+    try:
+        with utils.local_lock(f'virtual_router_{virtual_router_id}', timeout=settings.VIRTUAL_ROUTER_LOCK_TIMEOUT):
+            delay = _scrub_virtual_router(virtual_router_id, span, attempt)
+    except utils.LocalLockTimeout:
+        span.set_tag('return_reason', 'virtual_router_busy')
+        span.finish()
+        raise self.retry(countdown=utils.dependency_backoff(self.request.retries))
     span.finish()
 
     # Flush the loggers here so it's not in the span
     utils.flush_logstash()
 
+    if delay is not None:
+        # Retry instead of sending a new task, so the scrub keeps its queue and in flight entry
+        raise self.retry(kwargs={'attempt': attempt + 1}, countdown=delay)
+
 
-def _scrub_virtual_router(virtual_router_id: int, span: Span):
+def _scrub_virtual_router(virtual_router_id: int, span: Span, attempt: int = 0) -> Optional[float]:
     """
     Task to scrub the specified virtual_router
+    :param attempt: The number of times the scrub has been postponed waiting for the VMs of the project to be scrubbed
+    :returns: The number of seconds to postpone the scrub for if the project still has VMs
     """
     logger = logging.getLogger('robot.tasks.virtual_router.scrub')
     logger.info(f'Commencing scrub of virtual_router #{virtual_router_id}')
@@ -43,8 +59,9 @@ def _scrub_virtual_router(virtual_router_id: int, span: Span):
     # Read the virtual_router
     # Don't use utils so we can check the response code
     child_span = opentracing.tracer.start_span('read_virtual_router', child_of=span)
-    response = IAAS.virtual_router.read(
-        token=Token.get_instance().token,
+    response = api_call.call(
+        IAAS.virtual_router,
+        'read',
         pk=virtual_router_id,
         span=child_span,
     )
@@ -55,14 +72,14 @@ def _scrub_virtual_router(virtual_router_id: int, span: Span):
             f'Received scrub task for virtual_router #{virtual_router_id} but it was already deleted from the API',
         )
         span.set_tag('return_reason', 'already_deleted')
-        return
+        return None
     elif response.status_code != 200:
         logger.error(
             f'HTTP {response.status_code} error occurred when attempting to fetch virtual_router #{virtual_router_id};'
             f'\n Response Text: {response.content.decode()}',
         )
         span.set_tag('return_reason', 'invalid_virtual_router_id')
-        return
+        return None
     virtual_router = response.json()['content']
 
     # Ensure that the state of the virtual_router is still currently SCRUB_QUEUE
@@ -73,7 +90,7 @@ def _scrub_virtual_router(virtual_router_id: int, span: Span):
         )
         # Return out of this function without doing anything
         span.set_tag('return_reason', 'not_in_valid_state')
-        return
+        return None
 
     # Also ensure that all the VMs under this project are scrubbed
     child_span = opentracing.tracer.start_span('read_project_vms', child_of=span)
@@ -85,20 +102,20 @@ def _scrub_virtual_router(virtual_router_id: int, span: Span):
     child_span.finish()
     vm_count = len(vrf_vms)
     if vm_count > 0:
-        logger.warning(f'{vm_count} VMs are still in this project, scrub of VRF #{virtual_router_id} is postponed')
-        # since vms are yet in the project so wait for 5 sec and try again.
-        scrub_virtual_router.s(virtual_router_id).apply_async(eta=datetime.now() + timedelta(seconds=5))
-        return
+        delay = utils.dependency_backoff(attempt)
+        logger.warning(
+            f'{vm_count} VMs are still in this project, scrub of VRF #{virtual_router_id} is postponed for {delay}s',
+        )
+        span.set_tag('return_reason', 'vms_not_scrubbed')
+        return delay
 
     # Update the virtual_router state to SCRUBBING
     child_span = opentracing.tracer.start_span('update_to_scrubbing', child_of=span)
-    response = IAAS.virtual_router.partial_update(
-        token=Token.get_instance().token,
-        pk=virtual_router_id,
-        data={'state': state.SCRUBBING},
-        span=child_span,
-    )
+    won = transitions.begin(IAAS.virtual_router, virtual_router, state.SCRUBBING, span=child_span)
     child_span.finish()
+    if not won:
+        span.set_tag('return_reason', 'could_not_update_state')
+        return None
 
     virtual_router['errors'] = []
     success: bool = False
@@ -118,8 +135,8 @@ def _scrub_virtual_router(virtual_router_id: int, span: Span):
         metrics.virtual_router_scrub_success()
         # Closing the virtual_router
         child_span = opentracing.tracer.start_span('close_virtual_router', child_of=span)
-        response = IAAS.virtual_router.partial_update(
-            token=Token.get_instance().token,
+        response = utils.api_partial_update(
+            IAAS.virtual_router,
             pk=virtual_router_id,
             data={'state': state.CLOSED},
             span=child_span,
@@ -139,8 +156,8 @@ def _scrub_virtual_router(virtual_router_id: int, span: Span):
 
         # Update state to UNRESOURCED in the API
         child_span = opentracing.tracer.start_span('update_to_unresourced', child_of=span)
-        response = IAAS.virtual_router.partial_update(
-            token=Token.get_instance().token,
+        response = utils.api_partial_update(
+            IAAS.virtual_router,
             pk=virtual_router_id,
             data={'state': state.UNRESOURCED},
             span=child_span,
@@ -153,3 +170,4 @@ def _scrub_virtual_router(virtual_router_id: int, span: Span):
         except Exception:
             logger.error(f'Failed to send scrub failure email for virtual_router #{virtual_router_id}', exc_info=True)
         child_span.finish()
+    return None
@@ -1,7 +1,7 @@
 """
 files containing tasks related to vms
 """
-from .build import build_vm
+from .build import build_vm, build_vm_anyway
 from .quiesce import quiesce_vm
 from .restart import restart_vm
 from .scrub import scrub_vm
@@ -9,6 +9,7 @@ from .update import update_vm
 
 __all__ = [
     'build_vm',
+    'build_vm_anyway',
     'quiesce_vm',
     'restart_vm',
     'scrub_vm',
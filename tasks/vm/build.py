@@ -1,25 +1,27 @@
 # stdlib
 import logging
-from datetime import datetime, timedelta
-from typing import Any, Dict
+from datetime import datetime
+from typing import Any, Dict, Optional
 # lib
 import opentracing
 from cloudcix.api.iaas import IAAS
 from jaeger_client import Span
 # local
 import metrics
+import prefetch
 import state
+import transitions
 import utils
 from builders import (
     LinuxVM,
     WindowsVM,
 )
 from celery_app import app
-from cloudcix_token import Token
 from email_notifier import EmailNotifier
 
 __all__ = [
     'build_vm',
+    'build_vm_anyway',
 ]
 
 
@@ -32,8 +34,8 @@ def _unresource(vm: Dict[str, Any], span: Span):
 
     # Update state to UNRESOURCED in the API
     child_span = opentracing.tracer.start_span('update_to_unresourced', child_of=span)
-    response = IAAS.vm.partial_update(
-        token=Token.get_instance().token,
+    response = utils.api_partial_update(
+        IAAS.vm,
         pk=vm_id,
         data={'state': state.UNRESOURCED},
         span=child_span,
@@ -55,30 +57,53 @@ def _unresource(vm: Dict[str, Any], span: Span):
     child_span.finish()
 
 
-@app.task
-def build_vm(vm_id: int):
+@app.task(bind=True, max_retries=None)
+def build_vm(self, vm_id: int, snapshots: Optional[Dict[str, Any]] = None, attempt: int = 0):
     """
     Helper function that wraps the actual task in a span, meaning we don't have to remember to call .finish
     """
     span = opentracing.tracer.start_span('tasks.build_vm')
     span.set_tag('vm_id', vm_id)
-    _build_vm(vm_id, span)
+    delay = _build_vm(vm_id, span, snapshots, attempt)
     span.finish()
 
     # Flush the loggers here so it's not in the span
     utils.flush_logstash()
 
+    if delay is not None:
+        # Retry instead of sending a new task, so the build keeps its host queue and in flight entry. The Virtual Router
+        # will have changed by then, so its snapshot is not sent again
+        kwargs: Dict[str, Any] = {'attempt': attempt + 1}
+        if snapshots is not None:
+            kwargs['snapshots'] = {k: v for k, v in snapshots.items() if k != 'virtual_router'}
+        raise self.retry(kwargs=kwargs, countdown=delay)
+
+
+@app.task
+def build_vm_anyway(request, exc, traceback, signature: Dict[str, Any]):
+    """
+    Errback of a Virtual Router build that VM builds were chained to. Celery runs it in the worker of the failed build,
+    where it publishes the VM build that would otherwise never be sent. The build waits for the Virtual Router itself
+    :param signature: The signature of the VM build
+    """
+    logging.getLogger('robot.tasks.vm.build').warning(
+        f'Virtual Router build failed, publishing the build chained to it anyway. Error: {exc}',
+    )
+    app.signature(signature).apply_async()
+
 
-def _build_vm(vm_id: int, span: Span):
+def _build_vm(vm_id: int, span: Span, snapshots: Optional[Dict[str, Any]] = None, attempt: int = 0) -> Optional[float]:
     """
     Task to build the specified vm
+    :param attempt: The number of times the build has been postponed waiting for the Virtual Router of the VM
+    :returns: The number of seconds to postpone the build for if the Virtual Router of the VM is not built yet
     """
     logger = logging.getLogger('robot.tasks.vm.build')
     logger.info(f'Commencing build of VM #{vm_id}')
 
     # Read the VM
     child_span = opentracing.tracer.start_span('read_vm', child_of=span)
-    vm = utils.api_read(IAAS.vm, vm_id, span=child_span)
+    vm = prefetch.read(IAAS.vm, vm_id, snapshots, 'vm', span=child_span)
     child_span.finish()
 
     # Ensure it is not empty
@@ -86,14 +111,14 @@ def _build_vm(vm_id: int, span: Span):
         # Rely on the utils method for logging
         metrics.vm_build_failure()
         span.set_tag('return_reason', 'invalid_vm_id')
-        return
+        return None
 
     # Ensure that the state of the vm is still currently REQUESTED (it hasn't been picked up by another runner)
     if vm['state'] != state.REQUESTED:
         logger.warning(f'Cancelling build of VM #{vm_id}. Expected state to be {state.REQUESTED}, found {vm["state"]}.')
         # Return out of this function without doing anything as it was already handled
         span.set_tag('return_reason', 'not_in_correct_state')
-        return
+        return None
 
     # catch all the errors if any
     vm['errors'] = []
@@ -102,7 +127,7 @@ def _build_vm(vm_id: int, span: Span):
     child_span = opentracing.tracer.start_span('read_project_vr', child_of=span)
     vr_id = vm['project']['virtual_router_id']
     # need to read so to get the current state of virtual_router
-    vm_vr = utils.api_read(IAAS.virtual_router, pk=vr_id, span=child_span)
+    vm_vr = prefetch.read(IAAS.virtual_router, vr_id, snapshots, 'virtual_router', span=child_span)
     child_span.finish()
 
     if vm_vr['state'] == state.UNRESOURCED:
@@ -112,43 +137,38 @@ def _build_vm(vm_id: int, span: Span):
         vm['errors'].append(error)
         _unresource(vm, span)
         span.set_tag('return_reason', 'vr_unresourced')
-        return
+        return None
     elif vm_vr['state'] != state.RUNNING:
+        # Builds planned in the same run as their Virtual Router's build only get here if that build failed to finish
+        # the Virtual Router, otherwise the Virtual Router was built by a previous run or is still building elsewhere
+        delay = utils.dependency_backoff(attempt)
         logger.warning(
-            f'Virtual Router #{vm_vr["id"]} is not yet built, postponing build of VM #{vm_id}. '
+            f'Virtual Router #{vm_vr["id"]} is not yet built, postponing build of VM #{vm_id} for {delay}s. '
             f'Virtual Router is currently in state {vm_vr["state"]}',
         )
         # Return without changing the state
         span.set_tag('return_reason', 'vr_not_ready')
-        # since virtual_router is not ready yet so wait for 10 sec and try again.
-        build_vm.s(vm_id).apply_async(eta=datetime.now() + timedelta(seconds=10))
-        return
+        return delay
 
     # If all is well and good here, update the VM state to BUILDING and pass the data to the builder
     child_span = opentracing.tracer.start_span('update_to_building', child_of=span)
-    response = IAAS.vm.partial_update(
-        token=Token.get_instance().token,
-        pk=vm_id,
-        data={'state': state.BUILDING},
-        span=child_span,
-    )
+    won = transitions.begin(IAAS.vm, vm, state.BUILDING, span=child_span)
     child_span.finish()
 
-    if response.status_code != 200:
-        logger.error(f'Could not update VM #{vm_id} to state BUILDING.\nResponse: {response.content.decode()}.')
+    if not won:
         metrics.vm_build_failure()
         span.set_tag('return_reason', 'could_not_update_state')
-        return
+        return None
 
     # Read the VM server to get the server type
     child_span = opentracing.tracer.start_span('read_vm_server', child_of=span)
-    server = utils.api_read(IAAS.server, vm['server_id'], span=child_span)
+    server = prefetch.read(IAAS.server, vm['server_id'], snapshots, 'server', span=child_span)
     child_span.finish()
     if not bool(server):
         logger.error(f'Could not build VM #{vm_id} as its Server was not readable')
         _unresource(vm, span)
         span.set_tag('return_reason', 'server_not_read')
-        return
+        return None
     server_type = server['type']['name']
     # add server details to vm
     vm['server_data'] = server
@@ -186,8 +206,8 @@ def _build_vm(vm_id: int, span: Span):
 
         # Update state to RUNNING in the API
         child_span = opentracing.tracer.start_span('update_to_running', child_of=span)
-        response = IAAS.vm.partial_update(
-            token=Token.get_instance().token,
+        response = utils.api_partial_update(
+            IAAS.vm,
             pk=vm_id,
             data={'state': state.RUNNING},
             span=child_span,
@@ -215,3 +235,4 @@ def _build_vm(vm_id: int, span: Span):
         vm.pop('admin_password', None)
         vm.pop('server_data')
         _unresource(vm, span)
+    return None
@@ -1,16 +1,17 @@
 # stdlib
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 # lib
 import opentracing
 from cloudcix.api.iaas import IAAS
 from jaeger_client import Span
 # local
 import metrics
+import prefetch
 import state
+import transitions
 import utils
 from celery_app import app
-from cloudcix_token import Token
 from email_notifier import EmailNotifier
 from updaters import (
     LinuxVM,
@@ -34,8 +35,8 @@ def _unresource(vm: Dict[str, Any], span: Span):
 
     # Update state to UNRESOURCED in the API
     child_span = opentracing.tracer.start_span('update_to_unresourced', child_of=span)
-    response = IAAS.vm.partial_update(
-        token=Token.get_instance().token,
+    response = utils.api_partial_update(
+        IAAS.vm,
         pk=vm_id,
         data={'state': state.UNRESOURCED},
         span=child_span,
@@ -54,20 +55,20 @@ def _unresource(vm: Dict[str, Any], span: Span):
 
 
 @app.task
-def update_vm(vm_id: int):
+def update_vm(vm_id: int, snapshots: Optional[Dict[str, Any]] = None):
     """
     Helper function that wraps the actual task in a span, meaning we don't have to remember to call .finish
     """
     span = opentracing.tracer.start_span('tasks.update_vm')
     span.set_tag('vm_id', vm_id)
-    _update_vm(vm_id, span)
+    _update_vm(vm_id, span, snapshots)
     span.finish()
 
     # Flush the loggers here so it's not in the span
     utils.flush_logstash()
 
 
-def _update_vm(vm_id: int, span: Span):
+def _update_vm(vm_id: int, span: Span, snapshots: Optional[Dict[str, Any]] = None):
     """
     Task to update the specified vm
     """
@@ -76,7 +77,7 @@ def _update_vm(vm_id: int, span: Span):
 
     # Read the VM
     child_span = opentracing.tracer.start_span('read_vm', child_of=span)
-    vm = utils.api_read(IAAS.vm, vm_id, span=child_span)
+    vm = prefetch.read(IAAS.vm, vm_id, snapshots, 'vm', span=child_span)
     child_span.finish()
 
     # Ensure it is not empty
@@ -106,18 +107,10 @@ def _update_vm(vm_id: int, span: Span):
 
     # If all is well and good here, update the VM state to UPDATING and pass the data to the updater
     child_span = opentracing.tracer.start_span('update_to_updating', child_of=span)
-    response = IAAS.vm.partial_update(
-        token=Token.get_instance().token,
-        pk=vm_id,
-        data={'state': progress_state},
-        span=child_span,
-    )
+    won = transitions.begin(IAAS.vm, vm, progress_state, span=child_span)
     child_span.finish()
 
-    if response.status_code != 200:
-        logger.error(
-            f'Could not update VM #{vm_id} to state {progress_state}.\nResponse: {response.content.decode()}.',
-        )
+    if not won:
         metrics.vm_update_failure()
         span.set_tag('return_reason', 'could_not_update_state')
         return
@@ -154,7 +147,7 @@ def _update_vm(vm_id: int, span: Span):
     if changes:
         # Read the VM server to get the server type
         child_span = opentracing.tracer.start_span('read_vm_server', child_of=span)
-        server = utils.api_read(IAAS.server, vm['server_id'], span=child_span)
+        server = prefetch.read(IAAS.server, vm['server_id'], snapshots, 'server', span=child_span)
         child_span.finish()
         if not bool(server):
             logger.error(f'Could not build VM #{vm_id} as its Server was not readable')
@@ -196,8 +189,8 @@ def _update_vm(vm_id: int, span: Span):
         logger.info(f'Successfully updated VM #{vm_id}.')
         # Update back to RUNNING
         child_span = opentracing.tracer.start_span('update_to_prev_state', child_of=span)
-        response = IAAS.vm.partial_update(
-            token=Token.get_instance().token,
+        response = utils.api_partial_update(
+            IAAS.vm,
             pk=vm_id,
             data={'state': stable_state},
             span=child_span,
@@ -217,8 +210,8 @@ def _update_vm(vm_id: int, span: Span):
             for device in vm['reset_gpus']:
                 device_id = device['id']
                 child_span = opentracing.tracer.start_span('update_to_reset_device', child_of=span)
-                response = IAAS.device.partial_update(
-                    token=Token.get_instance().token,
+                response = utils.api_partial_update(
+                    IAAS.device,
                     pk=device_id,
                     data={'vm_id': None},
                     span=child_span,
@@ -0,0 +1,181 @@
+"""
+Asynchronous delivery of the spans and logstash records of a process.
+
+Finished spans and requests to flush the logstash handlers are put on a bounded in-process queue and handed on by a
+background reporter thread, so a task's worker slot is released as soon as the task returns instead of being held
+while its telemetry is sent. When the queue is full new items are dropped and counted rather than blocking the task.
+The queue is drained, and the tracer closed, when the worker process shuts down.
+"""
+# stdlib
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Optional, Tuple
+# local
+import settings
+
+__all__ = [
+    'drain',
+    'flush_logs',
+    'install_reporter',
+    'QueueReporter',
+    'shutdown',
+    'stats',
+    'submit',
+]
+
+LOGGER = logging.getLogger('robot.telemetry')
+
+_queue: 'queue.Queue[Tuple[str, Callable[[], Any]]]' = queue.Queue(maxsize=settings.TELEMETRY_QUEUE_SIZE)
+_dropped: Counter = Counter()
+_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+# Set while a flush of the logstash handlers is waiting in the queue, so repeated requests are coalesced
+_flush_pending = threading.Event()
+_closed = False
+
+
+def _drain_forever():
+    while True:
+        kind, job = _queue.get()
+        try:
+            job()
+        except Exception:
+            # Kept at debug, a logstash outage would otherwise report itself into the handler that is failing
+            LOGGER.debug(f'Telemetry reporter failed to send a {kind}', exc_info=True)
+        finally:
+            _queue.task_done()
+
+
+def _ensure_thread():
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_drain_forever, name='robot-telemetry', daemon=True)
+            _thread.start()
+
+
+def submit(kind: str, job: Callable[[], Any]) -> bool:
+    """
+    Queue a job for the reporter thread
+    :param kind: What the job sends, e.g. span, used to count drops
+    :param job: The callable that sends it
+    :returns: A flag stating whether the job was queued, False if the queue was full and the job was dropped
+    """
+    _ensure_thread()
+    try:
+        _queue.put_nowait((kind, job))
+    except queue.Full:
+        _dropped[kind] += 1
+        return False
+    return True
+
+
+def _flush_handlers():
+    _flush_pending.clear()
+    for handler in logging.getLogger('robot').handlers:
+        if hasattr(handler, 'flush'):
+            handler.flush()
+
+
+def flush_logs():
+    """
+    Ask the reporter thread to flush the logstash handlers, unless a flush is already waiting
+    """
+    if _flush_pending.is_set():
+        return
+    _flush_pending.set()
+    if not submit('log_flush', _flush_handlers):
+        _flush_pending.clear()
+
+
+class QueueReporter:
+    """
+    Jaeger reporter that hands finished spans to the reporter thread instead of reporting them in the task
+    """
+
+    def __init__(self, reporter: Any):
+        """
+        :param reporter: The reporter created by the tracer config, that the spans are passed on to
+        """
+        self.reporter = reporter
+
+    def report_span(self, span: Any):
+        submit('span', lambda: self.reporter.report_span(span))
+
+    def close(self) -> Any:
+        drain(settings.TELEMETRY_SHUTDOWN_TIMEOUT)
+        return self.reporter.close()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.reporter, name)
+
+
+def install_reporter(tracer: Any):
+    """
+    Route the spans of the tracer through the reporter thread
+    :param tracer: The jaeger tracer initialised for this process
+    """
+    if not isinstance(tracer.reporter, QueueReporter):
+        tracer.reporter = QueueReporter(tracer.reporter)
+
+
+def drain(timeout: float) -> bool:
+    """
+    Wait for everything queued so far to be handed on
+    :param timeout: The maximum number of seconds to wait
+    :returns: A flag stating whether the queue was emptied in time
+    """
+    deadline = time.monotonic() + timeout
+    with _queue.all_tasks_done:
+        while _queue.unfinished_tasks > 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _queue.all_tasks_done.wait(remaining)
+    return True
+
+
+def shutdown(tracer: Optional[Any] = None):
+    """
+    Send everything still queued and close the tracer, called as the process exits
+    :param tracer: The tracer of this process, if one was initialised
+    """
+    global _closed
+    if _closed:
+        return
+    _closed = True
+    if not drain(settings.TELEMETRY_SHUTDOWN_TIMEOUT):
+        LOGGER.warning(f'Exiting with {_queue.qsize()} spans and log flushes still queued')
+    _flush_handlers()
+    if tracer is None:
+        return
+    # The jaeger reporter sends its last batch from its own IO loop and resolves the returned future when it is done
+    sent = threading.Event()
+    tracer.close().add_done_callback(lambda _: sent.set())
+    sent.wait(settings.TELEMETRY_SHUTDOWN_TIMEOUT)
+
+
+def stats() -> Tuple[int, int]:
+    """
+    :returns: The number of jobs waiting in the queue, and the number dropped since the process started because the
+              queue was full
+    """
+    return _queue.qsize(), sum(_dropped.values())
+
+
+def _reset_after_fork():
+    global _queue, _thread, _lock, _flush_pending, _closed
+    # The parent's reporter thread does not exist in the child, and its queue may hold the parent's spans
+    _queue = queue.Queue(maxsize=settings.TELEMETRY_QUEUE_SIZE)
+    _dropped.clear()
+    _thread = None
+    _lock = threading.Lock()
+    _flush_pending = threading.Event()
+    _closed = False
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
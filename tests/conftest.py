@@ -0,0 +1,26 @@
+"""
+Shared setup for the tests.
+
+The modules of Robot are imported from the root of the repository, and import a `settings` module that deployment
+copies from deployment/settings_template.py. If no settings module is installed, the template is loaded in its place so
+the tests run against the default settings.
+"""
+# stdlib
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+if importlib.util.find_spec('settings') is None:
+    spec = importlib.util.spec_from_file_location('settings', os.path.join(ROOT, 'deployment', 'settings_template.py'))
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except ImportError:
+        # The requirements of the template are not installed, so the tests of modules that need settings fail on import
+        pass
+    else:
+        sys.modules['settings'] = module
@@ -0,0 +1,190 @@
+# stdlib
+import json
+# lib
+import pytest
+import requests
+# local
+import api_call
+import settings
+
+
+def response(status: int, body=None) -> requests.Response:
+    result = requests.Response()
+    result.status_code = status
+    result._content = json.dumps(body or {}).encode()
+    return result
+
+
+class FakeClient:
+    """
+    Stands in for a cloudcix client, answering each call with the next of the given outcomes
+    """
+    application = 'iaas'
+    service_uri = 'vm/'
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def _answer(self, method, **kwargs):
+        self.calls.append((method, kwargs))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def read(self, **kwargs):
+        return self._answer('read', **kwargs)
+
+    def list(self, **kwargs):
+        return self._answer('list', **kwargs)
+
+    def create(self, **kwargs):
+        return self._answer('create', **kwargs)
+
+
+class FakeToken:
+
+    def __init__(self):
+        self.token = 'first'
+        self.expired = []
+
+    def expire(self, stale_token):
+        self.expired.append(stale_token)
+        self.token = 'renewed'
+
+
+@pytest.fixture(autouse=True)
+def setup(monkeypatch):
+    token = FakeToken()
+    monkeypatch.setattr(api_call.Token, 'get_instance', staticmethod(lambda: token))
+    monkeypatch.setattr(api_call.metrics, 'api_request', lambda *args: None)
+    monkeypatch.setattr(api_call.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(settings, 'API_RETRIES', 2)
+    monkeypatch.setattr(settings, 'API_BREAKER_THRESHOLD', 5)
+    monkeypatch.setattr(settings, 'API_BREAKER_COOLDOWN', 30)
+    api_call._breakers.clear()
+    yield token
+    api_call._breakers.clear()
+
+
+def test_read_is_retried_after_a_server_error():
+    client = FakeClient(response(502), response(200))
+    assert api_call.call(client, 'read', pk=1).status_code == 200
+    assert len(client.calls) == 2
+
+
+def test_read_returns_the_last_server_error_once_the_retries_are_spent():
+    client = FakeClient(response(500), response(502), response(503))
+    assert api_call.call(client, 'read', pk=1).status_code == 503
+    assert len(client.calls) == 3
+
+
+def test_list_is_retried_after_a_connection_error():
+    client = FakeClient(requests.ConnectionError(), requests.Timeout(), response(200))
+    assert api_call.call(client, 'list', params={}).status_code == 200
+    assert len(client.calls) == 3
+
+
+def test_read_raises_once_the_retries_are_spent():
+    client = FakeClient(requests.ConnectionError(), requests.ConnectionError(), requests.ConnectionError())
+    with pytest.raises(requests.ConnectionError):
+        api_call.call(client, 'read', pk=1)
+    assert len(client.calls) == 3
+
+
+def test_create_is_not_retried_after_a_server_error():
+    client = FakeClient(response(500), response(200))
+    assert api_call.call(client, 'create', data={}).status_code == 500
+    assert len(client.calls) == 1
+
+
+def test_create_is_not_retried_after_a_timeout():
+    client = FakeClient(requests.Timeout(), response(200))
+    with pytest.raises(requests.Timeout):
+        api_call.call(client, 'create', data={})
+    assert len(client.calls) == 1
+
+
+def test_client_errors_are_not_retried():
+    client = FakeClient(response(404), response(200))
+    assert api_call.call(client, 'read', pk=1).status_code == 404
+    assert len(client.calls) == 1
+
+
+@pytest.mark.parametrize('method', ['read', 'create'])
+def test_expired_token_is_renewed_once(setup, method):
+    expired = response(401, {'detail': 'The token is expired'})
+    client = FakeClient(expired, response(200))
+    assert api_call.call(client, method).status_code == 200
+    assert setup.expired == ['first']
+    assert [kwargs['token'] for _, kwargs in client.calls] == ['first', 'renewed']
+
+
+def test_token_is_not_renewed_twice():
+    expired = response(401, {'detail': 'The token is expired'})
+    client = FakeClient(expired, expired, response(200))
+    assert api_call.call(client, 'read', pk=1).status_code == 401
+    assert len(client.calls) == 2
+
+
+@pytest.mark.parametrize('content', [b'Unauthorized', b'["token is expired"]', b'null'])
+def test_unauthorized_response_without_a_json_object_is_returned(setup, content):
+    unauthorized = response(401)
+    unauthorized._content = content
+    client = FakeClient(unauthorized)
+    assert api_call.call(client, 'read', pk=1).status_code == 401
+    assert setup.expired == []
+
+
+def test_open_circuit_fails_without_sending_the_request(monkeypatch):
+    monkeypatch.setattr(settings, 'API_BREAKER_THRESHOLD', 3)
+    client = FakeClient(*[response(500)] * 3)
+    api_call.call(client, 'read', pk=1)
+    assert len(client.calls) == 3
+
+    blocked = FakeClient(response(200))
+    assert api_call.call(blocked, 'read', pk=1).status_code == 503
+    assert blocked.calls == []
+
+
+class TestCircuitBreaker:
+
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr(api_call.time, 'monotonic', lambda: now[0])
+        return now
+
+    def test_opens_at_the_threshold(self, clock):
+        breaker = api_call.CircuitBreaker(threshold=2, cooldown=10)
+        breaker.failure()
+        assert breaker.allow()
+        breaker.failure()
+        assert not breaker.allow()
+
+    def test_success_closes_the_circuit(self, clock):
+        breaker = api_call.CircuitBreaker(threshold=2, cooldown=10)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        assert breaker.allow()
+
+    def test_lets_one_trial_through_after_the_cooldown(self, clock):
+        breaker = api_call.CircuitBreaker(threshold=1, cooldown=10)
+        breaker.failure()
+        clock[0] += 10
+        assert breaker.allow()
+        # The cooldown restarts for everyone else
+        assert not breaker.allow()
+        breaker.success()
+        assert breaker.allow()
+
+    def test_failed_trial_reopens_the_circuit(self, clock):
+        breaker = api_call.CircuitBreaker(threshold=1, cooldown=10)
+        breaker.failure()
+        clock[0] += 10
+        assert breaker.allow()
+        breaker.failure()
+        clock[0] += 5
+        assert not breaker.allow()
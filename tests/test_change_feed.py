@@ -0,0 +1,55 @@
+# stdlib
+import threading
+import time
+# local
+import change_feed
+import settings
+
+
+def test_local_feed_wakes_when_notified():
+    feed = change_feed.LocalFeed()
+    threading.Timer(0.05, feed.notify).start()
+    started = time.monotonic()
+    assert feed.wait(5)
+    assert time.monotonic() - started < 5
+
+
+def test_local_feed_times_out_without_a_notification():
+    assert not change_feed.LocalFeed().wait(0.01)
+
+
+def test_local_feed_notification_is_consumed_by_one_wait():
+    feed = change_feed.LocalFeed()
+    feed.notify()
+    assert feed.wait(0.01)
+    assert not feed.wait(0.01)
+
+
+def test_polling_feed_waits_out_the_interval(monkeypatch):
+    slept = []
+    monkeypatch.setattr(change_feed.time, 'sleep', slept.append)
+    assert not change_feed.PollingFeed().wait(3)
+    assert slept == [3]
+
+
+def test_get_change_feed(monkeypatch):
+    monkeypatch.setattr(settings, 'CHANGE_FEED', 'amqp')
+    assert isinstance(change_feed.get_change_feed(), change_feed.AMQPFeed)
+    monkeypatch.setattr(settings, 'CHANGE_FEED', 'poll')
+    assert isinstance(change_feed.get_change_feed(), change_feed.PollingFeed)
+    monkeypatch.setattr(settings, 'CHANGE_FEED', 'unknown')
+    assert isinstance(change_feed.get_change_feed(), change_feed.PollingFeed)
+
+
+def test_amqp_feed_falls_back_to_polling_when_the_broker_is_down(monkeypatch):
+    def unreachable():
+        raise ConnectionRefusedError('broker is down')
+
+    slept = []
+    monkeypatch.setattr(change_feed.app, 'connection', unreachable)
+    monkeypatch.setattr(change_feed.time, 'sleep', slept.append)
+    feed = change_feed.AMQPFeed()
+    assert not feed.wait(2)
+    assert len(slept) == 1 and 0 < slept[0] <= 2
+    # The next wait tries to connect again
+    assert feed._connection is None
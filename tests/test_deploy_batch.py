@@ -0,0 +1,84 @@
+# stdlib
+import subprocess
+# lib
+import pytest
+# local
+from mixins.linux import _batch_script, _split_batch_output, CommandResult
+
+SENTINEL = 'ROBOT-BATCH-test'
+
+
+def run_batch(commands, merge_stderr=False):
+    """
+    Run a batch script with the local shell, the way the host runs it, and split its output
+    """
+    process = subprocess.run(
+        ['bash', '-c', _batch_script(SENTINEL, commands)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=False,
+    )
+    return _split_batch_output(SENTINEL, len(commands), process.stdout, process.stderr, merge_stderr)
+
+
+def test_output_and_status_of_each_command():
+    results = run_batch(['echo one', 'echo two; exit 3', 'printf three'])
+    assert results == [
+        CommandResult('one\n', '', 0),
+        CommandResult('two\n', '', 3),
+        CommandResult('three', '', 0),
+    ]
+
+
+def test_stderr_is_kept_apart_by_default():
+    results = run_batch(['echo out; echo err >&2', 'echo other'])
+    assert results == [
+        CommandResult('out\n', 'err\n', 0),
+        CommandResult('other\n', '', 0),
+    ]
+
+
+def test_stderr_is_appended_to_stdout_when_merged():
+    results = run_batch(['echo out; echo err >&2'], merge_stderr=True)
+    assert results == [CommandResult('out\nerr\n', '', 0)]
+
+
+def test_a_failed_command_does_not_stop_the_batch():
+    results = run_batch(['false', 'exit 1', 'echo still here'])
+    assert [result.status for result in results] == [1, 1, 0]
+    assert results[2].stdout == 'still here\n'
+
+
+@pytest.mark.parametrize('command', ['', '\n', '# only a comment'])
+def test_empty_commands_succeed(command):
+    assert run_batch([command, 'echo after']) == [
+        CommandResult('', '', 0),
+        CommandResult('after\n', '', 0),
+    ]
+
+
+def test_multiline_output_and_blank_lines_are_kept():
+    results = run_batch(['printf "a\\n\\nb\\n"'])
+    assert results[0].stdout == 'a\n\nb\n'
+
+
+def test_sentinels_of_another_batch_in_the_output_are_ignored():
+    results = run_batch(["echo 'ROBOT-BATCH-other:END:0:9'", 'echo next'])
+    assert results == [
+        CommandResult('ROBOT-BATCH-other:END:0:9\n', '', 0),
+        CommandResult('next\n', '', 0),
+    ]
+
+
+def test_commands_missing_from_cut_short_output_have_no_status():
+    stdout = (
+        f'{SENTINEL}:BEGIN:0\nfirst\n\n{SENTINEL}:END:0:0\n'
+        f'{SENTINEL}:BEGIN:1\npartial output'
+    )
+    results = _split_batch_output(SENTINEL, 3, stdout, '', merge_stderr=False)
+    assert results == [
+        CommandResult('first\n', '', 0),
+        CommandResult('', '', None),
+        CommandResult('', '', None),
+    ]
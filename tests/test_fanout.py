@@ -0,0 +1,107 @@
+# stdlib
+import threading
+import time
+# lib
+import pytest
+# local
+import fanout
+import settings
+
+
+class Pool:
+    """
+    Stands in for ssh_pool, handing out a client per host after an optional delay, or failing to connect
+    """
+
+    def __init__(self, delays=None, dead=()):
+        self.delays = delays or {}
+        self.dead = set(dead)
+        self.checked_out = []
+        self.checked_in = []
+        self.lock = threading.Lock()
+
+    def checkout(self, host, username):
+        time.sleep(self.delays.get(host, 0))
+        if host in self.dead:
+            raise OSError(f'Could not connect to {host}')
+        with self.lock:
+            self.checked_out.append(host)
+        return f'client-{host}'
+
+    def checkin(self, client):
+        if client is not None:
+            with self.lock:
+                self.checked_in.append(client)
+
+
+@pytest.fixture(autouse=True)
+def setup(monkeypatch):
+    monkeypatch.setattr(settings, 'FANOUT_HEDGE_DELAY', 0.05)
+    fanout._failures.clear()
+    yield
+    fanout._failures.clear()
+
+
+def install(monkeypatch, pool):
+    monkeypatch.setattr(fanout.ssh_pool, 'checkout', pool.checkout)
+    monkeypatch.setattr(fanout.ssh_pool, 'checkin', pool.checkin)
+    return pool
+
+
+def recording(ran, success=lambda host: True):
+    def operation(host, client):
+        ran.append(host)
+        return success(host), f'result-{host}'
+    return operation
+
+
+def wait_for_threads():
+    for thread in threading.enumerate():
+        if thread.name.startswith('fanout-'):
+            thread.join(timeout=5)
+
+
+def test_first_runs_the_operation_on_the_first_host_only(monkeypatch):
+    pool = install(monkeypatch, Pool())
+    ran = []
+    assert fanout.first(['a', 'b', 'c'], 'user', recording(ran)) == ('a', 'result-a')
+    wait_for_threads()
+    assert ran == ['a']
+    assert sorted(pool.checked_in) == sorted(f'client-{host}' for host in pool.checked_out)
+
+
+def test_first_moves_on_from_a_dead_host_and_tries_it_last_next_time(monkeypatch):
+    install(monkeypatch, Pool(dead={'a'}))
+    ran = []
+    assert fanout.first(['a', 'b'], 'user', recording(ran)) == ('b', 'result-b')
+    wait_for_threads()
+    assert fanout.ordered(['a', 'b', 'c']) == ['b', 'c', 'a']
+
+
+def test_first_hedges_a_slow_host(monkeypatch):
+    install(monkeypatch, Pool(delays={'a': 0.5}))
+    ran = []
+    started = time.monotonic()
+    assert fanout.first(['a', 'b'], 'user', recording(ran)) == ('b', 'result-b')
+    assert time.monotonic() - started < 0.5
+    wait_for_threads()
+    # The slow host connected after the operation had succeeded, so the operation was not run on it
+    assert ran == ['b']
+
+
+def test_first_tries_the_next_host_when_the_operation_fails(monkeypatch):
+    install(monkeypatch, Pool())
+    ran = []
+    assert fanout.first(['a', 'b'], 'user', recording(ran, lambda host: host == 'b')) == ('b', 'result-b')
+    assert ran == ['a', 'b']
+
+
+def test_first_returns_none_when_every_host_fails(monkeypatch):
+    install(monkeypatch, Pool(dead={'a'}))
+    ran = []
+    assert fanout.first(['a', 'b'], 'user', recording(ran, lambda host: False)) is None
+    assert ran == ['b']
+
+
+def test_ordered_keeps_the_given_order_for_healthy_hosts():
+    assert fanout.ordered(['c', 'a', 'b']) == ['c', 'a', 'b']
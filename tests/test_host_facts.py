@@ -0,0 +1,91 @@
+# stdlib
+from unittest import mock
+# lib
+import pytest
+# local
+import host_facts
+import settings
+
+HOST = '2001:db8::1'
+VM = '100_420'
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    """
+    Give each test an empty cache of its own
+    """
+    monkeypatch.setattr(settings, 'HOST_FACTS_DB_PATH', str(tmp_path / 'state' / 'host_facts.db'))
+    monkeypatch.setattr(settings, 'HOST_FACTS_TTL', 60)
+    monkeypatch.setattr(settings, 'ROBOT_STATE_DIR', str(tmp_path / 'state'))
+
+
+@pytest.fixture
+def probe(monkeypatch):
+    """
+    Replace the probe of the host, returning the facts of one bridge by default
+    """
+    probe = mock.Mock(return_value={'ceph_secret_uuid': 'uuid', 'bridges': ['1000']})
+    monkeypatch.setattr(host_facts, '_probe', probe)
+    return probe
+
+
+def test_facts_are_probed_once_while_fresh(probe):
+    assert host_facts.get(HOST, mock.Mock()) == {'ceph_secret_uuid': 'uuid', 'bridges': ['1000']}
+    assert host_facts.get(HOST, mock.Mock()) == {'ceph_secret_uuid': 'uuid', 'bridges': ['1000']}
+    assert probe.call_count == 1
+
+
+def test_facts_are_probed_again_once_expired(probe, monkeypatch):
+    host_facts.get(HOST, mock.Mock())
+    monkeypatch.setattr(settings, 'HOST_FACTS_TTL', -1)
+    host_facts.get(HOST, mock.Mock(), refresh=True)
+    host_facts.get(HOST, mock.Mock())
+    assert probe.call_count == 3
+
+
+def test_invalidate_makes_the_next_task_probe_again(probe):
+    host_facts.get(HOST, mock.Mock())
+    host_facts.invalidate(HOST)
+    probe.return_value = {'ceph_secret_uuid': 'uuid', 'bridges': ['1000', '1001']}
+    assert host_facts.get(HOST, mock.Mock())['bridges'] == ['1000', '1001']
+    assert probe.call_count == 2
+
+
+def test_probe_that_ran_across_an_invalidation_is_not_cached(probe):
+    def stale(host_ip, span):
+        # A bridge build finishes while the probe is running
+        host_facts.invalidate(host_ip)
+        return {'ceph_secret_uuid': 'uuid', 'bridges': []}
+
+    probe.side_effect = stale
+    assert host_facts.get(HOST, mock.Mock())['bridges'] == []
+    probe.side_effect = None
+    assert host_facts.get(HOST, mock.Mock())['bridges'] == ['1000']
+    assert probe.call_count == 2
+
+
+def test_drives_are_cached_per_vm(monkeypatch):
+    run = mock.Mock(return_value=('vda /var/lib/libvirt/images/100_420.img\nvdb CLOUDCIX_VOLUMES/100_499\n',))
+    monkeypatch.setattr(host_facts, '_run', run)
+    drives = {'vda': '/var/lib/libvirt/images/100_420.img', 'vdb': 'CLOUDCIX_VOLUMES/100_499'}
+    assert host_facts.drive_map(HOST, VM, mock.Mock()) == drives
+    assert host_facts.drive_map(HOST, VM, mock.Mock()) == drives
+    assert run.call_count == 1
+
+    # Changing the bridges of the host leaves the drives of its VMs alone
+    host_facts.invalidate(HOST)
+    assert host_facts.drive_map(HOST, VM, mock.Mock()) == drives
+    assert run.call_count == 1
+
+    host_facts.invalidate(HOST, VM)
+    host_facts.drive_map(HOST, VM, mock.Mock())
+    assert run.call_count == 2
+
+
+def test_vm_without_drives_is_not_cached(monkeypatch):
+    run = mock.Mock(return_value=('',))
+    monkeypatch.setattr(host_facts, '_run', run)
+    assert host_facts.drive_map(HOST, VM, mock.Mock()) is None
+    assert host_facts.drive_map(HOST, VM, mock.Mock()) is None
+    assert run.call_count == 2
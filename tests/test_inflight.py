@@ -0,0 +1,90 @@
+# stdlib
+import sqlite3
+# lib
+import pytest
+# local
+import inflight
+import settings
+
+
+@pytest.fixture(autouse=True)
+def registry(tmp_path, monkeypatch):
+    """
+    Give each test an empty registry of its own
+    """
+    monkeypatch.setattr(settings, 'INFLIGHT_DB_PATH', str(tmp_path / 'state' / 'inflight.db'))
+    monkeypatch.setattr(settings, 'INFLIGHT_TTL', 60)
+    inflight._reset_after_fork()
+    yield
+    if inflight._connection is not None:
+        inflight._connection.close()
+    inflight._reset_after_fork()
+
+
+def test_claim_is_only_won_once():
+    assert inflight.claim('vm', 1, 'build')
+    assert not inflight.claim('vm', 1, 'build')
+
+
+def test_claims_are_kept_apart_by_type_id_and_action():
+    assert inflight.claim('vm', 1, 'build')
+    assert inflight.claim('vm', 2, 'build')
+    assert inflight.claim('vm', 1, 'update')
+    assert inflight.claim('backup', 1, 'build')
+
+
+def test_release_lets_the_object_be_claimed_again():
+    inflight.claim('vm', 1, 'build')
+    inflight.release('vm', 1, 'build')
+    assert inflight.claim('vm', 1, 'build')
+
+
+def test_release_of_an_unclaimed_entry_does_nothing():
+    inflight.release('vm', 1, 'build')
+    assert inflight.claim('vm', 1, 'build')
+
+
+def test_expired_claim_can_be_taken_over(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(inflight.time, 'time', lambda: now)
+    assert inflight.claim('vm', 1, 'build', ttl=10)
+    now += 5
+    assert not inflight.claim('vm', 1, 'build', ttl=10)
+    now += 10
+    assert inflight.claim('vm', 1, 'build', ttl=10)
+    # The takeover renews the entry
+    assert not inflight.claim('vm', 1, 'build', ttl=10)
+
+
+def test_claims_are_shared_through_the_database():
+    inflight.claim('vm', 1, 'build')
+    # Another process opens its own connection to the same file
+    inflight._reset_after_fork()
+    assert not inflight.claim('vm', 1, 'build')
+
+
+@pytest.mark.parametrize('task_name, args, key', [
+    ('tasks.vm.build.build_vm', (5,), ('vm', 5, 'build')),
+    ('tasks.virtual_router.update.update_virtual_router', [7], ('virtual_router', 7, 'update')),
+    ('tasks.scrub', (), None),
+    ('tasks.vm.build.build_vm', None, None),
+    ('tasks.vm.build.build_vm_anyway', ('request', 'exc', 'traceback'), None),
+])
+def test_task_key(task_name, args, key):
+    assert inflight.task_key(task_name, args) == key
+
+
+def test_release_task_releases_the_entry_of_the_task():
+    inflight.claim('vm', 5, 'build')
+    inflight.release_task('tasks.vm.build.build_vm', (5,))
+    assert inflight.claim('vm', 5, 'build')
+
+
+def test_claim_allows_dispatch_when_the_registry_fails(monkeypatch):
+    def broken():
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(inflight, '_connect', broken)
+    assert inflight.claim('vm', 1, 'build')
+    assert inflight.claim('vm', 1, 'build')
+    inflight.release('vm', 1, 'build')
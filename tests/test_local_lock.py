@@ -0,0 +1,65 @@
+# stdlib
+import threading
+import time
+# lib
+import pytest
+# local
+import settings
+import utils
+
+
+@pytest.fixture(autouse=True)
+def setup(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, 'ROBOT_STATE_DIR', str(tmp_path))
+    monkeypatch.setattr(utils, 'LOCAL_LOCK_POLL_INTERVAL', 0.01)
+
+
+class Holder:
+    """
+    Holds a local lock on another thread until it is released. flock locks belong to the open file, so a second open of
+    the lock file in the same process is excluded like another process would be
+    """
+
+    def __init__(self, name: str):
+        self.acquired = threading.Event()
+        self.release = threading.Event()
+        self.thread = threading.Thread(target=self._hold, args=(name,))
+        self.thread.start()
+        assert self.acquired.wait(5)
+
+    def _hold(self, name: str):
+        with utils.local_lock(name):
+            self.acquired.set()
+            self.release.wait(5)
+
+    def stop(self):
+        self.release.set()
+        self.thread.join(5)
+
+
+def test_lock_that_stays_held_times_out():
+    holder = Holder('virtual_router_1')
+    try:
+        started = time.monotonic()
+        with pytest.raises(utils.LocalLockTimeout):
+            with utils.local_lock('virtual_router_1', timeout=0.1):
+                pytest.fail('Acquired a lock that was held')
+        assert time.monotonic() - started >= 0.1
+    finally:
+        holder.stop()
+
+
+def test_lock_released_within_the_timeout_is_acquired():
+    holder = Holder('virtual_router_1')
+    threading.Timer(0.05, holder.stop).start()
+    with utils.local_lock('virtual_router_1', timeout=5):
+        pass
+
+
+def test_locks_with_different_names_do_not_exclude_each_other():
+    holder = Holder('virtual_router_1')
+    try:
+        with utils.local_lock('virtual_router_2', timeout=0):
+            pass
+    finally:
+        holder.stop()
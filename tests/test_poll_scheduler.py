@@ -0,0 +1,56 @@
+# lib
+import pytest
+# local
+from poll_scheduler import PollScheduler
+
+
+def test_starts_at_the_minimum_interval():
+    scheduler = PollScheduler(0.5, 15, 2)
+    assert scheduler.interval == 0.5
+    assert scheduler.hit_ratio == 0.0
+
+
+def test_miss_backs_off_up_to_the_ceiling():
+    scheduler = PollScheduler(1, 10, 2)
+    intervals = []
+    for _ in range(6):
+        scheduler.miss()
+        intervals.append(scheduler.interval)
+    assert intervals == [2, 4, 8, 10, 10, 10]
+
+
+def test_hit_resets_to_the_minimum_interval():
+    scheduler = PollScheduler(1, 10, 2)
+    scheduler.miss()
+    scheduler.miss()
+    scheduler.hit()
+    assert scheduler.interval == 1
+
+
+def test_ceiling_below_the_minimum_is_raised_to_it():
+    scheduler = PollScheduler(5, 1, 2)
+    scheduler.miss()
+    assert scheduler.interval == 5
+
+
+def test_hit_ratio_covers_the_recent_window():
+    scheduler = PollScheduler(1, 10, 2)
+    for _ in range(PollScheduler.WINDOW):
+        scheduler.miss()
+    scheduler.hit()
+    assert scheduler.hit_ratio == pytest.approx(1 / PollScheduler.WINDOW)
+    scheduler.hit()
+    scheduler.miss()
+    assert scheduler.hit_ratio == pytest.approx(2 / PollScheduler.WINDOW)
+
+
+@pytest.mark.parametrize('min_interval', [0, -1])
+def test_rejects_a_minimum_interval_that_is_not_positive(min_interval):
+    with pytest.raises(ValueError):
+        PollScheduler(min_interval, 10, 2)
+
+
+@pytest.mark.parametrize('backoff', [1, 0.5, 0])
+def test_rejects_a_backoff_that_does_not_grow_the_interval(backoff):
+    with pytest.raises(ValueError):
+        PollScheduler(1, 10, backoff)
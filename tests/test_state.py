@@ -0,0 +1,74 @@
+# lib
+import pytest
+# local
+import state
+
+
+@pytest.mark.parametrize('current, target', [
+    (state.REQUESTED, state.BUILDING),
+    (state.BUILDING, state.RUNNING),
+    (state.QUIESCE, state.QUIESCING),
+    (state.RESTART, state.RESTARTING),
+    (state.RUNNING_UPDATE, state.RUNNING_UPDATING),
+    (state.QUIESCED_UPDATING, state.QUIESCED),
+    (state.SCRUB, state.SCRUB_PREP),
+    (state.SCRUB, state.SCRUBBING),
+    (state.SCRUB_QUEUE, state.SCRUBBING),
+    (state.SCRUBBING, state.CLOSED),
+])
+def test_legal_transitions(current, target):
+    assert state.is_legal(current, target)
+
+
+@pytest.mark.parametrize('current, target', [
+    # Already moved on by another worker
+    (state.BUILDING, state.BUILDING),
+    (state.RUNNING, state.BUILDING),
+    # Skipping the in-progress state
+    (state.REQUESTED, state.RUNNING),
+    (state.SCRUB, state.CLOSED),
+    # Backwards
+    (state.CLOSED, state.SCRUBBING),
+    (state.QUIESCED, state.QUIESCING),
+    # Unknown states
+    (-1, state.BUILDING),
+    (state.REQUESTED, -1),
+])
+def test_illegal_transitions(current, target):
+    assert not state.is_legal(current, target)
+
+
+def test_every_state_in_the_transitions_has_a_name():
+    for current, targets in state.TRANSITIONS.items():
+        assert current in state.STATE_NAMES
+        for target in targets:
+            assert target in state.STATE_NAMES
+
+
+def test_every_state_robot_acts_in_can_be_unresourced():
+    for current in state.TRANSITIONS:
+        assert state.is_legal(current, state.UNRESOURCED)
+
+
+def test_only_the_scrub_queue_is_picked_up_from_a_stable_state():
+    picked_up = [stable for stable in state.STABLE_STATES if stable in state.TRANSITIONS]
+    assert picked_up == [state.SCRUB_QUEUE]
+
+
+@pytest.mark.parametrize('filters', [
+    state.BUILD_FILTERS,
+    state.QUIESCE_FILTERS,
+    state.RESTART_FILTERS,
+    state.SCRUB_FILTERS,
+    state.UPDATE_FILTERS,
+])
+def test_robot_can_move_objects_out_of_the_states_it_picks_them_up_in(filters):
+    for source in filters:
+        assert len(set(state.TRANSITIONS[source]) - {state.UNRESOURCED}) > 0
+
+
+def test_in_progress_states_lead_out_of_progress():
+    for progress in state.IN_PROGRESS_FILTERS:
+        targets = set(state.TRANSITIONS[progress]) - {state.UNRESOURCED}
+        assert len(targets) > 0
+        assert not targets & set(state.IN_PROGRESS_FILTERS)
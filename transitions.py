@@ -0,0 +1,82 @@
+"""
+Guarded state transitions for the objects that the tasks act on.
+
+The API has no conditional update, so a transition into an in-progress state is guarded instead. The transition must
+be legal according to state.TRANSITIONS, and the worker must win a short lived claim on the transition in the in flight
+registry before it sends the update. Two workers that both read an object in its requested state can then no longer
+both move it on and both do the work.
+
+The in flight registry is a file in the local state directory, so the guard only keeps apart the workers of one Robot
+host. That covers every worker of a region while the mainloop and all of the workers run in the one container under
+supervisord. Workers on different hosts are not guarded against each other, as the API gives no way to make the update
+conditional on the state it was read in.
+
+The claims won by a task are released by `end` once the task has finished, whether or not its phase succeeded, so a
+new request for the same object is not turned away while the claim would otherwise still be live.
+"""
+# stdlib
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+# lib
+from cloudcix.client import Client
+from jaeger_client import Span
+# local
+import inflight
+import settings
+import state
+import utils
+
+__all__ = [
+    'begin',
+    'end',
+]
+
+LOGGER = logging.getLogger('robot.transitions')
+
+# The claims won by the task that is currently running in this process
+_claims: List[Tuple[str, int, str]] = []
+
+
+def begin(client: Client, obj: Dict[str, Any], target: int, span: Optional[Span] = None) -> bool:
+    """
+    Move an object into the in-progress state of a phase, if this worker is the one on this host that should do the work
+    :param client: The client of the object e.g. IAAS.vm
+    :param obj: The object as read from the API, or from its snapshot
+    :param target: The state to move the object to
+    :param span: The span to pass to the update request
+    :returns: A flag stating whether this worker won the transition and should carry on with the phase
+    """
+    pk = obj['id']
+    client_name = f'{client.application}.{client.service_uri}'
+    current = obj['state']
+    if not state.is_legal(current, target):
+        LOGGER.warning(
+            f'Not moving {client_name} #{pk} from {state.STATE_NAMES.get(current, current)} to '
+            f'{state.STATE_NAMES[target]}, the transition is not legal.',
+        )
+        return False
+
+    action = f'{state.STATE_NAMES[current]}_to_{state.STATE_NAMES[target]}'
+    if not inflight.claim(client_name, pk, action, ttl=settings.TRANSITION_GUARD_TTL):
+        LOGGER.warning(f'Not moving {client_name} #{pk} to {state.STATE_NAMES[target]}, another worker already is.')
+        return False
+
+    response = utils.api_partial_update(client, pk=pk, data={'state': target}, span=span)
+    if response.status_code != 200:
+        # Let the next dispatch of the object try again
+        inflight.release(client_name, pk, action)
+        LOGGER.error(
+            f'Could not update {client_name} #{pk} to state {state.STATE_NAMES[target]}.\n'
+            f'Response: {response.content.decode()}.',
+        )
+        return False
+    _claims.append((client_name, pk, action))
+    return True
+
+
+def end():
+    """
+    Release the transition claims won by the task that has just finished in this process
+    """
+    while len(_claims) > 0:
+        inflight.release(*_claims.pop())
@@ -96,7 +96,7 @@ class Windows(WindowsMixin):
             # Check the stdout and stderr for messages
             if response.std_out:
                 msg = response.std_out.strip()
-                Windows.logger.debug(f'Backup update command for Backup #{backup_id} generated stdout\n{msg}')
+                Windows.logger.debug('Backup update command for Backup #%s generated stdout\n%s', backup_id, msg)
                 updated = True
             # Check if the error was parsed to ensure we're not logging invalid std_err output
             if response.std_err and '#< CLIXML\r\n' not in response.std_err:
@@ -6,13 +6,12 @@ updater class for linux snapshots
 """
 # stdlib
 import logging
-import socket
 from typing import Any, Dict, Optional
 # lib
 import opentracing
 from jaeger_client import Span
 from netaddr import IPAddress
-from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+from paramiko import SSHException
 # local
 import settings
 import utils
@@ -79,24 +78,15 @@ class Linux(LinuxMixin):
         cmd = utils.JINJA_ENV.get_template('snapshot/kvm/commands/update.j2').render(**template_data)
         child_span.finish()
 
-        Linux.logger.debug(f'Generated Snapshot Update command for Snapshot #{snapshot_id}\n{cmd}')
+        Linux.logger.debug('Generated Snapshot Update command for Snapshot #%s\n%s', snapshot_id, cmd)
 
         # Open a client and run the necessary command on the host
         updated = False
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        client = None
         try:
             # Try connecting to the host and running the necessary commands
-            sock.connect((host_ip, 22))
-            client.connect(
-                hostname=host_ip,
-                username='administrator',
-                pkey=key,
-                timeout=30,
-                sock=sock,
-            )  # No need for password as it should have keys
+            # No need for password as it should have keys
+            client = Linux.open_client(host_ip, 'administrator')
             span.set_tag('host', host_ip)
 
             # Attempt to execute the update command
@@ -107,7 +97,11 @@ class Linux(LinuxMixin):
             child_span.finish()
 
             if stdout:
-                Linux.logger.debug(f'Snapshot Update command for Snapshot #{snapshot_id} generated stdout. \n{stdout}')
+                Linux.logger.debug(
+                    'Snapshot Update command for Snapshot #%s generated stdout. \n%s',
+                    snapshot_id,
+                    stdout,
+                )
                 updated = True
             if stderr:
                 Linux.logger.error(f'Snapshot update command for Snapshot #{snapshot_id} generated stderr. \n{stderr}')
@@ -117,7 +111,7 @@ class Linux(LinuxMixin):
             snapshot_data['errors'].append(f'{error} Error: {err}')
             span.set_tag('failed_reason', 'ssh_error')
         finally:
-            client.close()
+            Linux.release_client(client)
         return updated
 
     @staticmethod
@@ -10,27 +10,33 @@ import json
 import logging
 import os
 import shutil
-import socket
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 # lib
 import opentracing
 from cloudcix.api import IAAS
 from jaeger_client import Span
 from netaddr import IPAddress
-from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+from paramiko import SSHClient, SSHException
 # local
+import api_call
+import host_facts
 import settings
 import state
-from cloudcix_token import Token
 from mixins import LinuxMixin, VMUpdateMixin
-from utils import api_read, JINJA_ENV, get_ceph_pool
+from utils import api_read_many, JINJA_ENV, get_ceph_pool
 
 
 __all__ = [
     'Linux',
 ]
 
+# The Ceph steps of an update are checked for these messages in their output, the other steps fail on any stderr
+CEPH_SUCCESS_MESSAGES = {
+    'ceph_attach': 'CephAttachSuccess',
+    'ceph_detach': 'CephDetachSuccess',
+}
+
 
 class Linux(LinuxMixin, VMUpdateMixin):
     """
@@ -115,188 +121,50 @@ class Linux(LinuxMixin, VMUpdateMixin):
 
         # Open a client and run the necessary commands on the host
         updated = False
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        client = None
         try:
             # Try connecting to the host and running the necessary commands
-            sock.connect((host_ip, 22))
-            client.connect(
-                hostname=host_ip,
-                username='administrator',
-                pkey=key,
-                timeout=30,
-                sock=sock,
-            )  # No need for password as it should have keys
+            # No need for password as it should have keys
+            client = Linux.open_client(host_ip, 'administrator')
             span.set_tag('host', host_ip)
 
             # Attempt to execute the update command
             Linux.logger.debug(f'Executing update command for VM #{vm_id}')
 
-            # First make sure the VM must be in shutdown state. So sending shutdown commands.
-            quiesce = True
+            # First make sure the VM is in shutdown state, as the changes need it. The remaining steps are only sent if
+            # the quiesce command succeeded
             child_span = opentracing.tracer.start_span('generate_quiesce_command', child_of=span)
             cmd = JINJA_ENV.get_template('vm/kvm/commands/quiesce.j2').render(**template_data)
             child_span.finish()
-            Linux.logger.debug(f'Generated VM Quiesce command for VM #{vm_id}\n{cmd}')
+            Linux.logger.debug('Generated VM Quiesce command for VM #%s\n%s', vm_id, cmd)
 
             child_span = opentracing.tracer.start_span('quiesce_vm', child_of=span)
             stdout, stderr = Linux.deploy(cmd, client, child_span)
             child_span.finish()
 
+            success = {'quiesce': True}
             if stdout:
-                Linux.logger.debug(f'VM quiesce command for VM #{vm_id} generated stdout.\n{stdout}')
+                Linux.logger.debug('VM quiesce command for VM #%s generated stdout.\n%s', vm_id, stdout)
             if stderr:
                 Linux.logger.error(f'VM quiesce command for VM #{vm_id} generated stderr.\n{stderr}')
-                quiesce = False
-
-            # CPU changes if any.
-            cpu = True
-            if template_data['changes']['cpu'] and quiesce:
-                child_span = opentracing.tracer.start_span('generate_cpu_command', child_of=span)
-                cmd = JINJA_ENV.get_template('vm/kvm/commands/update/cpu.j2').render(**template_data)
-                child_span.finish()
-                Linux.logger.debug(f'Generated VM CPU update command for VM #{vm_id}\n{cmd}')
-
-                child_span = opentracing.tracer.start_span('update_vm_cpu', child_of=span)
-                stdout, stderr = Linux.deploy(cmd, client, child_span)
-                child_span.finish()
-
-                if stdout:
-                    Linux.logger.debug(f'VM update CPU command for VM #{vm_id} generated stdout.\n{stdout}')
-                if stderr:
-                    Linux.logger.error(f'VM update CPU command for VM #{vm_id} generated stderr.\n{stderr}')
-                    cpu = False
-
-            # Drive changes if any.
-            drive = True
-            if template_data['changes']['storages'] and quiesce:
-                child_span = opentracing.tracer.start_span('generate_drive_command', child_of=span)
-                cmd = JINJA_ENV.get_template('vm/kvm/commands/update/drive.j2').render(**template_data)
-                child_span.finish()
-                Linux.logger.debug(f'Generated VM Drive update command for VM #{vm_id}\n{cmd}')
-
-                child_span = opentracing.tracer.start_span('update_vm_drive', child_of=span)
-                stdout, stderr = Linux.deploy(cmd, client, child_span)
-                child_span.finish()
-
-                if stdout:
-                    Linux.logger.debug(f'VM update Drive command for VM #{vm_id} generated stdout.\n{stdout}')
-                if stderr:
-                    Linux.logger.error(f'VM update Drive command for VM #{vm_id} generated stderr.\n{stderr}')
-                    drive = False
-
-            # GPU changes if any.
-            gpu = True
-            if template_data['changes']['gpu'] and quiesce:
-                child_span = opentracing.tracer.start_span('generate_gpu_command', child_of=span)
-                cmd = JINJA_ENV.get_template('vm/kvm/commands/update/gpu.j2').render(**template_data)
-                child_span.finish()
-                Linux.logger.debug(f'Generated VM GPU update command for VM #{vm_id}\n{cmd}')
-
-                child_span = opentracing.tracer.start_span('update_vm_gpu', child_of=span)
-                stdout, stderr = Linux.deploy(cmd, client, child_span)
-                child_span.finish()
-
-                if stdout:
-                    Linux.logger.debug(f'VM update GPU command for VM #{vm_id} generated stdout.\n{stdout}')
-                if stderr:
-                    Linux.logger.error(f'VM update GPU command for VM #{vm_id} generated stderr.\n{stderr}')
-                    gpu = False
-
-            # RAM changes if any.
-            ram = True
-            if template_data['changes']['ram'] and quiesce:
-                child_span = opentracing.tracer.start_span('generate_ram_command', child_of=span)
-                cmd = JINJA_ENV.get_template('vm/kvm/commands/update/ram.j2').render(**template_data)
-                child_span.finish()
-                Linux.logger.debug(f'Generated VM RAM update command for VM #{vm_id}\n{cmd}')
+                success['quiesce'] = False
 
-                child_span = opentracing.tracer.start_span('update_vm_ram', child_of=span)
-                stdout, stderr = Linux.deploy(cmd, client, child_span)
-                child_span.finish()
-
-                if stdout:
-                    Linux.logger.debug(f'VM update RAM command for VM #{vm_id} generated stdout.\n{stdout}')
-                if stderr:
-                    Linux.logger.error(f'VM update RAM command for VM #{vm_id} generated stderr.\n{stderr}')
-                    ram = False
-
-            # Ceph changes
-            ceph_detach = True
-            if template_data['changes']['ceph_detach'] and quiesce:
+            if success['quiesce']:
+                success.update(Linux._update_quiesced(vm_id, template_data, client, span))
                 for ceph in template_data['changes']['ceph_detach']:
-                    if ceph['target_name'] is not None:
-                        child_span = opentracing.tracer.start_span('generate_detach_command', child_of=span)
-                        cmd = JINJA_ENV.get_template('vm/kvm/commands/update/ceph_detach.j2').render(
-                            target_name=ceph['target_name'],
-                            **template_data,
-                        )
-                        child_span.finish()
-                        Linux.logger.debug(f'Generated VM Ceph detach command for VM #{vm_id}\n{cmd}')
-
-                        child_span = opentracing.tracer.start_span('ceph_detach', child_of=span)
-                        stdout, stderr = Linux.deploy(cmd, client, child_span)
-                        child_span.finish()
-
-                        if stdout:
-                            Linux.logger.debug(f'VM Ceph Detach command for VM #{vm_id} generated stdout.\n{stdout}')
-                        if stderr:
-                            Linux.logger.error(f'VM Ceph Detach command for VM #{vm_id} generated stderr.\n{stderr}')
-                        ceph_detach = ceph_detach and bool(stdout) and ('CephDetachSuccess' in stdout)
                     Linux._detach_resource(ceph['id'])
 
-            ceph_attach = True
-            if template_data['changes']['ceph_attach'] and quiesce:
-                for ceph in template_data['changes']['ceph_attach']:
-                    if ceph['target_name'] is None:
-                        Linux.logger.warning(f'Could not find target name for Ceph #{ceph["id"]}')
-                        continue
-                    child_span = opentracing.tracer.start_span('generate_attach_command', child_of=span)
-                    cmd = JINJA_ENV.get_template('vm/kvm/commands/update/ceph_attach.j2').render(
-                        ceph=ceph,
-                        **template_data,
-                    )
-                    child_span.finish()
-                    Linux.logger.debug(f'Generated VM Ceph attach command for VM #{vm_id}\n{cmd}')
-
-                    child_span = opentracing.tracer.start_span('ceph_attach', child_of=span)
-                    stdout, stderr = Linux.deploy(cmd, client, child_span)
-                    child_span.finish()
-
-                    if stdout:
-                        Linux.logger.debug(f'VM Ceph attach command for VM #{vm_id} generated stdout.\n{stdout}')
-                    if stderr:
-                        Linux.logger.error(f'VM Ceph attach command for VM #{vm_id} generated stderr.\n{stderr}')
-                    ceph_attach = ceph_attach and bool(stdout) and ('CephAttachSuccess' in stdout)
-
-            # Restart the VM if it was in Running state before.
-            restart = True
-            if template_data['restart']:
-                # Also render and deploy the restart_cmd template
-                restart_cmd = JINJA_ENV.get_template('vm/kvm/commands/restart.j2').render(**template_data)
-
-                # Attempt to execute the restart command
-                Linux.logger.debug(f'Executing restart command for VM #{vm_id}')
-                child_span = opentracing.tracer.start_span('restart_vm', child_of=span)
-                stdout, stderr = Linux.deploy(restart_cmd, client, child_span)
-                child_span.finish()
-
-                if stdout:
-                    Linux.logger.debug(f'VM restart command for VM #{vm_id} generated stdout.\n{stdout}')
-                if stderr:
-                    Linux.logger.error(f'VM restart command for VM #{vm_id} generated stderr.\n{stderr}')
-                    restart = False
-
-            updated = all([quiesce, drive, cpu, gpu, ceph_detach, ceph_attach, ram, restart])
+            updated = all(success.values())
         except (OSError, SSHException, TimeoutError) as err:
             error = f'Exception occurred while updating VM #{vm_id} in {host_ip}.'
             Linux.logger.error(error, exc_info=True)
             vm_data['errors'].append(f'{error} Error: {err}')
             span.set_tag('failed_reason', 'ssh_error')
         finally:
-            client.close()
+            Linux.release_client(client)
+            if template_data['drives_changed']:
+                # The drive map of the VM on the host is out of date, whether or not the update succeeded
+                host_facts.invalidate(host_ip, template_data['vm_identifier'])
 
         # remove all the files created in network drive
         if Path(path).is_dir():
@@ -307,6 +175,93 @@ class Linux(LinuxMixin, VMUpdateMixin):
 
         return updated
 
+    @staticmethod
+    def _update_quiesced(
+            vm_id: int,
+            template_data: Dict[str, Any],
+            client: SSHClient,
+            span: Span,
+    ) -> Dict[str, bool]:
+        """
+        Render the update steps for a quiesced VM and send them to the host as one batch, with the restart command, if
+        any, going last
+        :param vm_id: The id of the VM being updated
+        :param template_data: The data for the templates
+        :param client: A client connected to the host of the VM
+        :param span: The tracing span in use for this update task
+        :returns: Whether each kind of step succeeded
+        """
+        steps: List[Tuple[str, str]] = []
+        commands: List[str] = []
+
+        # CPU, Drive, GPU and RAM changes if any.
+        for change, name in (('cpu', 'CPU'), ('storages', 'Drive'), ('gpu', 'GPU'), ('ram', 'RAM')):
+            if not template_data['changes'][change]:
+                continue
+            step = 'drive' if change == 'storages' else change
+            child_span = opentracing.tracer.start_span(f'generate_{step}_command', child_of=span)
+            cmd = JINJA_ENV.get_template(f'vm/kvm/commands/update/{step}.j2').render(**template_data)
+            child_span.finish()
+            Linux.logger.debug('Generated VM %s update command for VM #%s\n%s', name, vm_id, cmd)
+            steps.append((step, f'VM update {name} command'))
+            commands.append(cmd)
+
+        # Ceph changes
+        for ceph in template_data['changes']['ceph_detach']:
+            if ceph['target_name'] is not None:
+                child_span = opentracing.tracer.start_span('generate_detach_command', child_of=span)
+                cmd = JINJA_ENV.get_template('vm/kvm/commands/update/ceph_detach.j2').render(
+                    target_name=ceph['target_name'],
+                    **template_data,
+                )
+                child_span.finish()
+                Linux.logger.debug('Generated VM Ceph detach command for VM #%s\n%s', vm_id, cmd)
+                steps.append(('ceph_detach', 'VM Ceph Detach command'))
+                commands.append(cmd)
+
+        for ceph in template_data['changes']['ceph_attach']:
+            if ceph['target_name'] is None:
+                Linux.logger.warning(f'Could not find target name for Ceph #{ceph["id"]}')
+                continue
+            child_span = opentracing.tracer.start_span('generate_attach_command', child_of=span)
+            cmd = JINJA_ENV.get_template('vm/kvm/commands/update/ceph_attach.j2').render(
+                ceph=ceph,
+                **template_data,
+            )
+            child_span.finish()
+            Linux.logger.debug('Generated VM Ceph attach command for VM #%s\n%s', vm_id, cmd)
+            steps.append(('ceph_attach', 'VM Ceph attach command'))
+            commands.append(cmd)
+
+        # Restart the VM if it was in Running state before.
+        if template_data['restart']:
+            cmd = JINJA_ENV.get_template('vm/kvm/commands/restart.j2').render(**template_data)
+            steps.append(('restart', 'VM restart command'))
+            commands.append(cmd)
+
+        success = {step: True for step, _ in steps}
+        if len(commands) == 0:
+            return success
+        Linux.logger.debug(f'Executing {len(commands)} update commands for VM #{vm_id}')
+        child_span = opentracing.tracer.start_span('update_vm_batch', child_of=span)
+        results = Linux.deploy_batch(commands, client, child_span)
+        child_span.finish()
+
+        for (step, description), (stdout, stderr, status) in zip(steps, results):
+            if status is None:
+                Linux.logger.error(f'{description} for VM #{vm_id} did not report a result')
+                success[step] = False
+                continue
+            if stdout:
+                Linux.logger.debug('%s for VM #%s generated stdout.\n%s', description, vm_id, stdout)
+            if stderr:
+                Linux.logger.error(f'{description} for VM #{vm_id} generated stderr.\n{stderr}')
+            if step in CEPH_SUCCESS_MESSAGES:
+                success[step] = success[step] and CEPH_SUCCESS_MESSAGES[step] in stdout
+            elif stderr:
+                success[step] = False
+        return success
+
     @staticmethod
     def _get_template_data(vm_data: Dict[str, Any], span: Span) -> Optional[Dict[str, Any]]:
         """
@@ -408,20 +363,16 @@ class Linux(LinuxMixin, VMUpdateMixin):
         # Determine restart
         data['restart'] = vm_data['restart']
 
-        # Ceph data
-        data['ceph_secret_uuid'] = Linux._get_ceph_secret_uuid(host_ip, settings.NETWORK_PASSWORD, span)
+        # Ceph data, the secret rarely changes so it comes from the cached facts of the host
+        facts = host_facts.get(host_ip, span)
+        data['ceph_secret_uuid'] = None if facts is None else facts['ceph_secret_uuid']
         data['ceph_monitor_ips'] = settings.CEPH_MONITORS
 
         linked_resources = updates.get('linked_resources', list())
         if len(linked_resources) > 0:
             Linux.logger.debug(f'Processing attached resources for VM #{vm_id}')
             # Get the list of existing drives on the VM
-            drive_target_map = Linux._get_drive_map(
-                host_ip,
-                data['vm_identifier'],
-                settings.NETWORK_PASSWORD,
-                span,
-            )
+            drive_target_map = host_facts.drive_map(host_ip, data['vm_identifier'], span)
             if drive_target_map is None:
                 Linux.logger.warning(f'Could not list drives on VM #{vm_id}. Exiting')
                 return None
@@ -429,10 +380,11 @@ class Linux(LinuxMixin, VMUpdateMixin):
             Linux.logger.debug(f'No linked resources to process for VM #{vm_id}')
             drive_target_map = dict()
 
+        # Read all of the resources to get their specs in one go
+        resources = api_read_many(IAAS.ceph, [r['id'] for r in linked_resources], span=span)
         for r in linked_resources:
             Linux.logger.debug(f'Processing resource #{r["id"]} for VM #{vm_id}')
-            # Read the resource to get its specs
-            resource = api_read(IAAS.ceph, pk=r['id'])
+            resource = resources.get(r['id'])
             if resource is None:
                 Linux.logger.warning(f'Could not read Ceph drive #{r["id"]}')
                 continue
@@ -465,6 +417,7 @@ class Linux(LinuxMixin, VMUpdateMixin):
 
         # Generate drive letters for any new drives
         prefix = 'vd'
+        new_drives = False
         for ceph in data['changes']['ceph_attach']:
             if ceph['target_name'] is not None:
                 continue
@@ -487,80 +440,13 @@ class Linux(LinuxMixin, VMUpdateMixin):
             # Assign the target to the ceph drive
             ceph['target_name'] = target_name
             drive_target_map[target_name] = ceph['source_name']
+            new_drives = True
 
-        return data
-
-    @staticmethod
-    def _get_ceph_secret_uuid(host_ip, host_sudo_passwd, span):
-        client = Linux._get_client(host_ip)
-        if client is None:
-            return None
-
-        cmd = JINJA_ENV.get_template('vm/kvm/commands/get_ceph_secret.j2').render(
-            host_sudo_passwd=host_sudo_passwd,
-        )
-        Linux.logger.debug(f'Generated GetCephSecret command for host {host_ip}')
-
-        child_span = opentracing.tracer.start_span('get_ceph_secret_id', child_of=span)
-        try:
-            stdout, stderr = Linux.deploy(cmd, client, child_span)
-        except SSHException:
-            error = f'Exception occurred while running command on {host_ip}.'
-            Linux.logger.error(error, exc_info=True)
-            span.set_tag('failed_reason', 'ssh_error')
-            stdout = stderr = ''
-        finally:
-            client.close()
-        child_span.finish()
-
-        if stdout:
-            Linux.logger.debug(f'GetCephSecret command for host {host_ip} generated stdout.\n{stdout}')
-        if stderr:
-            Linux.logger.error(f'GetCephSecret command for host {host_ip} generated  stderr.\n{stderr}')
-        return stdout.strip()
-
-    @staticmethod
-    def _get_drive_map(host_ip, vm_id, host_sudo_passwd, span) -> Optional[Dict[str, str]]:
-        client = Linux._get_client(host_ip)
-        if client is None:
-            Linux.logger.error('Could not create ssh client')
-            return None
-
-        cmd = JINJA_ENV.get_template('vm/kvm/commands/list_drives.j2').render(
-            vm_identifier=vm_id,
-            host_sudo_passwd=host_sudo_passwd,
+        # The drive map of the VM changes if its drives are updated, or a Ceph drive is attached or detached
+        data['drives_changed'] = bool(changes['storages']) or new_drives or any(
+            ceph['target_name'] is not None for ceph in changes['ceph_detach']
         )
-        Linux.logger.debug(f'Generated DriveList command for VM #{vm_id}')
-
-        child_span = opentracing.tracer.start_span('list_drives', child_of=span)
-        stdout = stderr = ''
-        try:
-            stdout, stderr = Linux.deploy(cmd, client, span)
-        except SSHException:
-            error = f'Exception occurred while executing command on {host_ip}.'
-            Linux.logger.error(error, exc_info=True)
-            span.set_tag('failed_reason', 'ssh_error')
-        finally:
-            client.close()
-        child_span.finish()
-
-        if stdout:
-            Linux.logger.debug(f'VM DriveList command for VM #{vm_id} generated stdout.\n{stdout}')
-        if stderr:
-            Linux.logger.error(f'VM DriveList command for VM #{vm_id} generated stderr.\n{stderr}')
-
-        drives = dict()
-        # Expect output as lines of `<target_name> <source_name>`. Put the data into a dictionary
-        for line in stdout.strip().split('\n'):
-            if line.find(' ') == -1:
-                Linux.logger.warning(f'Got invalid line from DriveList command\nLine: {line}')
-                continue
-            target, source = line.split(' ')
-            drives[target] = source
-        # There should be at least one fs drive returned. If not, something went wrong
-        if not drives:
-            return None
-        return drives
+        return data
 
     @staticmethod
     def _generate_network_drive_files(vm_data: Dict[str, Any], template_data: Dict[str, Any], path: str) -> bool:
@@ -591,7 +477,7 @@ class Linux(LinuxMixin, VMUpdateMixin):
             template_name = 'vm/kvm/device/pci_gpu.j2'
             for device in vm_data['gpu_devices']:
                 pci_gpu_data = JINJA_ENV.get_template(template_name).render(device=device['id_on_host'])
-                Linux.logger.debug(f'Generated pci_gpu_{device["id"]}.xml file for VM #{vm_id}\n{pci_gpu_data}')
+                Linux.logger.debug('Generated pci_gpu_%s.xml file for VM #%s\n%s', device["id"], vm_id, pci_gpu_data)
                 pci_gpu_file_path = f'{path}/pci_gpu_{device["id"]}.xml'
                 try:
                     # Attempt to write
@@ -616,7 +502,7 @@ class Linux(LinuxMixin, VMUpdateMixin):
             for ceph in template_data['changes']['ceph_attach']:
                 ceph_data = JINJA_ENV.get_template(template_name).render(ceph=ceph, **template_data)
                 ceph_file_path = f'{path}/ceph_{ceph["identifier"]}.xml'
-                Linux.logger.debug(f'Generated {ceph_file_path} for VM #{vm_id}\n{ceph_data}')
+                Linux.logger.debug('Generated %s for VM #%s\n%s', ceph_file_path, vm_id, ceph_data)
                 try:
                     # Attempt to write
                     with open(ceph_file_path, 'w') as f:
@@ -633,33 +519,11 @@ class Linux(LinuxMixin, VMUpdateMixin):
         # Return True as all was successful
         return True
 
-    @staticmethod
-    def _get_client(host_ip: str) -> Optional[SSHClient]:
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        key = RSAKey.from_private_key_file('/root/.ssh/id_rsa')
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-        try:
-            # Try connecting to the host
-            sock.connect((host_ip, 22))
-            client.connect(
-                hostname=host_ip,
-                username='administrator',
-                pkey=key,
-                timeout=30,
-                sock=sock,
-            )
-        except SSHException:
-            error = f'Exception occurred while connecting to {host_ip}.'
-            Linux.logger.error(error, exc_info=True)
-            client.close()
-            return None
-        return client
-
     @staticmethod
     def _detach_resource(resource_id: int) -> None:
-        response = IAAS.detach.update(
-            token=Token.get_instance().token,
+        response = api_call.call(
+            IAAS.detach,
+            'update',
             resource_id=resource_id,
             pk=None,
         )
@@ -117,7 +117,7 @@ class Windows(WindowsMixin, VMUpdateMixin):
             # Check the stdout and stderr for messages
             if response.std_out:
                 msg = response.std_out.strip()
-                Windows.logger.debug(f'VM update command for VM #{vm_id} generated stdout\n{msg}')
+                Windows.logger.debug('VM update command for VM #%s generated stdout\n%s', vm_id, msg)
                 updated = 'VM Successfully Updated' in msg
             # Check if the error was parsed to ensure we're not logging invalid std_err output
             if response.std_err and '#< CLIXML\r\n' not in response.std_err:
@@ -137,7 +137,7 @@ class Windows(WindowsMixin, VMUpdateMixin):
 
                 if response.std_out:
                     msg = response.std_out.strip()
-                    Windows.logger.debug(f'VM restart command for VM #{vm_id} generated stdout\n{msg}')
+                    Windows.logger.debug('VM restart command for VM #%s generated stdout\n%s', vm_id, msg)
                 # Check if the error was parsed to ensure we're not logging invalid std_err output
                 if response.std_err and '#< CLIXML\r\n' not in response.std_err:
                     msg = response.std_err.strip()
@@ -4,21 +4,29 @@ File containing some utility functions that wrap around various repeatedly used
 # stdlib
 import atexit
 import enum
+import fcntl
 import logging
 import os
+import re
 import subprocess
+import time
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from json import JSONEncoder
-from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
 # lib
 import jinja2
 import netaddr
 from cloudcix.api.iaas import IAAS
 from logstash_async.formatter import LogstashFormatter
 from logstash_async.handler import AsynchronousLogstashHandler
+from requests import Response
 # local
+import api_cache
+import api_call
 import settings
-from cloudcix_token import Token
+import telemetry
 from cloudcix.client import Client
 from settings import (
     LOGSTASH_PORT,
@@ -29,11 +37,17 @@ from settings import (
 
 
 __all__ = [
+    'api_iter',
     'api_list',
+    'api_partial_update',
     'api_read',
+    'api_read_many',
+    'dependency_backoff',
     'flush_logstash',
     'get_current_git_sha',
     'JINJA_ENV',
+    'local_lock',
+    'LocalLockTimeout',
     'setup_root_logger',
     'Targets',
     'write_to_drive',
@@ -45,6 +59,9 @@ JINJA_ENV = jinja2.Environment(
     trim_blocks=True,
 )
 
+# Seconds between attempts to take a local lock that is held by another process
+LOCAL_LOCK_POLL_INTERVAL = 0.1
+
 
 class DequeEncoder(JSONEncoder):
     """
@@ -67,11 +84,24 @@ class DequeEncoder(JSONEncoder):
                 return list(iterable)
 
 
+# Secrets that must never reach logstash, compiled once rather than searched for in every record
+_REDACT_PATTERN = re.compile('|'.join(re.escape(secret) for secret in (NETWORK_PASSWORD,) if secret))
+# The process that the robot logger was last set up in
+_logging_pid: Optional[int] = None
+
+
 def _redact_logs(record: logging.LogRecord) -> bool:
     """
-    Filter out the logs to redact passwords and other sensitive information
+    Filter out the logs to redact passwords and other sensitive information, and cut overly long messages short.
+    Runs only for records that are emitted, and renders any lazy %-style arguments once for the formatter to reuse
     """
-    record.msg = record.msg.replace(NETWORK_PASSWORD, '*' * 16)
+    message = record.getMessage()
+    if _REDACT_PATTERN.pattern:
+        message = _REDACT_PATTERN.sub('*' * 16, message)
+    if len(message) > settings.LOG_MAX_LENGTH:
+        message = f'{message[:settings.LOG_MAX_LENGTH]}... [{len(message) - settings.LOG_MAX_LENGTH} characters cut]'
+    record.msg = message
+    record.args = ()
     return True
 
 
@@ -79,8 +109,14 @@ def setup_root_logger():
     """
     Called at startup.
     Sets up the proper handlers on the root logger which allows all other loggers to propogate messages to it
-    instead of having that old bad system
+    instead of having that old bad system.
+    Only does any work the first time it is called in each process
     """
+    global _logging_pid
+    if _logging_pid == os.getpid():
+        return
+    _logging_pid = os.getpid()
+
     # Add null handler to root logger to avoid basicConfig from running
     logging.getLogger().handlers = []
 
@@ -97,9 +133,8 @@ def setup_root_logger():
     logstash_handler.setFormatter(logstash_fmt)
     logger.addHandler(logstash_handler)
 
-    # Add the redact filter
+    # Add the redact filter. On the handler it covers the records of every robot.* logger, not only this one
     logstash_handler.addFilter(_redact_logs)
-    logger.addFilter(_redact_logs)
 
     # At exit, flush all logs to logstash
     atexit.register(logstash_handler.flush)
@@ -119,11 +154,9 @@ def get_current_git_sha() -> str:
 
 def flush_logstash():
     """
-    helper method to flush the logstash handler
+    helper method to flush the logstash handler, from the telemetry reporter thread so the caller does not wait on it
     """
-    for handler in logging.getLogger('robot').handlers:
-        if hasattr(handler, 'flush'):
-            handler.flush()
+    telemetry.flush_logs()
 
 
 # Methods that wrap cloudcix clients to abstract retrieval and checking
@@ -131,12 +164,18 @@ def flush_logstash():
 # However, we only replace the list and read method, since wrapping update and delete didn't really affect the code
 # make request -> check status code / call ro.update -> check flag
 
-def api_list(client: Client, params: Dict[str, Any], **kwargs) -> Deque[Dict[str, Any]]:
+def api_list(
+        client: Client,
+        params: Dict[str, Any],
+        workers: Optional[int] = None,
+        **kwargs,
+) -> Deque[Dict[str, Any]]:
     """
     Calls the list command on the supplied client, using the supplied parameters and kwargs and fetches all of the data
     that matches.
     :param client: The client to call the list method on
     :param params: List parameters to be sent in the request
+    :param workers: The number of pages to fetch at the same time. Defaults to settings.API_LIST_WORKERS
     :param kwargs: Any extra kwargs to pass to the request (ie spans)
     :returns: A list of instances of the client, if the request is valid, else an empty list
     """
@@ -144,20 +183,18 @@ def api_list(client: Client, params: Dict[str, Any], **kwargs) -> Deque[Dict[str
     client_name = f'{client.application}.{client.service_uri}'
     logger.debug(f'Attempting to retrieve a list of {client_name} records with the following filters: {params}')
 
+    cache_key = api_cache.key_for(client, params)
+    if cache_key is not None:
+        cached = api_cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f'Using cached list of {client_name} records with the following filters: {params}')
+            return cached
+
     # Set up necessary stuff for fetching all of the items for the params
     params['page'] = 0
     objects: Deque[Dict[str, Any]] = deque()
 
-    response = client.list(
-        token=Token.get_instance().token,
-        params=params,
-        **kwargs,
-    )
-    # Token expire error "detail":"JWT token is expired. Please login again."
-    if response.status_code == 401 and 'token is expired' in response.json()['detail']:
-        # try again to list as Token renews in response call
-        return api_list(client, params)
-
+    response = api_call.call(client, 'list', params=params, **kwargs)
     if response.status_code != 200:
         logger.error(
             f'HTTP {response.status_code} error occurred when attempting to fetch {client_name} instances with '
@@ -176,26 +213,99 @@ def api_list(client: Client, params: Dict[str, Any], **kwargs) -> Deque[Dict[str
     )
     logger.debug(f'{client_name}.list retrieved {total_records} records with the following filters: {params}')
 
-    # Go fetch the rest of the objects
-    while len(objects) < total_records:
-        params['page'] += 1
-        response = client.list(
-            token=Token.get_instance().token,
-            params=params,
-            **kwargs,
-        )
-        # Token expire error "detail":"JWT token is expired. Please login again." so expect renew in next request.
-        if response.status_code == 401 and 'token is expired' in response.json()['detail']:
-            response.json()['content'] = []
+    # Go fetch the rest of the objects, the pages after the first are requested in parallel
+    page_size = len(objects)
+    if page_size == 0 or page_size >= total_records:
+        if cache_key is not None:
+            api_cache.put(cache_key, objects)
+        return objects
+    pages = range(1, -(-total_records // page_size))
+
+    def fetch_page(page: int):
+        page_params = dict(params, page=page)
+        return page_params, api_call.call(client, 'list', params=page_params, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=min(workers or settings.API_LIST_WORKERS, len(pages))) as executor:
+        futures = [executor.submit(fetch_page, page) for page in pages]
+        # Reassemble the pages in order, stopping at the first one that failed
+        for future in futures:
+            page_params, response = future.result()
+            if response.status_code != 200:
+                logger.error(
+                    f'HTTP {response.status_code} error occurred when attempting to fetch {client_name} instances '
+                    f'with filters {page_params};\nResponse Text: {response.content.decode()}',
+                )
+                for pending in futures:
+                    pending.cancel()
+                # Return what we have so far
+                return objects
+            objects.extend(response.json()['content'])
+    if cache_key is not None:
+        api_cache.put(cache_key, objects)
+    return objects
+
+
+def api_partial_update(client: Client, pk: int, data: Dict[str, Any], **kwargs) -> Response:
+    """
+    Calls the partial_update command on the supplied client, and drops any cached copies of the object
+    :param client: The client to call the partial_update method on
+    :param pk: The id of the object to update
+    :param data: The fields to update
+    :param kwargs: Any extra kwargs to pass to the request (ie spans)
+    :returns: The response from the API
+    """
+    response = api_call.call(client, 'partial_update', pk=pk, data=data, **kwargs)
+    # Invalidate even if the request failed, the update may still have been applied
+    api_cache.invalidate(client, pk)
+    return response
+
+
+def api_iter(client: Client, params: Dict[str, Any], **kwargs) -> Iterator[Dict[str, Any]]:
+    """
+    Calls the list command on the supplied client like api_list, but yields the records page by page instead of
+    collecting them all first. The next page is fetched in the background while the current one is being consumed.
+    :param client: The client to call the list method on
+    :param params: List parameters to be sent in the request
+    :param kwargs: Any extra kwargs to pass to the request (ie spans)
+    :returns: A generator of instances of the client, which stops early if a request fails
+    """
+    logger = logging.getLogger('robot.utils.api_iter')
+    client_name = f'{client.application}.{client.service_uri}'
+    logger.debug(f'Attempting to iterate over {client_name} records with the following filters: {params}')
+
+    def fetch_page(page: int):
+        page_params = dict(params, page=page)
+        response = api_call.call(client, 'list', params=page_params, **kwargs)
         if response.status_code != 200:
             logger.error(
                 f'HTTP {response.status_code} error occurred when attempting to fetch {client_name} instances with '
-                f'filters {params};\nResponse Text: {response.content.decode()}',
+                f'filters {page_params};\nResponse Text: {response.content.decode()}',
             )
-            # Return what we have so fa
-            return objects
-        objects.extend(response.json()['content'])
-    return objects
+            return None
+        return response.json()
+
+    response_data = fetch_page(0)
+    if response_data is None:
+        return
+    total_records: int = response_data['_metadata']['total_records']
+    logger.debug(f'{client_name}.list found {total_records} records with the following filters: {params}')
+
+    fetched = 0
+    page = 0
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while True:
+            content = response_data['content']
+            fetched += len(content)
+            next_page = None
+            if len(content) > 0 and fetched < total_records:
+                page += 1
+                next_page = executor.submit(fetch_page, page)
+            yield from content
+            if next_page is None:
+                return
+            response_data = next_page.result()
+            if response_data is None:
+                return
 
 
 def api_read(client: Client, pk: int, **kwargs) -> Dict[str, Any]:
@@ -210,18 +320,19 @@ def api_read(client: Client, pk: int, **kwargs) -> Dict[str, Any]:
     logger = logging.getLogger('robot.utils.api_read')
     client_name = f'{client.application}.{client.service_uri}'
     logger.debug(f'Attempting to read {client_name} #{pk}')
-    response = client.read(
-        token=Token.get_instance().token,
-        pk=pk,
-        **kwargs,
-    )
-    # Token expire error "detail":"JWT token is expired. Please login again."
-    if response.status_code == 401 and 'token is expired' in response.json()['detail']:
-        # try again to list as Token renews in response call
-        return api_read(client, pk)
 
+    cache_key = api_cache.key_for(client, pk)
+    if cache_key is not None:
+        cached = api_cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f'Using cached copy of {client_name} #{pk}')
+            return cached
+
+    response = api_call.call(client, 'read', pk=pk, **kwargs)
     if response.status_code == 200:
         obj = response.json()['content']
+        if cache_key is not None:
+            api_cache.put(cache_key, obj)
     else:
         logger.error(
             f'HTTP {response.status_code} error occurred when attempting to fetch {client_name} #{pk};\n'
@@ -230,6 +341,25 @@ def api_read(client: Client, pk: int, **kwargs) -> Dict[str, Any]:
     return obj
 
 
+def api_read_many(client: Client, ids: Iterable[int], **kwargs) -> Dict[int, Dict[str, Any]]:
+    """
+    Fetches several instances of the supplied client with list requests filtered on id, instead of one read each.
+    The ids are sent in chunks of API_READ_MANY_CHUNK to keep the query strings within the limits of the API.
+    :param client: The client to call the list method on
+    :param ids: The ids of the objects to read
+    :param kwargs: Any extra kwargs to pass to the request (ie spans)
+    :returns: The instances that were found, keyed by id. Ids that could not be fetched are left out
+    """
+    pks = list(dict.fromkeys(ids))
+    objects: Dict[int, Dict[str, Any]] = {}
+    for start in range(0, len(pks), settings.API_READ_MANY_CHUNK):
+        chunk = pks[start:start + settings.API_READ_MANY_CHUNK]
+        params = {'search[id__in]': chunk}
+        for obj in api_list(client, params, **kwargs):
+            objects[obj['id']] = obj
+    return objects
+
+
 def write_to_drive(
     conf: str,
     filename: str,
@@ -289,15 +419,61 @@ class Targets(enum.Enum):
         return target
 
 
+class LocalLockTimeout(Exception):
+    """
+    Raised when a local lock could not be acquired within its timeout
+    """
+    pass
+
+
+@contextmanager
+def local_lock(name: str, timeout: Optional[float] = None) -> Iterator[None]:
+    """
+    Exclusive lock shared by every Robot process on this host, backed by a lock file in the local state directory.
+    Unlike ResourceLock it needs no round trips to the lock database, but it only excludes processes on this host. It
+    may be held for a whole task, e.g. the Virtual Router tasks hold one per Virtual Router so that two tasks never act
+    on the same Virtual Router at once.
+    :param name: The name of the lock, processes using the same name exclude each other
+    :param timeout: Seconds to wait for the lock. Waits for as long as it takes if not given
+    :raises LocalLockTimeout: If the lock is still held by another process once the timeout has passed
+    """
+    lock_dir = f'{settings.ROBOT_STATE_DIR}/locks'
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(f'{lock_dir}/{name}.lock', 'w') as lock_file:
+        if timeout is None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        raise LocalLockTimeout(f'Could not acquire local lock {name} within {timeout}s')
+                    time.sleep(LOCAL_LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def dependency_backoff(attempt: int) -> float:
+    """
+    Calculate how long a task waits before checking again on a dependency that is not ready yet. Tasks wait by retrying,
+    which keeps the queue the task was routed to
+    :param attempt: The number of times the task has already been postponed
+    :returns: The delay in seconds, doubling with each attempt up to DEPENDENCY_RETRY_BACKOFF_MAX
+    """
+    return min(settings.DEPENDENCY_RETRY_BACKOFF * 2 ** attempt, settings.DEPENDENCY_RETRY_BACKOFF_MAX)
+
+
 def get_ceph_pool(sku: str) -> Optional[str]:
     return settings.CEPH_POOLS.get(sku.upper())
 
 
 def get_linked_resources(vm_id: int) -> Optional[List[Dict]]:
-    response = IAAS.ceph.list(
-        token=Token.get_instance().token,
-        params={'search[parent_id]': vm_id},
-    )
+    response = api_call.call(IAAS.ceph, 'list', params={'search[parent_id]': vm_id})
     if response.status_code != 200:
         logging.getLogger(__name__ + '.get_linked_resources').error(
             f'Could not list resources attached to VM #{vm_id}',